@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TaxDocument
+from .models import TaxDocument, Job
 
 @admin.register(TaxDocument)
 class TaxDocumentAdmin(admin.ModelAdmin):
@@ -27,4 +27,9 @@ class TaxDocumentAdmin(admin.ModelAdmin):
             'fields': ('uploaded_at',)
         }),
     )
-    
\ No newline at end of file
+    
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'run_after', 'locked_by', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'locked_at', 'finished_at', 'last_error')
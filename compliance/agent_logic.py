@@ -13,8 +13,9 @@ Note: Requires Google Cloud credentials and Vertex AI API access.
 
 import os
 import json
-from google import genai
 from django.conf import settings
+from .genai_clients import get_genai_client
+from .single_flight import coalesce, flight_key
 
 def generate_autonomous_action(doc_text, doc_name):
     """
@@ -24,12 +25,8 @@ def generate_autonomous_action(doc_text, doc_name):
     """
     print(f"[Agent] Autonomously analyzing impact for: {doc_name}...")
     
-    # Initialize Vertex Client
-    client = genai.Client(
-        vertexai=True, 
-        project=settings.DOCAI_PROJECT_ID, 
-        location=os.getenv('VERTEX_LOCATION') or 'us-central1'
-    )
+    # Shared Vertex Client (created once per process)
+    client = get_genai_client(settings.DOCAI_PROJECT_ID, os.getenv('VERTEX_LOCATION') or 'us-central1')
     
     # We only take the first 5000 characters to save tokens/speed
     prompt = f"""You are an autonomous compliance agent for ComplyFlow. 
@@ -79,11 +76,7 @@ def audit_invoice_against_rule(invoice_data, rule_text):
     """
     print(f"[Agent] Auditing invoice against rules...")
     
-    client = genai.Client(
-        vertexai=True, 
-        project=settings.DOCAI_PROJECT_ID, 
-        location=os.getenv('VERTEX_LOCATION') or 'us-central1'
-    )
+    client = get_genai_client(settings.DOCAI_PROJECT_ID, os.getenv('VERTEX_LOCATION') or 'us-central1')
     
     # Format entities for the prompt
     entities_summary = ""
@@ -112,13 +105,15 @@ def audit_invoice_against_rule(invoice_data, rule_text):
     """
     
     try:
-        response = client.models.generate_content(
-            model=os.getenv('GEMINI_MODEL') or 'gemini-2.0-flash',
+        # Identical audits running at the same time (same invoice data, same rule) share one call
+        model = os.getenv('GEMINI_MODEL') or 'gemini-2.0-flash'
+        response_text = coalesce(flight_key("audit", model, prompt), lambda: client.models.generate_content(
+            model=model,
             contents=prompt,
             config={'response_mime_type': 'application/json'}
-        )
+        ).text)
         
-        result = json.loads(response.text)
+        result = json.loads(response_text)
         return result.get('is_flagged', False), result.get('reason', '')
     except Exception as e:
         print(f"[Agent] Audit Error: {e}")
@@ -0,0 +1,197 @@
+"""
+ComplyFlow - Semantic Answer Cache
+
+Many users ask near-identical questions ("how to claim ITC", "what is RCM"). After
+retrieval, a chat answer is served from the AnswerCacheEntry table when an earlier
+question was asked with the same profession, the same discussDoc scope, exactly the
+same retrieved chunks (rank order included) and the same notification context (the
+agent's action draft and impact level, which the notification pipeline may rewrite),
+and its embedding is within ANSWER_CACHE_SIMILARITY (cosine) of the new question.
+Generation is skipped entirely.
+
+Only self-contained questions are cached: no conversation history and no private
+uploaded-document context. A lookup only embeds the question when some entry shares
+its retrieved chunks and no entry has exactly the same question text, so a first ask
+costs no embedding call. Answers found by the identifier fast path (which never
+embeds) are keyed on the exact question alone and stored without an embedding.
+Entries expire after ANSWER_CACHE_TTL seconds, the least recently used are evicted
+beyond ANSWER_CACHE_MAX_ENTRIES, and re-ingesting a source drops every answer built on
+it (invalidate_sources, called by replace_document).
+
+Requires Postgres (pgvector); elsewhere, or with ANSWER_CACHE=false, it is a no-op.
+
+Functions:
+- cache_key: Cache key for a retrieved question, or None if it is not cacheable.
+- lookup / store: Read and write cached answers.
+- invalidate_sources: Drop answers built on the given knowledge-base sources.
+- prune: Delete expired entries and enforce the size cap.
+- answer_cache_stats: Hit/miss counters for this process.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+
+ENABLED = os.getenv("ANSWER_CACHE", "true").lower() != "false"
+# Minimum cosine similarity between the new and the cached question
+SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+PRUNE_EVERY = 100
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "errors": 0}
+_writes_since_prune = 0
+
+def _count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+def is_enabled():
+    return ENABLED and connection.vendor == "postgresql"
+
+def cache_key(message, history, profession, search_results, discuss_doc_name=None, doc_id=None, exact=False,
+              agent_context=""):
+    """
+    Returns the lookup key for this question, its retrieved chunks and the prompt's
+    agent_context, or None when the answer depends on more than that (history, a private
+    document) or nothing was retrieved. exact=True (identifier fast-path results)
+    matches the normalized question text only.
+    """
+    if not is_enabled() or history or doc_id or not search_results:
+        return None
+    chunk_ids = [str(r["id"]) for r in search_results]
+    return {
+        "question": " ".join(message.split()),
+        "profession": profession[:100],
+        "scope": discuss_doc_name or "",
+        "chunk_ids": chunk_ids,
+        "sources": sorted({r.get("source", "Unknown") for r in search_results}),
+        # A rewritten notification draft changes agent_context and so misses old answers
+        "context_hash": hashlib.sha256(json.dumps([chunk_ids, agent_context or ""]).encode("utf-8")).hexdigest(),
+        "exact": exact,
+    }
+
+def _embedding(key):
+    if "embedding" not in key:
+        # Same (cached) embedder as retrieval: usually a memory hit for the question text
+        from .retriever import get_embeddings
+        key["embedding"] = get_embeddings().embed_query(key["question"])
+    return key["embedding"]
+
+def lookup(key):
+    """
+    Returns a cached answer for the key, or None. Candidates share the key's chunks,
+    profession and scope; an identical question is a hit without embedding, and the
+    question is only embedded (for the similarity test) when other candidates exist.
+    """
+    if key is None:
+        return None
+    from pgvector.django import CosineDistance
+    from django.db.models import F
+    from .models import AnswerCacheEntry
+
+    try:
+        candidates = AnswerCacheEntry.objects.filter(
+            context_hash=key["context_hash"], profession=key["profession"], scope=key["scope"],
+            expires_at__gt=timezone.now(),
+        )
+        entry = candidates.filter(question=key["question"]).order_by("-last_used_at").first()
+        distance = 0.0
+        if entry is None and not key["exact"] and candidates.exists():
+            entry = (
+                candidates.filter(embedding__isnull=False)
+                .annotate(distance=CosineDistance("embedding", _embedding(key)))
+                .filter(distance__lte=1 - SIMILARITY)
+                .order_by("distance")
+                .first()
+            )
+            distance = entry.distance if entry is not None else None
+    except Exception as e:
+        _count("errors")
+        print(f"[AnswerCache] Lookup failed: {e}")
+        return None
+    if entry is None:
+        _count("misses")
+        return None
+    AnswerCacheEntry.objects.filter(pk=entry.pk).update(hit_count=F("hit_count") + 1, last_used_at=timezone.now())
+    _count("hits")
+    print(f"[AnswerCache] Hit (distance {distance:.4f}): '{key['question'][:50]}'")
+    return entry.answer
+
+def store(key, answer):
+    """Caches a generated answer under the key."""
+    global _writes_since_prune
+    if key is None or not answer:
+        return
+    from .models import AnswerCacheEntry
+
+    try:
+        # Savepoint: store runs inside coalesce_shared's transaction, which a failed
+        # insert would otherwise leave aborted
+        with transaction.atomic():
+            AnswerCacheEntry.objects.create(
+                question=key["question"],
+                # Exact-keyed entries are never compared by similarity: skip the embedding call
+                embedding=None if key["exact"] else _embedding(key),
+                profession=key["profession"],
+                scope=key["scope"],
+                context_hash=key["context_hash"],
+                chunk_ids=key["chunk_ids"],
+                sources=key["sources"],
+                answer=answer,
+                expires_at=timezone.now() + timedelta(seconds=TTL_SECONDS),
+            )
+    except Exception as e:
+        _count("errors")
+        print(f"[AnswerCache] Store failed: {e}")
+        return
+    _count("stores")
+    with _lock:
+        _writes_since_prune += 1
+        due = _writes_since_prune >= PRUNE_EVERY
+        if due:
+            _writes_since_prune = 0
+    if due:
+        prune()
+
+def prune(max_entries=None):
+    """Deletes expired entries, then the least recently used beyond max_entries. Returns rows deleted."""
+    from .models import AnswerCacheEntry
+
+    deleted, _ = AnswerCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    cap = max_entries or MAX_ENTRIES
+    cutoff = list(AnswerCacheEntry.objects.order_by("-last_used_at").values_list("last_used_at", flat=True)[cap:cap + 1])
+    if cutoff:
+        evicted, _ = AnswerCacheEntry.objects.filter(last_used_at__lte=cutoff[0]).delete()
+        deleted += evicted
+    _count("evictions", deleted)
+    return deleted
+
+def invalidate_sources(sources):
+    """Drops cached answers built on any of the given sources (e.g. a re-ingested circular)."""
+    if not is_enabled() or not sources:
+        return 0
+    from django.db.models import Q
+    from .models import AnswerCacheEntry
+
+    match = Q()
+    for source in sources:
+        match |= Q(sources__contains=[source])
+    deleted, _ = AnswerCacheEntry.objects.filter(match).delete()
+    if deleted:
+        _count("invalidations", deleted)
+        print(f"[AnswerCache] Invalidated {deleted} answers for {', '.join(sources)}")
+    return deleted
+
+def answer_cache_stats():
+    with _lock:
+        data = dict(_counters)
+    lookups = data["hits"] + data["misses"]
+    data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else 0.0
+    data["enabled"] = is_enabled()
+    return data
@@ -1,4 +1,10 @@
+import copy
+import hashlib
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from django.contrib.auth.models import User
 from rest_framework import authentication
 from rest_framework import exceptions
@@ -8,12 +14,99 @@ from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    # Honours Cache-Control on Google's cert endpoint, so certs are fetched about once a day
+    from cachecontrol import CacheControl
+except ImportError:
+    CacheControl = None
+
+# Verified tokens remembered per process (each until its own `exp`)
+TOKEN_CACHE_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_ENTRIES", "10000"))
+# Seconds a cached User is reused before re-reading it from the DB
+USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "300"))
+# Cached tokens are dropped this many seconds before they expire
+EXP_LEEWAY_SECONDS = 30
+
+class _TTLCache:
+    """Thread-safe LRU whose entries each carry an absolute expiry (time.time())."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.time():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_token_cache = _TTLCache(TOKEN_CACHE_ENTRIES)  # sha256(token) -> email
+_user_cache = _TTLCache(TOKEN_CACHE_ENTRIES)   # email -> User
+_transport = None
+_transport_lock = threading.Lock()
+
+def _token_key(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_auth_transport():
+    """Shared google-auth transport: one pooled session, cert responses HTTP-cached."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            import requests as http_requests
+            session = http_requests.Session()
+            if CacheControl is not None:
+                session = CacheControl(session)
+            else:
+                logger.warning("cachecontrol not installed; Google certs are refetched on every verification.")
+            _transport = requests.Request(session=session)
+    return _transport
+
+def forget_user(email):
+    """Drops a memoized User (call after changing the user outside this backend)."""
+    _user_cache.discard(email)
+
+def auth_cache_stats():
+    return {
+        "token_hits": _token_cache.hits,
+        "token_misses": _token_cache.misses,
+        "user_hits": _user_cache.hits,
+        "user_misses": _user_cache.misses,
+    }
+
 class GoogleTokenAuthentication(authentication.BaseAuthentication):
     """
     Custom authentication backend for verifying Google ID tokens.
     
     The frontend sends the Google ID token in the Authorization header:
     Authorization: Bearer <google_id_token>
+
+    A verified token is cached (by sha256) until its `exp`, and the User it maps to is
+    memoized for AUTH_USER_CACHE_TTL seconds, so repeat requests skip both the signature
+    check and the get_or_create.
     """
     def authenticate(self, request):
         auth_header = request.META.get('HTTP_AUTHORIZATION')
@@ -27,6 +120,19 @@ class GoogleTokenAuthentication(authentication.BaseAuthentication):
                 return None
             
             token = parts[1]
+
+            # 0. Fast path: token already verified by this process
+            token_key = _token_key(token)
+            email = _token_cache.get(token_key)
+            if email is not None:
+                user = _user_cache.get(email)
+                if user is None:
+                    user = User.objects.filter(email=email).first()
+                    if user is None:
+                        _token_cache.discard(token_key)
+                        raise exceptions.AuthenticationFailed('User no longer exists.')
+                    _user_cache.put(email, user, time.time() + USER_CACHE_TTL)
+                return (copy.copy(user), token)
             
             # 1. Get Client ID from settings
             # We first check SOCIALACCOUNT_PROVIDERS, then fall back to env/direct setting
@@ -45,7 +151,7 @@ class GoogleTokenAuthentication(authentication.BaseAuthentication):
 
             # 2. Verify with Google
             try:
-                idinfo = id_token.verify_oauth2_token(token, requests.Request(), client_id)
+                idinfo = id_token.verify_oauth2_token(token, get_auth_transport(), client_id)
                 
                 # 3. Validation
                 if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
@@ -95,7 +201,12 @@ class GoogleTokenAuthentication(authentication.BaseAuthentication):
                 if created:
                     logger.info(f"Created new user via Google Login: {email}")
 
-                return (user, token)
+                expires_at = min(float(idinfo.get('exp', 0)) - EXP_LEEWAY_SECONDS, time.time() + 3600)
+                if expires_at > time.time():
+                    _token_cache.put(token_key, email, expires_at)
+                    _user_cache.put(email, user, time.time() + USER_CACHE_TTL)
+
+                return (copy.copy(user), token)
 
             except ValueError as e:
                 # Invalid token
@@ -0,0 +1,436 @@
+"""
+ComplyFlow - Chat Pipeline
+
+The stages of answering a chat message, shared by the JSON endpoint (chat_view) and the
+token-streaming endpoint (chat_stream_view): user context, greeting short-circuit,
+retrieval (identifier fast path, then hybrid search), prompt construction, the
+no-LLM fallback report and saving the exchange to history.
+
+Functions:
+- user_context: The user's profession and optional uploaded-document context.
+- greeting_reply / is_greeting: Canned intro for a bare greeting (no retrieval/LLM).
+- retrieve: Search results, citations and prompt context for a message.
+- search: Coalesced hybrid knowledge-base search.
+- asearch: search() with the query embedded asynchronously (ASGI chat).
+- aprepare: Async user_context + retrieve with all lookups run concurrently.
+- in_thread: sync_to_async on an executor thread that closes its DB connection.
+- build_prompt: The Gemini prompt for a message and its retrieved context.
+- generate_answer: Gemini answer for a prompt (coalesced, answer-cached).
+- fallback_report: Human-readable report of the retrieved provisions (LLM unavailable).
+- save_query: Store the exchange in ComplianceQuery.
+
+Classes:
+- AnswerStream: Incremental FALLBACK_IRRELEVANT handling for streamed answers.
+"""
+
+import logging
+import os
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from .models import TaxDocument, UserProfile, ComplianceQuery, GlobalNotification
+from .genai_clients import get_genai_client
+from .single_flight import acoalesce, coalesce, coalesce_shared, flight_key
+from .metrics import span
+from . import answer_cache
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_MARKER = "FALLBACK_IRRELEVANT"
+IRRELEVANT_REPLY = "I am a compliance assistant dedicated to Indian Tax and Law. I'm afraid I can't help with that specific query."
+
+def _profession(profile):
+    return profile.profession if profile is not None and profile.profession else "User"
+
+def _doc_context(doc):
+    if doc is None:
+        return ""
+    return (
+        f"\n\nDOCUMENT CONTEXT:\nFilename: {doc.original_filename}\n"
+        f"AI Verdict: {doc.get_status_display()}\nIssues: {doc.flag_reason or 'None'}\n"
+        f"Data: {doc.extracted_data or 'Not available'}"
+    )
+
+def user_context(user, doc_id=None):
+    """Returns (user_profession, doc_context) for an authenticated user (or None)."""
+    if user is None:
+        return "User", ""
+    try:
+        profile = user.profile
+    except UserProfile.DoesNotExist:
+        profile = None
+    doc = TaxDocument.objects.filter(id=doc_id, user=user).first() if doc_id else None
+    return _profession(profile), _doc_context(doc)
+
+def is_greeting(message):
+    words = set(message.lower().strip().split())
+    greet_keywords = {"hi", "hello", "hey", "yo", "namaste", "greetings"}
+    return bool(words.intersection(greet_keywords)) and len(words) <= 3
+
+def greeting_reply(message, user_profession):
+    """The intro text when the message is just a greeting, else None."""
+    if is_greeting(message):
+        return (
+            f"Hi! 👋 I'm ComplyFlow, your GST and Indian tax compliance assistant. I see you're working as a {user_profession}.\n\n"
+            "Ask me tax questions and I'll answer strictly from legal documents with citations."
+        )
+    return None
+
+def _search_query(message, history, discuss_doc_name=None):
+    """Expand query if it seems to be a follow-up."""
+    search_query = message
+    reference_pronouns = {"this", "that", "it", "them", "those", "they"}
+    is_follow_up = len(message.split()) < 8 or any(p in message.lower() for p in reference_pronouns)
+
+    if is_follow_up and history and not discuss_doc_name:
+        last_user_msg = next((m['content'] for m in reversed(history) if m['role'] == 'user'), "")
+        if last_user_msg:
+            search_query = f"{last_user_msg} {message}"
+    return search_query
+
+def _agent_context(notif=None, tax_doc=None):
+    """AGENTIC HANDOVER: previous analysis of the discussed notification or uploaded document."""
+    if notif is not None and notif.action_draft:
+        # Case A: Discussing a new discovery from notifications (with an autonomous draft)
+        return f"\nPREVIOUS AGENT ANALYSIS: This document was marked as {notif.impact_level} impact. The agent already drafted this action: {notif.action_draft}\n"
+    if tax_doc is not None and tax_doc.status == 'FLAGGED':
+        # Case B: Discussing a business document from dashboard
+        return f"\nPREVIOUS AUDIT RESULT: This document is currently FLAGGED. Reason: {tax_doc.flag_reason}\n"
+    return ""
+
+def _identifier_results(message, discuss_doc_name=None):
+    """
+    Fast path: a message naming a specific circular/notification is resolved by an
+    indexed metadata lookup, with no embedding call or ANN scan.
+    """
+    from .identifiers import extract_identifiers, document_keys, lookup_by_identifiers
+
+    cited_keys = document_keys(extract_identifiers(message)) if not discuss_doc_name else []
+    if not cited_keys:
+        return []
+    search_results = [
+        {
+            "id": r["id"],
+            "content": r["content"],
+            "source": r["metadata"].get("source", "Unknown"),
+            "category": r["metadata"].get("category", "Unknown"),
+        }
+        for r in lookup_by_identifiers(cited_keys, k=5, query=message)
+    ]
+    print(f"[Chat] Identifier lookup {cited_keys} found {len(search_results)} chunks")
+    return search_results
+
+def search(search_query, filter_metadata=None):
+    """
+    Hybrid search_laws for the chat. Identical searches running at the same time in
+    this worker (e.g. many users opening the same discussDoc) share one call.
+    """
+    from .retriever import search_laws
+
+    key = flight_key("search", search_query, filter_metadata)
+    return coalesce(key, lambda: search_laws(search_query, k=5, filter_metadata=filter_metadata, mode="hybrid"))
+
+async def asearch(search_query, filter_metadata=None):
+    """
+    search() for the async chat: the query is embedded on the event loop (aembed_query,
+    under the embedder's per-loop concurrency cap) and only the database half runs in a
+    thread. Identical searches in flight on this loop share one call.
+    """
+    from .retriever import get_embeddings, search_vector
+
+    async def run():
+        with span("embed_query"):
+            query_vector = await get_embeddings().aembed_query(search_query)
+        return await in_thread(search_vector)(query_vector, search_query, 5, filter_metadata, mode="hybrid")
+
+    return await acoalesce(flight_key("search", search_query, filter_metadata), run)
+
+def _package(search_results, agent_context, identifier_match=False):
+    context = "\n\n".join([
+        f"Source: {r['source']}\nCategory: {r['category']}\nContent: {r['content']}"
+        for r in search_results
+    ])
+
+    citations = [
+        {
+            "id": str(i+1),
+            "section": r.get('category', 'General'),
+            "title": r.get('source', 'Tax Authority'),
+            "content": r.get('content', '')[:300] + "...",
+            "source": r.get('source', 'N/A')
+        }
+        for i, r in enumerate(search_results)
+    ]
+    return {
+        "search_results": search_results,
+        "citations": citations,
+        "context": context,
+        "agent_context": agent_context,
+        # Found by the identifier fast path (no embedding): answer-cached by exact question
+        "identifier_match": identifier_match,
+    }
+
+def retrieve(message, history, discuss_doc_name=None, doc_id=None):
+    """
+    Retrieval Phase with Metadata Filtering. Returns a dict with search_results,
+    citations, context (prompt text) and agent_context. Raises if the knowledge base
+    is unreachable.
+    """
+    filter_metadata = None
+    notif = tax_doc = None
+    if discuss_doc_name:
+        filter_metadata = {"source": discuss_doc_name}
+        print(f"[Chat] Targeted search for document: {discuss_doc_name}")
+        notif = GlobalNotification.objects.filter(doc_name=discuss_doc_name).first()
+    elif doc_id:
+        tax_doc = TaxDocument.objects.filter(id=doc_id).first()
+
+    search_query = _search_query(message, history, discuss_doc_name)
+    search_results = _identifier_results(message, discuss_doc_name)
+    identifier_match = bool(search_results)
+    if not search_results:
+        search_results = search(search_query, filter_metadata)
+        print(f"[Chat] Found {len(search_results)} relevant chunks in knowledge base")
+
+    # If we targeted a doc but found nothing, fallback to general search to be helpful
+    if discuss_doc_name and not search_results:
+        print(f"[Chat] ⚠️ No results for {discuss_doc_name} specifically, falling back to general search")
+        search_results = search(search_query)
+        print(f"[Chat] General fallback found {len(search_results)} chunks")
+
+    return _package(search_results, _agent_context(notif, tax_doc), identifier_match)
+
+def in_thread(fn):
+    """
+    Awaitable fn run on an executor thread (concurrently with the request's other sync
+    work, unlike thread-sensitive sync_to_async). Nothing else ever closes a DB
+    connection such a thread opens, so it is closed when fn returns.
+    """
+    def run(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connection.close()
+    return sync_to_async(run, thread_sensitive=False)
+
+async def aprepare(user, message, history, discuss_doc_name=None, doc_id=None):
+    """
+    Async user_context() + retrieve(): the profile, uploaded document, discussed
+    notification and knowledge-base search are fetched concurrently (async ORM; the
+    search embeds asynchronously and runs its SQL in a thread). For a discussDoc the general search only runs if the
+    targeted one finds nothing, as in retrieve(), so a notification spike does not
+    double the search load. Returns (user_profession, doc_context, retrieval).
+    """
+    import asyncio
+
+    async def nothing():
+        return None
+
+    async def knowledge_base():
+        results = await in_thread(_identifier_results)(message, discuss_doc_name)
+        if results:
+            return results, True
+        if not discuss_doc_name:
+            results = await asearch(search_query)
+            print(f"[Chat] Found {len(results)} relevant chunks in knowledge base")
+            return results, False
+        print(f"[Chat] Targeted search for document: {discuss_doc_name}")
+        results = await asearch(search_query, {"source": discuss_doc_name})
+        if not results:
+            print(f"[Chat] ⚠️ No results for {discuss_doc_name} specifically, falling back to general search")
+            results = await asearch(search_query)
+        return results, False
+
+    search_query = _search_query(message, history, discuss_doc_name)
+    profile, doc, notif, (search_results, identifier_match) = await asyncio.gather(
+        UserProfile.objects.filter(user=user).afirst() if user is not None else nothing(),
+        TaxDocument.objects.filter(id=doc_id).afirst() if doc_id else nothing(),
+        GlobalNotification.objects.filter(doc_name=discuss_doc_name).afirst() if discuss_doc_name else nothing(),
+        knowledge_base(),
+    )
+    # The uploaded document only adds private context for its owner (as in user_context)
+    own_doc = doc if doc is not None and user is not None and doc.user_id == user.id else None
+    agent_context = _agent_context(notif, None if discuss_doc_name else doc)
+    return _profession(profile), _doc_context(own_doc), _package(search_results, agent_context, identifier_match)
+
+def build_prompt(message, history, user_profession, retrieval, doc_context="", discuss_doc_name=None):
+    agent_context = retrieval["agent_context"]
+    context = retrieval["context"]
+
+    # Format conversation history for the prompt
+    history_text = ""
+    for h in history[-6:]: # Include last 3 turns
+        role = "User" if h['role'] == 'user' else "Assistant"
+        history_text += f"{role}: {h['content']}\n"
+
+    prompt = f"""You are an expert tax and Indian laws assistant for ComplyFlow.
+        The user identifies as: {user_profession}.
+        
+        CONVERSATION HISTORY:
+        {history_text}
+        
+        STEP 1: RELEVANCE CHECK
+        Is the CURRENT User Question below related to Indian Tax, GST, Legal Compliance, or Business Regulations?
+        - Use the CONVERSATION HISTORY to resolve any pronouns or context.
+        - If NO (and it is NOT a greeting or thank you), output EXACTLY: "FALLBACK_IRRELEVANT"
+        - If YES (or if it is a simple greeting/gratitude), proceed to STEP 2.
+        
+        STEP 2: GENERATE RESPONSE
+        Answer the CURRENT user's question or acknowledge their message in a professional, human-readable, and actionable manner.
+        - CRITICAL: If "CONTEXT FROM LEGAL DOCUMENTS" is provided below, you MUST use it to answer the question. Do NOT say you don't have the full text if the context contains legal provisions.
+        - {f"NOTE: The user is specifically asking about the document '{discuss_doc_name}'. Focus your summary and analysis on this document." if discuss_doc_name else ""}
+        
+        FORMATTING INSTRUCTIONS:
+        1. Use Markdown headers (`###`) for main sections. ALWAYS put a DOUBLE NEWLINE after the header.
+        2. Use **bolding** for key terms, dates, and section names.
+        3. Use bullet points (`-`) for lists. ALWAYS put a DOUBLE NEWLINE between each bullet point block and the surrounding text.
+        4. STRUCTURE: 
+           ### Summary
+           (3-4 sentences summarizing the situation)
+           
+           ### Compliance Review
+           - Point 1
+           - Point 2
+           
+           ### Conclusion
+           (Direct, actionable advice)
+        5. Use [1], [2] for citations pointing to the sources below.
+        6. CRITICAL: Use DOUBLE NEWLINES (`\n\n`) between EVERY section. 
+        7. NO HTML TAGS: Do NOT use `<br>`, `<b>`, or any other HTML. Strictly use Markdown.
+        
+        PROMPT:
+        {agent_context}
+
+        LEGAL DOCUMENT CONTEXT:
+        {context}
+        {doc_context}
+        
+        CURRENT USER QUESTION: {message}
+        
+        INSTRUCTIONS:
+        1. If it's a question or a request to discuss a document, provide the structured report described above.
+        2. If it's a thank you/greeting, respond politely as a helpful assistant.
+        """
+    return prompt
+
+def generate_answer(prompt, cache_key=None):
+    """
+    Generates the answer text for a prompt (IRRELEVANT_REPLY for off-topic questions)
+    and stores it in the answer cache. Concurrent identical prompts share one Gemini
+    call: within this worker always, and across workers when the answer is cacheable,
+    since followers then read the leader's answer back from the cache. Raises on
+    model errors.
+    """
+    gemini_model = os.getenv('GEMINI_MODEL') or 'gemini-2.0-flash'
+
+    def generate():
+        # Shared Vertex AI client (keep-alive pool, created once per worker)
+        client = get_genai_client(settings.DOCAI_PROJECT_ID, os.getenv('VERTEX_LOCATION') or 'us-central1')
+        with span("gemini"):
+            response = client.models.generate_content(
+                model=gemini_model,
+                contents=prompt
+            )
+        response_text = response.text.strip()
+        if FALLBACK_MARKER in response_text:
+            response_text = IRRELEVANT_REPLY
+        answer_cache.store(cache_key, response_text)
+        return response_text
+
+    key = flight_key("generate", gemini_model, prompt)
+    if cache_key is None:
+        return coalesce(key, generate)
+    return coalesce_shared(key, generate, load=lambda: answer_cache.lookup(cache_key))
+
+def fallback_report(search_results):
+    """FINAL FALLBACK: Structured Human-Readable Report when Vertex AI is unreachable."""
+    if not search_results:
+        return "I'm sorry, I'm currently unable to process your request. Please ensure you are logged in and the connection is stable."
+
+    response_text = "### 🔍 Partial Document Review\n"
+    response_text += "I'm currently having trouble reaching my advanced analysis engine (Vertex AI), but I have retrieved these relevant provisions from your documents:\n\n"
+
+    # Group by source for readability
+    sources = {}
+    for snippet in search_results:
+        src = snippet.get('source') or 'General Provision'
+        if src not in sources:
+            sources[src] = []
+        sources[src].append(snippet.get('content', ''))
+
+    for src, contents in sources.items():
+        response_text += f"**From {src}:**\n"
+        for content in contents:
+            # Clean up and limit content for readability
+            clean_content = content.strip().replace('\n', ' ')
+            if len(clean_content) > 300:
+                clean_content = clean_content[:300] + "..."
+            response_text += f"• {clean_content}\n"
+        response_text += "\n"
+
+    response_text += "---\n*Note: To restore full intelligent summaries, please check API permissions.*"
+    return response_text
+
+def save_query(user, message, response_text, conversation_id=None):
+    """Saves the exchange to history; returns the conversation_id used (None if anonymous)."""
+    if user is None:
+        return None
+    try:
+        # If conversation_id wasn't provided, the model default (uuid.uuid4) starts a new session
+        data_to_save = {
+            "user": user,
+            "query": message,
+            "response": response_text
+        }
+        if conversation_id:
+            data_to_save["conversation_id"] = conversation_id
+
+        new_query = ComplianceQuery.objects.create(**data_to_save)
+        return new_query.conversation_id
+    except Exception as save_err:
+        logger.error(f"Failed to save query history: {str(save_err)}")
+        return conversation_id
+
+class AnswerStream:
+    """
+    Turns streamed model text into client-visible text. The model answers EXACTLY
+    FALLBACK_IRRELEVANT for off-topic questions, so leading text that could still be
+    that marker is held back; once it is ruled out, text passes straight through.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.irrelevant = False
+        self._pending = ""
+        self._decided = False
+
+    def feed(self, text):
+        """Returns the text to send now ('' while undecided or once irrelevant)."""
+        if not text or self.irrelevant:
+            return ""
+        self.parts.append(text)
+        if self._decided:
+            return text
+        self._pending += text
+        head = self._pending.lstrip()
+        if head.startswith(FALLBACK_MARKER):
+            self.irrelevant = True
+            return ""
+        if FALLBACK_MARKER.startswith(head):
+            return ""
+        self._decided = True
+        out, self._pending = self._pending, ""
+        return out
+
+    def finish(self):
+        """Returns (final_text, replaced): replaced is True if what was streamed must be discarded."""
+        full = "".join(self.parts).strip()
+        if self.irrelevant or FALLBACK_MARKER in full:
+            return IRRELEVANT_REPLY, True
+        return full, False
+
+    def flush(self):
+        """Held-back text (a short answer that turned out not to be the marker)."""
+        out, self._pending = ("" if self.irrelevant else self._pending), ""
+        self._decided = True
+        return out
@@ -0,0 +1,300 @@
+"""
+ComplyFlow - Embedding Cache
+
+This module puts a content-addressed cache in front of VertexEmbeddings so that text
+which has already been embedded (an unchanged circular, a re-audited invoice, a repeated
+chat query) never costs another Vertex call.
+
+Entries are keyed by (model, sha256 of the text) and looked up in two tiers:
+1. An in-process LRU shared by every CachedEmbeddings instance in the worker.
+2. The EmbeddingCacheEntry Postgres table, shared by all workers and ingestion runs.
+
+Configuration (environment variables):
+- EMBEDDING_CACHE_MEMORY_ENTRIES: LRU capacity per process (default 4096).
+- EMBEDDING_CACHE_DB_MAX_ENTRIES: rows kept in Postgres before least-recently-used
+  rows are evicted (default 500000).
+- EMBEDDING_CACHE_DB: set to "false" to disable the Postgres tier.
+
+A Postgres hit only refreshes the row's last_used_at when it is older than
+TOUCH_INTERVAL (a day), so a hot chat query does not cost an UPDATE on every lookup;
+the LRU order is kept to that resolution.
+
+With GENAI_BACKEND = 'fake' the wrapped embedder is fake_backends.FakeEmbeddings,
+cached under its own "fake:" model key.
+
+Classes:
+- CachedEmbeddings: Drop-in embeddings wrapper with embed_query() / embed_documents()
+  and their async counterparts aembed_query() / aembed_documents().
+
+Functions:
+- get_cached_embeddings: Process-wide cached embedder for a given model.
+- embedding_cache_stats: Hit/miss/eviction counters for monitoring.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+from .vertex_embeddings import VertexEmbeddings
+
+CacheKey = Tuple[str, str]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "db_evictions": 0,
+            "db_errors": 0,
+        }
+
+    def add(self, name: str, amount: int = 1):
+        if amount:
+            with self._lock:
+                self.values[name] += amount
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            data = dict(self.values)
+        lookups = data["memory_hits"] + data["db_hits"] + data["misses"]
+        data["hit_rate"] = round((data["memory_hits"] + data["db_hits"]) / lookups, 4) if lookups else 0.0
+        return data
+
+
+class _MemoryLRU:
+    """Thread-safe LRU of vectors keyed by (model, text_hash)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[CacheKey, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is not None:
+                self._data.move_to_end(key)
+            return vector
+
+    def put(self, key: CacheKey, vector: List[float]) -> int:
+        """Stores a vector and returns how many entries were evicted to make room."""
+        evicted = 0
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_counters = _Counters()
+_memory = _MemoryLRU(max(1, int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096"))))
+
+
+class CachedEmbeddings:
+    """
+    Wraps an embedder (normally VertexEmbeddings) with the memory and Postgres cache tiers.
+    Exposes the same embed_query() / embed_documents() interface LangChain expects.
+    """
+
+    # Run the Postgres eviction pass after this many new rows have been written
+    PRUNE_EVERY = 1000
+    # A hit only rewrites last_used_at when it is older than this
+    TOUCH_INTERVAL = timedelta(days=1)
+    PRUNE_BATCH = 1000
+
+    def __init__(self, embedder, use_db: Optional[bool] = None, max_db_entries: Optional[int] = None):
+        self.embedder = embedder
+        self.model = getattr(embedder, "model", embedder.__class__.__name__)
+        if use_db is None:
+            use_db = os.getenv("EMBEDDING_CACHE_DB", "true").lower() != "false"
+        self.use_db = use_db
+        self.max_db_entries = max_db_entries or int(os.getenv("EMBEDDING_CACHE_DB_MAX_ENTRIES", "500000"))
+        self._writes_since_prune = 0
+
+    # --- Postgres tier ---
+
+    def _db_get(self, hashes: List[str]) -> Dict[str, List[float]]:
+        if not self.use_db or not hashes:
+            return {}
+        try:
+            from django.utils import timezone
+            from .models import EmbeddingCacheEntry
+
+            rows = EmbeddingCacheEntry.objects.filter(model=self.model, text_hash__in=hashes)
+            found, stale = {}, []
+            stale_before = timezone.now() - self.TOUCH_INTERVAL
+            for h, v, last_used_at in rows.values_list("text_hash", "embedding", "last_used_at"):
+                found[h] = [float(x) for x in v]
+                if last_used_at < stale_before:
+                    stale.append(h)
+            if stale:
+                rows.filter(text_hash__in=stale).update(last_used_at=timezone.now())
+            return found
+        except Exception as e:
+            _counters.add("db_errors")
+            print(f"[Cache] Embedding cache read skipped: {e}")
+            return {}
+
+    def _db_put(self, items: Dict[str, List[float]]):
+        if not self.use_db or not items:
+            return
+        try:
+            from .models import EmbeddingCacheEntry
+
+            EmbeddingCacheEntry.objects.bulk_create(
+                [EmbeddingCacheEntry(model=self.model, text_hash=h, embedding=v) for h, v in items.items()],
+                ignore_conflicts=True,
+                batch_size=500,
+            )
+            self._writes_since_prune += len(items)
+            if self._writes_since_prune >= self.PRUNE_EVERY:
+                self.prune()
+        except Exception as e:
+            _counters.add("db_errors")
+            print(f"[Cache] Embedding cache write skipped: {e}")
+
+    def prune(self, max_entries: Optional[int] = None) -> int:
+        """Evicts least-recently-used Postgres rows beyond max_entries. Returns rows deleted."""
+        from .models import EmbeddingCacheEntry
+
+        self._writes_since_prune = 0
+        cap = max_entries or self.max_db_entries
+        excess = EmbeddingCacheEntry.objects.count() - cap
+        if excess <= 0:
+            return 0
+        # The oldest 'excess' rows exactly (ties broken by id), read from the front of the
+        # last_used_at index rather than by skipping the 'cap' newest
+        ids = list(EmbeddingCacheEntry.objects.order_by("last_used_at", "id").values_list("id", flat=True)[:excess])
+        deleted = 0
+        for start in range(0, len(ids), self.PRUNE_BATCH):
+            count, _ = EmbeddingCacheEntry.objects.filter(id__in=ids[start:start + self.PRUNE_BATCH]).delete()
+            deleted += count
+        _counters.add("db_evictions", deleted)
+        if deleted:
+            print(f"[Cache] Evicted {deleted} embedding cache rows (cap {cap})")
+        return deleted
+
+    # --- Lookup phases (shared by the sync and async paths) ---
+
+    def _from_memory(self, hashes: List[str]) -> Tuple[Dict[str, List[float]], List[str]]:
+        vectors: Dict[str, List[float]] = {}
+        for h in hashes:
+            if h in vectors:
+                continue
+            vector = _memory.get((self.model, h))
+            if vector is not None:
+                vectors[h] = vector
+        _counters.add("memory_hits", sum(1 for h in hashes if h in vectors))
+        pending = list(dict.fromkeys(h for h in hashes if h not in vectors))
+        return vectors, pending
+
+    def _merge_db(self, hashes: List[str], vectors: Dict[str, List[float]], pending: List[str],
+                  from_db: Dict[str, List[float]]) -> List[str]:
+        _counters.add("db_hits", sum(1 for h in hashes if h in from_db))
+        for h, vector in from_db.items():
+            _counters.add("memory_evictions", _memory.put((self.model, h), vector))
+        vectors.update(from_db)
+        missing = [h for h in pending if h not in from_db]
+        _counters.add("misses", sum(1 for h in hashes if h not in vectors))
+        return missing
+
+    def _remember(self, missing: List[str], fresh_vectors: List[List[float]]) -> Dict[str, List[float]]:
+        fresh = dict(zip(missing, fresh_vectors))
+        for h, vector in fresh.items():
+            _counters.add("memory_evictions", _memory.put((self.model, h), vector))
+        return fresh
+
+    # --- LangChain interface ---
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        # 1. In-process LRU, 2. Postgres (one query for all remaining unique hashes)
+        vectors, pending = self._from_memory(hashes)
+        missing = self._merge_db(hashes, vectors, pending, self._db_get(pending))
+
+        # 3. Vertex, once per unique missing text
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            fresh = self._remember(missing, self.embedder.embed_documents([text_by_hash[h] for h in missing]))
+            self._db_put(fresh)
+            vectors.update(fresh)
+
+        return [vectors[h] for h in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        vectors, pending = self._from_memory(hashes)
+        from_db = await sync_to_async(self._db_get)(pending) if pending else {}
+        missing = self._merge_db(hashes, vectors, pending, from_db)
+
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            missing_texts = [text_by_hash[h] for h in missing]
+            if hasattr(self.embedder, "aembed_documents"):
+                fresh_vectors = await self.embedder.aembed_documents(missing_texts)
+            else:
+                fresh_vectors = await sync_to_async(self.embedder.embed_documents, thread_sensitive=False)(missing_texts)
+            fresh = self._remember(missing, fresh_vectors)
+            await sync_to_async(self._db_put)(fresh)
+            vectors.update(fresh)
+
+        return [vectors[h] for h in hashes]
+
+
+_cached_embedders: Dict[str, CachedEmbeddings] = {}
+_cached_embedders_lock = threading.Lock()
+
+
+def get_cached_embeddings(model: str = "models/embedding-001", **vertex_kwargs) -> CachedEmbeddings:
+    """
+    Returns the process-wide cached embedder for 'model', building the underlying
+    VertexEmbeddings (or FakeEmbeddings, GENAI_BACKEND=fake) on first use. Ingestion,
+    retrieval and auditing all share it.
+    """
+    from django.conf import settings
+
+    fake = getattr(settings, "GENAI_BACKEND", "vertex") == "fake"
+    with _cached_embedders_lock:
+        embedder = _cached_embedders.get((fake, model))
+        if embedder is None:
+            if fake:
+                from .fake_backends import FakeEmbeddings
+                embedder = CachedEmbeddings(FakeEmbeddings(model=model))
+            else:
+                embedder = CachedEmbeddings(VertexEmbeddings(model=model, **vertex_kwargs))
+            _cached_embedders[(fake, model)] = embedder
+        return embedder
+
+
+def embedding_cache_stats() -> Dict[str, float]:
+    data = _counters.snapshot()
+    data["memory_entries"] = len(_memory)
+    return data
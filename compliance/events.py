@@ -0,0 +1,238 @@
+"""
+ComplyFlow - Realtime Events
+
+Cross-process event fan-out for the SSE endpoints. Producers (the document job worker,
+the notification pipeline) call publish(), which issues a Postgres NOTIFY inside the
+caller's transaction, so listeners only ever hear about committed rows. Each web worker
+runs ONE listener thread on a dedicated connection (LISTEN) and fans every event out
+to its in-process subscribers; open streams never touch the database themselves.
+
+LISTEN is session state, which a transaction-mode pooler (Supabase port 6543) drops
+between transactions: the listener connects with EVENTS_DATABASE_URL (a direct or
+session-mode DSN) when set, and DATABASE_URL otherwise.
+
+Without Postgres (local SQLite) events are delivered in-process only.
+
+Functions:
+- publish: Send an event on a channel (NOTIFY on commit).
+- subscribe: Context manager yielding a bounded queue of events for one stream.
+- asubscribe: Async variant yielding an asyncio.Queue (ASGI streams; no thread per client).
+- get_broadcaster: The process-wide Broadcaster.
+
+Classes:
+- Broadcaster: LISTEN thread + subscriber registry.
+"""
+
+import asyncio
+import json
+import os
+import queue
+import select
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import dj_database_url
+from django.conf import settings
+from django.db import connection, connections
+
+DOCUMENT_STATUS_CHANNEL = "complyflow_document_status"
+NOTIFICATIONS_CHANNEL = "complyflow_notifications"
+# Events buffered per subscriber before the oldest are dropped (slow client)
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE_SIZE", "100"))
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+LISTEN_TIMEOUT = 5.0
+TRANSACTION_POOLER_PORT = 6543
+
+def _is_postgres():
+    return connection.vendor == "postgresql"
+
+def publish(channel, payload):
+    """
+    Publishes a JSON-serializable event. On Postgres this is pg_notify(), delivered to
+    every listening process when the surrounding transaction commits.
+    """
+    data = json.dumps(payload, default=str)
+    if len(data.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        print(f"[Events] Dropping oversized event on {channel} ({len(data)} chars)")
+        return
+    if not _is_postgres():
+        get_broadcaster().dispatch(channel, data)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [channel, data])
+
+class Broadcaster:
+    """
+    Per-process fan-out. A daemon thread LISTENs on every subscribed channel using its
+    own connection and calls each subscriber's sink with the decoded payload. Sinks
+    must not block (they run on the listener thread).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sinks = {}  # channel -> set of callables
+        self._listening = set()
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def add_sink(self, channel, sink):
+        with self._lock:
+            self._sinks.setdefault(channel, set()).add(sink)
+            self._ensure_thread()
+        self._wakeup.set()
+
+    def remove_sink(self, channel, sink):
+        with self._lock:
+            self._sinks.get(channel, set()).discard(sink)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel:
+                return len(self._sinks.get(channel, ()))
+            return sum(len(s) for s in self._sinks.values())
+
+    def dispatch(self, channel, data):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            print(f"[Events] Ignoring malformed payload on {channel}")
+            return
+        with self._lock:
+            sinks = list(self._sinks.get(channel, ()))
+        # Every sink (and its match filter) gets this same dict: sinks must not mutate it
+        for sink in sinks:
+            try:
+                sink(payload)
+            except Exception as e:
+                print(f"[Events] Subscriber error on {channel}: {e}")
+
+    def _ensure_thread(self):
+        if not _is_postgres() or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="events-listener", daemon=True)
+        self._thread.start()
+
+    def _listener_connection(self):
+        """A new connection wrapper for LISTEN, on EVENTS_DATABASE_URL if configured."""
+        db = connections["default"].copy()
+        url = getattr(settings, "EVENTS_DATABASE_URL", "")
+        if url:
+            db.settings_dict.update(dj_database_url.parse(url))
+        elif str(db.settings_dict.get("PORT")) == str(TRANSACTION_POOLER_PORT):
+            print("[Events] ⚠️ DATABASE_URL looks like a transaction pooler, where LISTEN hears nothing: "
+                  "set EVENTS_DATABASE_URL to a direct or session-mode connection")
+        return db
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            db = None
+            try:
+                db = self._listener_connection()
+                db.ensure_connection()
+                db.set_autocommit(True)
+                self._listening = set()
+                print("[Events] Listener connected")
+                backoff = 1.0
+                self._listen_loop(db.connection)
+            except Exception as e:
+                print(f"[Events] Listener error: {e}; reconnecting in {backoff:.0f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if db is not None:
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+
+    def _sync_channels(self, raw):
+        with self._lock:
+            wanted = set(self._sinks)
+        for channel in wanted - self._listening:
+            with raw.cursor() as cursor:
+                cursor.execute(f'LISTEN "{channel}"')
+            self._listening.add(channel)
+
+    def _listen_loop(self, raw):
+        # psycopg 3 exposes a notifies() generator; psycopg2 needs select() + poll()
+        psycopg3 = hasattr(raw, "notifies") and callable(raw.notifies)
+        while True:
+            self._wakeup.clear()
+            self._sync_channels(raw)
+            if psycopg3:
+                for notify in raw.notifies(timeout=LISTEN_TIMEOUT):
+                    self.dispatch(notify.channel, notify.payload)
+                    if self._wakeup.is_set():
+                        break
+            else:
+                if select.select([raw], [], [], LISTEN_TIMEOUT)[0]:
+                    raw.poll()
+                    while raw.notifies:
+                        notify = raw.notifies.pop(0)
+                        self.dispatch(notify.channel, notify.payload)
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+def get_broadcaster():
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = Broadcaster()
+    return _broadcaster
+
+@contextmanager
+def subscribe(channel, match=None):
+    """
+    Yields a queue.Queue receiving events on 'channel' (optionally only those for which
+    match(payload) is true). The queue is bounded; a slow reader loses its oldest events.
+    """
+    events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def sink(payload):
+        if match is not None and not match(payload):
+            return
+        while True:
+            try:
+                events.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    broadcaster = get_broadcaster()
+    broadcaster.add_sink(channel, sink)
+    try:
+        yield events
+    finally:
+        broadcaster.remove_sink(channel, sink)
+
+@asynccontextmanager
+async def asubscribe(channel, match=None):
+    """
+    Async subscribe(): events are handed to the caller's event loop from the listener
+    thread, so an idle subscriber is just a queue waiting on the loop.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(payload):
+        if events.full():
+            events.get_nowait()
+        events.put_nowait(payload)
+
+    def sink(payload):
+        if match is not None and not match(payload):
+            return
+        loop.call_soon_threadsafe(deliver, payload)
+
+    broadcaster = get_broadcaster()
+    broadcaster.add_sink(channel, sink)
+    try:
+        yield events
+    finally:
+        broadcaster.remove_sink(channel, sink)
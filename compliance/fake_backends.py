@@ -0,0 +1,238 @@
+"""
+ComplyFlow - Local Stand-ins for Vertex AI and Document AI
+
+Fake backends for load tests and local development on one machine, with no Google
+quota spent. They implement only the client surface ComplyFlow calls, with realistic
+latency, and are selected by settings:
+- GENAI_BACKEND=fake: get_genai_client() returns FakeGenAIClient (Gemini answers, JSON
+  agent/audit verdicts and embeddings; embeddings come from the deterministic
+  HashEmbeddings, so a corpus loaded with the same seed retrieves sensibly), and
+  get_cached_embeddings() wraps FakeEmbeddings instead of building VertexEmbeddings.
+- DOCAI_BACKEND=fake: analyze_document_uri() uses FakeDocumentProcessorServiceClient.
+- STORAGE_BACKEND=local|memory: uploads go to MEDIA_ROOT or Django's InMemoryStorage
+  instead of GCS (see settings.py).
+
+Tuned with environment variables:
+- FAKE_GENAI_LATENCY: seconds before the first token (default 0.4).
+- FAKE_GENAI_TOKENS_PER_SECOND: generation speed (default 60).
+- FAKE_GENAI_ANSWER_TOKENS: words per chat answer (default 250).
+- FAKE_GENAI_FLAG_RATE: share of audited invoices flagged (default 0.2).
+- FAKE_EMBED_LATENCY: seconds per embedding request (default 0.05).
+- FAKE_EMBED_SEED: HashEmbeddings seed (default 42, as benchmark_retrieval).
+- FAKE_DOCAI_LATENCY: seconds per processed document (default 1.5).
+
+Functions:
+- get_fake_genai_client: The process-wide FakeGenAIClient.
+
+Classes:
+- FakeGenAIClient: google-genai Client stand-in (models / aio.models).
+- FakeEmbeddings: VertexEmbeddings stand-in (no google-genai, no project needed).
+- FakeDocumentProcessorServiceClient: Document AI client stand-in.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+GENAI_LATENCY = float(os.getenv("FAKE_GENAI_LATENCY", "0.4"))
+TOKENS_PER_SECOND = float(os.getenv("FAKE_GENAI_TOKENS_PER_SECOND", "60"))
+ANSWER_TOKENS = int(os.getenv("FAKE_GENAI_ANSWER_TOKENS", "250"))
+FLAG_RATE = float(os.getenv("FAKE_GENAI_FLAG_RATE", "0.2"))
+EMBED_LATENCY = float(os.getenv("FAKE_EMBED_LATENCY", "0.05"))
+EMBED_SEED = int(os.getenv("FAKE_EMBED_SEED", "42"))
+DOCAI_LATENCY = float(os.getenv("FAKE_DOCAI_LATENCY", "1.5"))
+# Words per streamed chunk (Gemini streams a few words at a time)
+STREAM_CHUNK_TOKENS = 8
+
+_ANSWER_WORDS = (
+    "input tax credit is available subject to section 16 conditions including possession of a valid "
+    "tax invoice receipt of goods or services and filing of GSTR-3B the recipient must reverse credit "
+    "if payment to the supplier is not made within 180 days under rule 37 blocked credits under "
+    "section 17(5) cannot be claimed refer to the relevant circular and notification for the effective date"
+).split()
+
+def _rng(*parts):
+    return random.Random(hashlib.sha256("|".join(map(str, parts)).encode("utf-8")).hexdigest())
+
+def _question(prompt):
+    match = re.search(r"CURRENT USER QUESTION:\s*(.+)", prompt)
+    return match.group(1).strip() if match else prompt[-200:].strip()
+
+def _answer(prompt):
+    """A deterministic markdown answer in the shape the chat prompt asks for."""
+    rng = _rng("answer", prompt)
+    words = [rng.choice(_ANSWER_WORDS) for _ in range(max(ANSWER_TOKENS - 12, 10))]
+    third = len(words) // 3
+    return (
+        f"### Summary\n\nRegarding \"{_question(prompt)[:120]}\": {' '.join(words[:third])} [1].\n\n"
+        f"### Compliance Review\n\n- {' '.join(words[third:2 * third])} [2]\n\n"
+        f"### Conclusion\n\n{' '.join(words[2 * third:])}."
+    )
+
+def _json_verdict(prompt):
+    rng = _rng("verdict", prompt)
+    if '"is_flagged"' in prompt:
+        flagged = rng.random() < FLAG_RATE
+        return json.dumps({
+            "is_flagged": flagged,
+            "reason": "Input tax credit claimed on a blocked item under Section 17(5)." if flagged else "Compliant",
+        })
+    return json.dumps({
+        "impact_level": rng.choice(["HIGH", "MEDIUM", "LOW"]),
+        "action_draft": "1. Review the change. 2. Update invoicing. 3. Inform affected clients.",
+        "ai_analysis": "Synthetic analysis from the local stand-in model.",
+    })
+
+def _wants_json(config):
+    if config is None:
+        return False
+    mime = config.get("response_mime_type") if isinstance(config, dict) else getattr(config, "response_mime_type", None)
+    return mime == "application/json"
+
+def _chunks(text):
+    words = text.split(" ")
+    for i in range(0, len(words), STREAM_CHUNK_TOKENS):
+        piece = " ".join(words[i:i + STREAM_CHUNK_TOKENS])
+        yield (piece if i == 0 else " " + piece), len(words[i:i + STREAM_CHUNK_TOKENS])
+
+def _prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    return json.dumps(contents, default=str)
+
+class _Embedder:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                from .retrieval_bench import HashEmbeddings
+                cls._instance = HashEmbeddings(seed=EMBED_SEED)
+        return cls._instance
+
+def _embed_response(contents, content):
+    texts = contents if isinstance(contents, list) else [content if content is not None else contents]
+    vectors = _Embedder.get().embed_documents([str(t) for t in texts])
+    response = SimpleNamespace(embeddings=[SimpleNamespace(values=v) for v in vectors])
+    if len(vectors) == 1:
+        response.embedding = response.embeddings[0]
+    return response
+
+class _Models:
+    def generate_content(self, model=None, contents=None, config=None, **kwargs):
+        prompt = _prompt_text(contents)
+        text = _json_verdict(prompt) if _wants_json(config) else _answer(prompt)
+        time.sleep(GENAI_LATENCY + len(text.split()) / TOKENS_PER_SECOND)
+        return SimpleNamespace(text=text)
+
+    def generate_content_stream(self, model=None, contents=None, config=None, **kwargs):
+        time.sleep(GENAI_LATENCY)
+        for piece, tokens in _chunks(_answer(_prompt_text(contents))):
+            time.sleep(tokens / TOKENS_PER_SECOND)
+            yield SimpleNamespace(text=piece)
+
+    def embed_content(self, model=None, contents=None, content=None, config=None, **kwargs):
+        time.sleep(EMBED_LATENCY)
+        return _embed_response(contents, content)
+
+class _AsyncModels:
+    async def generate_content(self, model=None, contents=None, config=None, **kwargs):
+        prompt = _prompt_text(contents)
+        text = _json_verdict(prompt) if _wants_json(config) else _answer(prompt)
+        await asyncio.sleep(GENAI_LATENCY + len(text.split()) / TOKENS_PER_SECOND)
+        return SimpleNamespace(text=text)
+
+    async def generate_content_stream(self, model=None, contents=None, config=None, **kwargs):
+        # Like google-genai: awaiting the call returns the async iterator
+        async def stream():
+            await asyncio.sleep(GENAI_LATENCY)
+            for piece, tokens in _chunks(_answer(_prompt_text(contents))):
+                await asyncio.sleep(tokens / TOKENS_PER_SECOND)
+                yield SimpleNamespace(text=piece)
+        return stream()
+
+    async def embed_content(self, model=None, contents=None, content=None, config=None, **kwargs):
+        await asyncio.sleep(EMBED_LATENCY)
+        return _embed_response(contents, content)
+
+class FakeGenAIClient:
+    """The parts of google.genai.Client ComplyFlow uses: models.* and aio.models.*."""
+
+    def __init__(self):
+        self.models = _Models()
+        self.aio = SimpleNamespace(models=_AsyncModels())
+
+class FakeEmbeddings:
+    """
+    VertexEmbeddings stand-in returning HashEmbeddings vectors after FAKE_EMBED_LATENCY
+    per call. Its model is "fake:<model>", so the embedding cache (keyed by model) never
+    serves its vectors as real ones, even on a shared database.
+    """
+
+    def __init__(self, model="models/embedding-001", **kwargs):
+        self.model = f"fake:{model}"
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts):
+        time.sleep(EMBED_LATENCY)
+        return _Embedder.get().embed_documents([str(t) for t in texts])
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(EMBED_LATENCY)
+        return _Embedder.get().embed_documents([str(t) for t in texts])
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_fake_genai_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = FakeGenAIClient()
+            print("[GenAI] Using the local stand-in model (GENAI_BACKEND=fake)")
+    return _client
+
+class FakeDocumentProcessorServiceClient:
+    """
+    documentai.DocumentProcessorServiceClient stand-in: process_document() returns an
+    invoice-like document derived from the file URI (same file, same result).
+    """
+
+    def __init__(self, credentials=None, **kwargs):
+        pass
+
+    def processor_path(self, project, location, processor):
+        return f"projects/{project}/locations/{location}/processors/{processor}"
+
+    def process_document(self, request=None, **kwargs):
+        uri = request.gcs_document.gcs_uri if request is not None else ""
+        time.sleep(DOCAI_LATENCY)
+        rng = _rng("docai", uri)
+        net = rng.randrange(1000, 500000)
+        rate = rng.choice([0.05, 0.12, 0.18, 0.28])
+        item = rng.choice(["office supplies", "corporate gift watches", "export of services", "raw materials"])
+        text = (
+            f"TAX INVOICE\nSupplier: Example Traders Pvt Ltd\nGSTIN: 27ABCDE1234F1Z5\n"
+            f"Description: {item}\nNet amount: {net:,}.00\nGST @ {int(rate * 100)}%: {net * rate:,.2f}\n"
+            f"Input tax credit to be claimed in GSTR-3B.\n"
+        )
+        entities = [
+            SimpleNamespace(type_="supplier_name", mention_text="Example Traders Pvt Ltd", confidence=0.98),
+            SimpleNamespace(type_="net_amount", mention_text=f"{net:,}.00", confidence=0.95),
+            SimpleNamespace(type_="total_tax_amount", mention_text=f"{net * rate:,.2f}", confidence=0.93),
+            SimpleNamespace(type_="invoice_date", mention_text="2024-08-25", confidence=0.9),
+        ]
+        return SimpleNamespace(document=SimpleNamespace(text=text, entities=entities))
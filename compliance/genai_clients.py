@@ -0,0 +1,124 @@
+"""
+ComplyFlow - Shared GenAI Clients
+
+One google-genai Client per (project, location) per process, reused by chat, the
+compliance agent and the embedding wrapper. Building a Client loads credentials and
+every new one opens fresh TLS connections; sharing one keeps a warm, keep-alive httpx
+pool so a warm worker skips that setup on every LLM and embedding call.
+
+With GENAI_BACKEND = 'fake' in settings, every caller gets the local stand-in client
+from fake_backends instead (load tests, offline development).
+
+The registry is fork-safe: a child process (gunicorn/ProcessPool/run_workers fork)
+never reuses the parent's sockets and builds its own clients on first use.
+
+Pool size is tuned with environment variables:
+- GENAI_MAX_CONNECTIONS: max open connections per client (default 20).
+- GENAI_KEEPALIVE_CONNECTIONS: idle connections kept open (default 10).
+- GENAI_KEEPALIVE_EXPIRY: seconds an idle connection is kept (default 60).
+
+Functions:
+- get_genai_client: The shared Vertex AI client for a project/location.
+- genai_client_stats: Client and connection reuse counters for this process.
+"""
+
+import os
+import threading
+from django.conf import settings
+
+try:
+    import httpx
+    from google import genai
+    from google.genai import types
+except Exception:
+    genai = None
+
+MAX_CONNECTIONS = int(os.getenv("GENAI_MAX_CONNECTIONS", "20"))
+KEEPALIVE_CONNECTIONS = int(os.getenv("GENAI_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("GENAI_KEEPALIVE_EXPIRY", "60"))
+
+_clients = {}
+_lock = threading.Lock()
+_owner_pid = os.getpid()
+_stats = {
+    "clients_created": 0,
+    "client_reuses": 0,
+    "requests": 0,
+    "new_connections": 0,
+    "tls_handshakes": 0,
+}
+
+def _count(event_name):
+    # httpcore trace events: one connect per new TCP connection, one send per request
+    if event_name == "connection.connect_tcp.complete":
+        _stats["new_connections"] += 1
+    elif event_name == "connection.start_tls.complete":
+        _stats["tls_handshakes"] += 1
+    elif event_name.endswith("send_request_headers.started"):
+        _stats["requests"] += 1
+
+def _trace(event_name, info):
+    _count(event_name)
+
+async def _atrace(event_name, info):
+    _count(event_name)
+
+def _attach_trace(request):
+    request.extensions["trace"] = _trace
+
+async def _aattach_trace(request):
+    request.extensions["trace"] = _atrace
+
+def _http_options():
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    return types.HttpOptions(
+        client_args={"limits": limits, "event_hooks": {"request": [_attach_trace]}},
+        async_client_args={"limits": limits, "event_hooks": {"request": [_aattach_trace]}},
+    )
+
+def _reset_after_fork():
+    # Inherited clients share sockets with the parent: forget them (never close them)
+    global _lock, _owner_pid
+    _clients.clear()
+    _lock = threading.Lock()
+    _owner_pid = os.getpid()
+    for key in _stats:
+        _stats[key] = 0
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_genai_client(project=None, location=None):
+    """Returns this process's shared Vertex AI genai.Client for project/location."""
+    if getattr(settings, "GENAI_BACKEND", "vertex") == "fake":
+        from .fake_backends import get_fake_genai_client
+        return get_fake_genai_client()
+    if genai is None:
+        raise RuntimeError("google-genai library not available")
+    project = project or getattr(settings, "DOCAI_PROJECT_ID", None) or os.getenv("DOCAI_PROJECT_ID")
+    location = location or os.getenv("VERTEX_LOCATION") or "us-central1"
+    if os.getpid() != _owner_pid:
+        _reset_after_fork()
+    key = (project, location)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats["client_reuses"] += 1
+            return client
+        client = genai.Client(vertexai=True, project=project, location=location, http_options=_http_options())
+        _clients[key] = client
+        _stats["clients_created"] += 1
+        print(f"[GenAI] Created shared client for {project}/{location}")
+        return client
+
+def genai_client_stats():
+    """Counters since this process started (or forked). connection_reuse = requests on warm sockets."""
+    stats = dict(_stats)
+    requests = stats["requests"]
+    stats["connection_reuse"] = round(1 - stats["new_connections"] / requests, 3) if requests else None
+    stats["clients"] = len(_clients)
+    return stats
@@ -0,0 +1,137 @@
+"""
+ComplyFlow - Legal Identifier Index
+
+Many questions name a specific circular or notification ("Circular No. 189/01/2023-GST",
+"Notification 12/2024"). This module extracts such identifiers with regexes, both at
+ingest time (stored in chunk metadata) and from chat messages, so a citation lookup is a
+single indexed SELECT instead of a Vertex embedding call plus an ANN scan.
+
+Identifiers are normalized to keys like:
+- circular:189/1/2023 (plus circular:189/2023 and the short form circular:189)
+- notification:12/2024
+- section:17(5) (plus the parent section:17)
+
+Chunk metadata fields (served by LangChain's ix_cmetadata_gin jsonb_path_ops index):
+- doc_identifiers: identifiers OF the chunk's document (from knowledge_base_index.csv).
+- identifiers: identifiers MENTIONED in the chunk text.
+
+Functions:
+- extract_identifiers: Normalized identifier keys found in a text.
+- document_identifiers: Identifier keys for a document, from its index row and filename.
+- lookup_by_identifiers: Direct metadata lookup of chunks for identifier keys.
+
+Keys added here only reach already-ingested chunks after `manage.py index_identifiers`.
+"""
+
+import json
+import re
+from django.db import connection
+from .vector_index import EMBEDDING_TABLE, COLLECTION_TABLE, COLLECTION_NAME, FTS_COLUMN, FTS_CONFIG, fts_available
+
+CIRCULAR_RE = re.compile(
+    r"\bcircular\s*(?:no\.?|number)?\s*[:#]?\s*(\d{1,4})(?:\s*/\s*(\d{1,3})\s*/\s*(\d{4}))?",
+    re.IGNORECASE,
+)
+NOTIFICATION_RE = re.compile(
+    r"\bnotification\s*(?:no\.?|number)?\s*[:#]?\s*(\d{1,4})\s*/\s*(\d{4})",
+    re.IGNORECASE,
+)
+SECTION_RE = re.compile(
+    r"\bsection\s*(\d{1,3}[A-Z]{0,2})\s*(\(\s*\d{1,3}[A-Za-z]?\s*\))?",
+    re.IGNORECASE,
+)
+# Bare index ids of known shapes ("cir-cgst-234-2024", "Circular-No-228-2024"):
+# number and year. Anything else falls through to the document header scan.
+BARE_ID_RES = {
+    "circulars": re.compile(r"^(?:cir|circular)(?:-[a-z]+)*-(\d{1,4})-(\d{4})$", re.IGNORECASE),
+    "notifications": re.compile(r"^(?:notf?|notification)(?:-[a-z]+)*-(\d{1,4})-(\d{4})$", re.IGNORECASE),
+}
+# Identifier kinds that name a whole document (eligible for the chat fast path)
+DOCUMENT_KINDS = ("circular", "notification")
+
+def extract_identifiers(text):
+    """Returns the sorted, de-duplicated identifier keys mentioned in 'text'."""
+    found = set()
+    for number, seq, year in CIRCULAR_RE.findall(text or ""):
+        found.add(f"circular:{int(number)}")
+        if seq and year:
+            # The year-qualified form is what a bare index id ("cir-cgst-234-2024") carries
+            found.add(f"circular:{int(number)}/{year}")
+            found.add(f"circular:{int(number)}/{int(seq)}/{year}")
+    for number, year in NOTIFICATION_RE.findall(text or ""):
+        found.add(f"notification:{int(number)}/{year}")
+    for number, sub in SECTION_RE.findall(text or ""):
+        number = number.upper()
+        found.add(f"section:{number}")
+        if sub:
+            found.add(f"section:{number}({sub.strip('() ').lower()})")
+    return sorted(found)
+
+def document_identifiers(document_id=None, category=None):
+    """
+    Identifier keys for a document, from its knowledge_base_index.csv document_id
+    (e.g. "Circular No. 189/01/2023-GST"). Bare ids of a known shape get the keys chat
+    messages produce: "cir-cgst-234-2024" -> circular:234 and circular:234/2024 (so a full
+    citation "234/28/2024" still finds it), "notification-12-2024" -> notification:12/2024.
+    Other ids ("download (1)") return [] so the caller falls back to header_identifiers.
+    """
+    keys = set(extract_identifiers(document_id or ""))
+    bare = BARE_ID_RES.get(category)
+    match = bare.match(document_id.strip()) if not keys and document_id and bare else None
+    if match:
+        number, year = int(match.group(1)), match.group(2)
+        if category == "circulars":
+            keys.add(f"circular:{number}")
+        keys.add(f"{'circular' if category == 'circulars' else 'notification'}:{number}/{year}")
+    return sorted(keys)
+
+def document_keys(keys):
+    """The subset of keys that name a whole circular/notification."""
+    return [k for k in keys if k.split(":", 1)[0] in DOCUMENT_KINDS]
+
+def header_identifiers(text, window=300):
+    """Document-level keys from a document's opening lines (for files missing from the index CSV)."""
+    return document_keys(extract_identifiers((text or "")[:window]))
+
+def _fetch(field, keys, k, exclude_ids=(), query=None, collection_name=COLLECTION_NAME):
+    # One containment test per key, OR-ed; each is served by the GIN index on cmetadata
+    clauses = " OR ".join(["e.cmetadata @> %s::jsonb"] * len(keys))
+    params = [collection_name, *[json.dumps({field: [key]}) for key in keys]]
+    exclude = ""
+    if exclude_ids:
+        exclude = "AND e.id <> ALL(%s)"
+        params.append(list(exclude_ids))
+    # Best match for the question first (any query term counts), then reading order
+    rank = ""
+    if query and fts_available():
+        rank = (f"ts_rank_cd(e.{FTS_COLUMN}, NULLIF(replace(plainto_tsquery('{FTS_CONFIG}', %s)::text, "
+                f"'&', '|'), '')::tsquery) DESC NULLS LAST, ")
+        params.append(query)
+    sql = f"""
+        SELECT e.id, e.document, e.cmetadata
+        FROM {EMBEDDING_TABLE} AS e
+        JOIN {COLLECTION_TABLE} AS c ON e.collection_id = c.uuid
+        WHERE c.name = %s AND ({clauses}) {exclude}
+        ORDER BY {rank}e.cmetadata->>'source', (e.cmetadata->>'chunk_index')::int NULLS LAST
+        LIMIT %s;
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, k])
+        rows = cursor.fetchall()
+    return [{"id": row[0], "content": row[1], "metadata": row[2] or {}} for row in rows]
+
+def lookup_by_identifiers(keys, k=5, query=None):
+    """
+    Chunks for identifier keys without any embedding: chunks of the documents the keys
+    name, then chunks that mention them. Each group is ranked by full-text match with
+    'query' (the question) when given and the tsvector column exists, else in reading
+    order. Only the most specific keys are used (circular:189/1/2023 and
+    circular:189/2023 over circular:189).
+    """
+    keys = [key for key in keys if not any(other.startswith((key + "/", key + "(")) for other in keys)]
+    if not keys:
+        return []
+    results = _fetch("doc_identifiers", keys, k, query=query)
+    if len(results) < k:
+        results += _fetch("identifiers", keys, k - len(results), exclude_ids=[r["id"] for r in results], query=query)
+    return results
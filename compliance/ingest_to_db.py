@@ -3,31 +3,78 @@ ComplyFlow - Document Ingestion Pipeline
 
 This module handles the ingestion of legal documents into the vector database.
 It processes PDFs, chunks text, generates embeddings, and stores them in PostgreSQL with pgvector.
+Every ingested file is recorded in the IngestedDocument registry with a sha256 of its bytes:
+unchanged files are skipped before parsing, and a changed file's old chunks are replaced
+by the new ones in a single transaction (so amended circulars never leave duplicates).
+
+Files are processed as a stream: pages -> clean_text -> splitter -> embedding batches ->
+a staging file on disk, then one short transaction swaps the staged rows in (delete +
+COPY + registry). Only a few pages of text and one embedding batch are in memory at a
+time, however large the Act, and no transaction or row lock is held while PDFs are
+parsed or Vertex is called. Chunks spanning a page break are kept whole (tagged
+page_start/page_end).
 
 Functions:
 - ingest_single_file: Process and ingest a single document file.
+- iter_chunks: Stream chunks of one PDF page by page, with page numbers in metadata.
+- load_chunks: Parse, clean and chunk one PDF (no DB/network; safe in a process pool).
+- file_sha256 / is_unchanged: Content-hash checks against the registry.
+- replace_document: Embed a document's chunks, then atomically swap them in and update the registry.
 - clean_text: Clean and normalize document text.
 - get_splitter: Get appropriate text splitter based on document type.
+- load_knowledge_base_index: Filename -> row mapping from data/knowledge_base_index.csv.
+- chunk_metadata: Identifier/position metadata attached to every chunk.
 
 Note: Requires PostgreSQL with pgvector and Vertex AI embeddings.
 """
 
 # ingest_to_db.py (Updated to be modular)
+import csv
+import hashlib
+import json
 import os
 import re
+import tempfile
 from functools import lru_cache
+from django.db import transaction
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_postgres.vectorstores import PGVector
 from dotenv import load_dotenv
-from .vertex_embeddings import VertexEmbeddings
+from .embedding_cache import get_cached_embeddings
+from .identifiers import extract_identifiers, document_identifiers, header_identifiers
+from .vector_index import insert_embeddings, delete_document_chunks
+from .answer_cache import invalidate_sources
 
 load_dotenv()
-DB_CONNECTION = os.getenv("DATABASE_URL")
 COLLECTION_NAME = "legal_docs_vectors"
+# Chunks embedded (and inserted) per round trip while streaming a document
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+KB_INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "knowledge_base_index.csv")
+
 @lru_cache(maxsize=1)
 def get_embeddings():
-    return VertexEmbeddings(model=os.getenv("VERTEX_EMBEDDING_MODEL", "models/embedding-001"))
+    return get_cached_embeddings(model=os.getenv("VERTEX_EMBEDDING_MODEL", "models/embedding-001"))
+
+@lru_cache(maxsize=1)
+def load_knowledge_base_index():
+    """Maps PDF filename -> knowledge_base_index.csv row (category, document_id, subject)."""
+    if not os.path.exists(KB_INDEX_PATH):
+        return {}
+    with open(KB_INDEX_PATH, newline="", encoding="utf-8") as f:
+        return {row["filename"]: row for row in csv.DictReader(f)}
+
+def chunk_metadata(file_name, category, full_text_head=""):
+    """
+    Document-level metadata shared by every chunk of a file: its document_id and the
+    identifiers that name it (from the index CSV, else from the document's opening lines).
+    """
+    row = load_knowledge_base_index().get(file_name, {})
+    document_id = row.get("document_id")
+    doc_ids = document_identifiers(document_id, category) or header_identifiers(full_text_head)
+    metadata = {"doc_identifiers": doc_ids}
+    if document_id:
+        metadata["document_id"] = document_id
+    return metadata
 
 def clean_text(text):
     text = re.sub(r'Page \d+ of \d+', '', text)
@@ -35,42 +82,191 @@ def clean_text(text):
 
 def get_splitter(doc_type):
     # (Keep your existing splitter logic here, simplified for brevity)
+    # start_index lets the streaming chunker map chunks back to page numbers
     if doc_type == "acts":
-        return RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+        return RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200, add_start_index=True)
     else:
-        return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100, add_start_index=True)
+
+def _page_span(page_starts, start, end):
+    """1-based (first, last) page of the buffer range [start, end) given (offset, page) starts."""
+    first = last = page_starts[0][1]
+    for offset, page in page_starts:
+        if offset <= start:
+            first = page
+        if offset < end:
+            last = page
+    return first, last
+
+def _rebase_pages(page_starts, cut):
+    """Page starts for buffer[cut:]: the page containing offset 'cut' now starts at 0."""
+    current = [page for offset, page in page_starts if offset <= cut][-1]
+    return [(0, current)] + [(offset - cut, page) for offset, page in page_starts if offset > cut]
+
+def iter_chunks(file_path, category, source_url=None, stats=None):
+    """
+    Streams one PDF as LangChain Documents with full chunk metadata, page by page.
+
+    Cleaned pages are appended to a text buffer. Once it holds two chunks' worth, the
+    buffer is split and every chunk except the last is emitted; the last chunk is
+    carried over and re-split with the following pages, so no chunk is ever cut at a
+    page break. stats (a dict) receives "pages".
+    Touches no database or network.
+    """
+    source = os.path.basename(file_path)
+    splitter = get_splitter(category)
+    flush_at = 2 * splitter._chunk_size
+    buffer = ""
+    page_starts = []  # (offset in buffer, 1-based page number)
+    doc_metadata = None
+    chunk_index = 0
+    pages = 0
+
+    def emit(pieces):
+        nonlocal chunk_index, doc_metadata
+        if doc_metadata is None:
+            # Add Metadata (Crucial for tracking live files)
+            doc_metadata = chunk_metadata(source, category, buffer[:1000])
+        for piece in pieces:
+            start = piece.metadata.pop("start_index")
+            page_start, page_end = _page_span(page_starts, start, start + len(piece.page_content))
+            piece.metadata["source"] = source
+            piece.metadata["category"] = category
+            piece.metadata["chunk_index"] = chunk_index
+            piece.metadata["page_start"] = page_start
+            piece.metadata["page_end"] = page_end
+            piece.metadata["identifiers"] = extract_identifiers(piece.page_content)
+            piece.metadata.update(doc_metadata)
+            if source_url:
+                piece.metadata["source_url"] = source_url # To prevent re-downloading later
+            chunk_index += 1
+            yield piece
+
+    for page in PyPDFLoader(file_path).lazy_load():
+        pages += 1
+        if buffer:
+            buffer += "\n"
+        page_starts.append((len(buffer), pages))
+        buffer += clean_text(page.page_content)
+        if len(buffer) < flush_at:
+            continue
+
+        pieces = splitter.create_documents([buffer])
+        if len(pieces) < 2:
+            continue
+        carry_from = pieces[-1].metadata["start_index"]
+        yield from emit(pieces[:-1])
+        buffer = buffer[carry_from:]
+        page_starts = _rebase_pages(page_starts, carry_from)
+
+    if buffer.strip():
+        yield from emit(splitter.create_documents([buffer]))
+    if stats is not None:
+        stats["pages"] = pages
+
+def load_chunks(file_path, category, source_url=None):
+    """
+    Loads, cleans and splits one PDF into a list of chunks (see iter_chunks).
+    Returns (chunks, page_count). Used where chunks must cross a process boundary.
+    """
+    stats = {}
+    chunks = list(iter_chunks(file_path, category, source_url, stats))
+    return chunks, stats.get("pages", 0)
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_unchanged(source, content_hash):
+    from .models import IngestedDocument
+    return IngestedDocument.objects.filter(source=source, content_hash=content_hash).exists()
+
+def _embedded_rows(chunks, embeddings, batch_size=None):
+    """Yields (content, metadata, vector) rows, embedding 'chunks' (any iterable) batch by batch."""
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            vectors = embeddings.embed_documents([c.page_content for c in batch])
+            yield from ((c.page_content, c.metadata, v) for c, v in zip(batch, vectors))
+            batch = []
+    if batch:
+        vectors = embeddings.embed_documents([c.page_content for c in batch])
+        yield from ((c.page_content, c.metadata, v) for c, v in zip(batch, vectors))
+
+def _stage_rows(rows):
+    """
+    Spools (content, metadata, vector) rows to an anonymous temp file, one JSON line
+    each, so a whole document can be embedded before its transaction opens without
+    holding it in memory. Returns (file rewound to the start, row count).
+    """
+    staged = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+    count = 0
+    for content, metadata, vector in rows:
+        staged.write(json.dumps([content, metadata, list(vector)]) + "\n")
+        count += 1
+    staged.seek(0)
+    return staged, count
+
+def _staged_rows(staged):
+    for line in staged:
+        content, metadata, vector = json.loads(line)
+        yield content, metadata, vector
+
+def replace_document(source, category, content_hash, chunks, source_url=None, embeddings=None):
+    """
+    Streams 'chunks' (a list or an iter_chunks() generator) through batched embedding
+    into a staging file, outside any transaction: parsing and Vertex calls are slow.
+    Then, in ONE short transaction, deletes the source's previous chunks, COPYs the
+    staged rows in, updates the registry and drops cached chat answers built on the
+    source. Readers keep seeing the old chunks until commit. A document that yields no
+    chunks leaves the knowledge base and registry untouched. Returns the number of
+    chunks written.
+    """
+    from .models import IngestedDocument
+
+    embeddings = embeddings or get_embeddings()
+    staged, count = _stage_rows(_embedded_rows(chunks, embeddings))
+    with staged:
+        if not count:
+            print(f"[Ingest] No text chunks in {source}; keeping the previous version")
+            return 0
+        with transaction.atomic():
+            removed = delete_document_chunks(source)
+            written = insert_embeddings(_staged_rows(staged))
+            IngestedDocument.objects.update_or_create(
+                source=source,
+                defaults={
+                    "category": category,
+                    "content_hash": content_hash,
+                    "chunk_count": written,
+                    "source_url": source_url,
+                },
+            )
+            invalidate_sources([source])
+    if removed:
+        print(f"[Ingest] Replaced {removed} old chunks of {source}")
+    return written
 
 def ingest_single_file(file_path, category, source_url=None):
     """
     Process a SINGLE file and add it to Supabase.
-    Called by the Live Watcher.
+    Called by the Live Watcher. Unchanged files (same sha256) are skipped.
     """
     print(f"[Ingest] Ingesting Live File: {file_path}")
     try:
-        loader = PyPDFLoader(file_path)
-        pages = loader.load()
-        full_text = clean_text("\n".join([p.page_content for p in pages]))
-        
-        splitter = get_splitter(category)
-        chunks = splitter.create_documents([full_text])
-        
-        # Add Metadata (Crucial for tracking live files)
-        for chunk in chunks:
-            chunk.metadata["source"] = os.path.basename(file_path)
-            chunk.metadata["category"] = category
-            if source_url:
-                chunk.metadata["source_url"] = source_url # To prevent re-downloading later
-        
-        if not chunks: return
-
-        PGVector.from_documents(
-            embedding=get_embeddings(),
-            documents=chunks,
-            collection_name=COLLECTION_NAME,
-            connection=DB_CONNECTION,
-            use_jsonb=True,
-        )
-        print(f"[Done] Successfully added to Knowledge Base!")
+        source = os.path.basename(file_path)
+        content_hash = file_sha256(file_path)
+        if is_unchanged(source, content_hash):
+            print(f"[Ingest] Skipping {source}: unchanged since last ingest")
+            return
+
+        written = replace_document(source, category, content_hash, iter_chunks(file_path, category, source_url), source_url)
+        print(f"[Done] Successfully added {written} chunks to Knowledge Base!")
         
     except Exception as e:
         print(f"[Error] Error ingesting {file_path}: {e}")
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+ComplyFlow - Background Job Queue
+
+A small Postgres-backed job queue, so slow work (Document AI, embeddings, Gemini audits)
+runs outside the request that triggered it. Jobs are rows in the Job table; workers
+started with `python manage.py run_workers` claim them with
+SELECT ... FOR UPDATE SKIP LOCKED, which lets any number of worker processes, on any
+number of nodes, share one queue without double-processing a job.
+
+Failed jobs are retried with exponential backoff up to max_attempts. While a job runs,
+its worker refreshes locked_at every JOB_HEARTBEAT_SECONDS; a RUNNING job with no
+heartbeat for JOB_STALE_SECONDS lost its worker (killed, OOM) and is re-queued, or
+marked FAILED once it has used up max_attempts (a job that keeps killing its worker
+must not loop forever).
+
+Functions:
+- register: Decorator that registers a handler for a job kind.
+- enqueue: Add a job to the queue.
+- claim_job / run_job: Claim the next runnable job and execute it.
+- work: Worker loop used by run_workers.
+"""
+
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+
+# Seconds between polls when the queue is empty
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# RUNNING jobs without a heartbeat for this long are assumed orphaned (worker killed)
+STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+# How often a running job refreshes locked_at (well under STALE_SECONDS)
+HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+RETRY_BASE_SECONDS = 5
+
+_handlers = {}
+
+def register(kind):
+    """Registers the decorated function as the handler for jobs of 'kind' (called with **payload)."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+def enqueue(kind, payload=None, delay_seconds=0, max_attempts=3):
+    """Queues a job. Runs in the caller's transaction, so it is only visible once that commits."""
+    if kind not in _handlers:
+        raise ValueError(f"No job handler registered for '{kind}'")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay_seconds),
+    )
+
+def claim_job(worker_id):
+    """Atomically claims the oldest runnable job (skipping rows other workers hold). Returns it or None."""
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='QUEUED', run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'RUNNING'
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at'])
+    return job
+
+def _heartbeat(job, stop):
+    """Refreshes the claimed job's locked_at until 'stop' is set (runs in its own thread)."""
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                Job.objects.filter(pk=job.pk, status='RUNNING', locked_by=job.locked_by).update(locked_at=timezone.now())
+            except Exception as e:
+                print(f"[Jobs] Heartbeat for {job} failed: {e}")
+    finally:
+        connection.close()
+
+def run_job(job):
+    """Executes a claimed job (heartbeating meanwhile) and records DONE, a backed-off retry, or FAILED."""
+    handler = _handlers.get(job.kind)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), name=f"job-{job.pk}-heartbeat", daemon=True)
+    heartbeat.start()
+    try:
+        if handler is None:
+            raise LookupError(f"No job handler registered for '{job.kind}'")
+        handler(**job.payload)
+    except Exception as e:
+        job.last_error = f"{e}\n{traceback.format_exc()}"[-5000:]
+        if job.attempts < job.max_attempts:
+            job.status = 'QUEUED'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            print(f"[Jobs] {job} failed (attempt {job.attempts}/{job.max_attempts}), retrying: {e}")
+        else:
+            job.status = 'FAILED'
+            job.finished_at = timezone.now()
+            print(f"[Jobs] {job} failed permanently: {e}")
+    else:
+        job.status = 'DONE'
+        job.finished_at = timezone.now()
+        job.last_error = None
+    finally:
+        stop.set()
+        heartbeat.join()
+    job.locked_by = None
+    job.save(update_fields=['status', 'run_after', 'finished_at', 'last_error', 'locked_by'])
+    return job.status
+
+def requeue_stale_jobs():
+    """
+    Re-queues RUNNING jobs whose worker stopped heartbeating (e.g. was killed mid-job);
+    those that have used up max_attempts are marked FAILED instead. Returns the number
+    re-queued.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='RUNNING', locked_at__lt=now - timedelta(seconds=STALE_SECONDS))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='FAILED', locked_by=None, finished_at=now,
+        last_error=f"Worker stopped heartbeating for {STALE_SECONDS}s on the last attempt",
+    )
+    count = stale.filter(attempts__lt=F('max_attempts')).update(status='QUEUED', locked_by=None)
+    if count or failed:
+        print(f"[Jobs] Re-queued {count} stale jobs, failed {failed} out of attempts")
+    return count
+
+def work(worker_id, stop_event=None, poll_interval=None, burst=False):
+    """
+    Worker loop: claim and run jobs until stop_event is set.
+    burst=True exits as soon as the queue is empty (useful for cron and tests).
+    """
+    poll_interval = poll_interval or POLL_INTERVAL
+    print(f"[Jobs] Worker {worker_id} started")
+    last_stale_check = 0.0
+    while not (stop_event and stop_event.is_set()):
+        close_old_connections()
+        if time.monotonic() - last_stale_check > 60:
+            requeue_stale_jobs()
+            last_stale_check = time.monotonic()
+
+        job = claim_job(worker_id)
+        if job is not None:
+            run_job(job)
+            continue
+        if burst:
+            break
+        if stop_event:
+            stop_event.wait(poll_interval)
+        else:
+            time.sleep(poll_interval)
+    print(f"[Jobs] Worker {worker_id} stopped")
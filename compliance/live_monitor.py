@@ -3,7 +3,6 @@ import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import time
-from .ingest_to_db import ingest_single_file # Import our new helper
 
 # CONFIG
 CBIC_URL = "https://taxinformation.cbic.gov.in/central-tax-notifications" 
@@ -61,12 +60,19 @@ def check_and_ingest():
             
             # 3. TRIGGER INGESTION (The "Live" part)
             # We assume these are 'notifications' category
+            # (imported here: ingestion needs Django configured, see __main__)
+            from .ingest_to_db import ingest_single_file
             ingest_single_file(local_path, category="notifications", source_url=doc['url'])
             
         except Exception as e:
             print(f"Failed to download {filename}: {e}")
 
 if __name__ == "__main__":
+    # Ingestion writes through the Django ORM and connection: configure Django first
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "complyflow_backend.settings")
+    django.setup()
+
     # Run this loop forever (or set as a Cron job)
     print("[Start] CBIC Live Monitor Started...")
     while True:
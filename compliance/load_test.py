@@ -0,0 +1,287 @@
+"""
+ComplyFlow - Load Test Driver
+
+Replays a realistic traffic mix against a running ComplyFlow server over HTTP, so
+worker counts and async/queue changes can be sized on one machine. Run the server with
+the local stand-ins (GENAI_BACKEND=fake, DOCAI_BACKEND=fake, STORAGE_BACKEND=local) to
+spend no Google quota; `manage.py load_test` drives it.
+
+Virtual users run a closed loop: pick a scenario by weight, run it, think, repeat.
+Scenarios mirror the frontend:
+- chat / chat_async: POST /api/chat/ (or /api/chat/async/); some are follow-ups in the
+  same conversation, some discuss a notified document (discussDoc).
+- chat_stream: POST /api/chat/stream/, timing the first token and the full answer.
+- history / notifications: the dashboard's GETs.
+- upload: POST /api/documents/, then poll until the worker has processed it.
+
+Every sample keeps the server's Server-Timing stages, so the report shows where the
+time went (retrieval vs generation vs history save) at the measured load.
+
+Functions:
+- parse_mix: "chat=50,upload=5" -> {scenario: weight}.
+- prepare_users: Synthetic users with JWT access tokens.
+- run: Drive the mix for a duration; returns the raw samples.
+- report: Throughput and latency percentiles per scenario and stage.
+"""
+
+import asyncio
+import json
+import random
+import time
+from django.contrib.auth.models import User
+from .metrics import parse_server_timing, summarize
+
+SCENARIOS = ("chat", "chat_async", "chat_stream", "history", "notifications", "upload")
+DEFAULT_MIX = "chat=45,chat_stream=20,history=15,notifications=15,upload=5"
+LOAD_TEST_EMAIL_DOMAIN = "loadtest.complyflow.local"
+
+# Popular questions repeat (as in production), which exercises the answer cache
+QUESTIONS = (
+    "How to claim ITC on capital goods?",
+    "What is reverse charge mechanism under GST?",
+    "Can I claim input tax credit on a car used for business?",
+    "What is the due date for filing GSTR-3B?",
+    "Is GST applicable on export of services?",
+    "What are blocked credits under Section 17(5)?",
+    "How do I reverse ITC if payment is not made within 180 days?",
+    "What is the GST rate on restaurant services?",
+    "Do I need to register under GST for interstate supply?",
+    "What is the time of supply for services under reverse charge?",
+    "Can ITC be claimed on corporate gifts given to clients?",
+    "What is the penalty for late filing of GST returns?",
+    "How is the place of supply determined for online services?",
+    "What documents are needed for a GST refund on exports?",
+    "Explain the composition scheme turnover limit.",
+    "Is e-invoicing mandatory for my business?",
+)
+FOLLOW_UPS = (
+    "What about the deadline for that?",
+    "Does this apply to exports too?",
+    "Can you explain that in simpler terms?",
+    "Which section covers this?",
+)
+FOLLOW_UP_SHARE = 0.3
+DISCUSS_DOC_SHARE = 0.15
+UPLOAD_POLL_SECONDS = 0.5
+# Pause after a failed request so an unreachable server is not hammered in a tight loop
+ERROR_BACKOFF_SECONDS = 1.0
+
+# Smallest well-formed PDF: uploads are about the pipeline, not the parser
+SAMPLE_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+def parse_mix(spec):
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {SCENARIOS}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The traffic mix needs at least one scenario with a positive weight")
+    return mix
+
+def prepare_users(count):
+    """Creates (or reuses) loadtest-N users and returns a Bearer access token for each."""
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    tokens = []
+    for i in range(count):
+        email = f"loadtest-{i}@{LOAD_TEST_EMAIL_DOMAIN}"
+        user, _ = User.objects.get_or_create(username=email, defaults={"email": email})
+        tokens.append(str(RefreshToken.for_user(user).access_token))
+    return tokens
+
+class _VirtualUser:
+    def __init__(self, index, token, rng, discuss_docs):
+        self.index = index
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.rng = rng
+        self.discuss_docs = discuss_docs
+        self.history = []
+        self.conversation_id = None
+
+    def next_message(self):
+        """(message, history, conversation_id, params) for the next chat turn."""
+        params = {}
+        if self.history and self.rng.random() < FOLLOW_UP_SHARE:
+            return self.rng.choice(FOLLOW_UPS), self.history[-6:], self.conversation_id, params
+        self.history, self.conversation_id = [], None
+        if self.discuss_docs and self.rng.random() < DISCUSS_DOC_SHARE:
+            params["discussDoc"] = self.rng.choice(self.discuss_docs)
+        return self.rng.choice(QUESTIONS), [], None, params
+
+    def remember(self, message, answer, conversation_id):
+        self.history += [{"role": "user", "content": message}, {"role": "assistant", "content": answer[:500]}]
+        self.conversation_id = conversation_id
+
+def _sample(scenario, started, ok, status=None, response=None, **extra):
+    sample = {
+        "scenario": scenario,
+        "seconds": time.perf_counter() - started,
+        "ok": ok,
+        "status": status,
+        "stages": parse_server_timing(response.headers.get("Server-Timing")) if response is not None else {},
+    }
+    sample.update(extra)
+    return sample
+
+async def _chat(client, vu, path="/api/chat/", scenario="chat"):
+    message, history, conversation_id, params = vu.next_message()
+    started = time.perf_counter()
+    response = await client.post(path, params=params, headers=vu.headers,
+                                 json={"message": message, "history": history, "conversation_id": conversation_id})
+    ok = response.status_code == 200
+    if ok:
+        body = response.json()
+        vu.remember(message, body.get("response", ""), body.get("conversation_id"))
+    return [_sample(scenario, started, ok, response.status_code, response)]
+
+async def _chat_async(client, vu):
+    return await _chat(client, vu, "/api/chat/async/", "chat_async")
+
+async def _chat_stream(client, vu):
+    message, history, conversation_id, params = vu.next_message()
+    started = time.perf_counter()
+    first_token = None
+    answer, new_conversation_id, ok = [], conversation_id, False
+    async with client.stream("POST", "/api/chat/stream/", params=params, headers=vu.headers,
+                             json={"message": message, "history": history, "conversation_id": conversation_id}) as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                if event == "done":
+                    data = json.loads(line[6:])
+                    answer, new_conversation_id, ok = [data.get("response", "")], data.get("conversation_id"), True
+                elif event == "error":
+                    ok = False
+        status = response.status_code
+    if ok:
+        vu.remember(message, answer[0], new_conversation_id)
+    extra = {} if ok or status != 200 else {"error": "error event"}
+    return [_sample("chat_stream", started, ok and status == 200, status, response, first_token_seconds=first_token, **extra)]
+
+async def _get(client, vu, path, scenario):
+    started = time.perf_counter()
+    response = await client.get(path, headers=vu.headers)
+    return [_sample(scenario, started, response.status_code == 200, response.status_code, response)]
+
+async def _history(client, vu):
+    return await _get(client, vu, "/api/history/", "history")
+
+async def _notifications(client, vu):
+    return await _get(client, vu, "/api/notifications/", "notifications")
+
+async def _upload(client, vu, timeout):
+    started = time.perf_counter()
+    name = f"invoice-{vu.index}-{vu.rng.randrange(10**9)}.pdf"
+    response = await client.post("/api/documents/", headers=vu.headers,
+                                 files={"file": (name, SAMPLE_PDF, "application/pdf")})
+    samples = [_sample("upload", started, response.status_code == 201, response.status_code, response)]
+    if response.status_code != 201:
+        return samples
+
+    # Queue + Document AI + audit: until the worker marks the document done
+    document_id = response.json()["id"]
+    status = "PENDING"
+    while time.perf_counter() - started < timeout:
+        await asyncio.sleep(UPLOAD_POLL_SECONDS)
+        detail = await client.get(f"/api/documents/{document_id}/", headers=vu.headers)
+        status = detail.json().get("status") if detail.status_code == 200 else "ERROR"
+        if status != "PENDING":
+            break
+    samples.append(_sample("document_processed", started, status in ("VALID", "FLAGGED"), status))
+    return samples
+
+async def _user_loop(client, vu, mix, deadline, think_seconds, upload_timeout, samples):
+    scenarios, weights = list(mix), list(mix.values())
+    handlers = {
+        "chat": _chat,
+        "chat_async": _chat_async,
+        "chat_stream": _chat_stream,
+        "history": _history,
+        "notifications": _notifications,
+        "upload": lambda c, v: _upload(c, v, upload_timeout),
+    }
+    while time.perf_counter() < deadline:
+        scenario = vu.rng.choices(scenarios, weights)[0]
+        started = time.perf_counter()
+        try:
+            samples.extend(await handlers[scenario](client, vu))
+        except Exception as e:
+            samples.append(_sample(scenario, started, False, error=str(e)[:200] or type(e).__name__))
+            await asyncio.sleep(ERROR_BACKOFF_SECONDS)
+            continue
+        if think_seconds:
+            await asyncio.sleep(vu.rng.expovariate(1 / think_seconds))
+
+async def _arun(base_url, tokens, mix, duration, think_seconds, ramp_seconds, upload_timeout, seed, discuss_docs, timeout):
+    import httpx
+
+    samples = []
+    limits = httpx.Limits(max_connections=len(tokens) * 2, max_keepalive_connections=len(tokens))
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def start(i, token):
+            # Spread user start times over the ramp so the server is not hit by a wall
+            await asyncio.sleep(ramp_seconds * i / max(1, len(tokens)))
+            vu = _VirtualUser(i, token, random.Random(f"{seed}:{i}"), discuss_docs)
+            await _user_loop(client, vu, mix, deadline, think_seconds, upload_timeout, samples)
+
+        await asyncio.gather(*(start(i, t) for i, t in enumerate(tokens)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+def run(base_url, tokens, mix, duration=60, think_seconds=1.0, ramp_seconds=5.0, upload_timeout=120,
+        seed=0, discuss_docs=(), timeout=120):
+    """Drives the mix with one virtual user per token. Returns (samples, elapsed_seconds)."""
+    return asyncio.run(_arun(base_url, tokens, mix, duration, think_seconds, ramp_seconds, upload_timeout,
+                             seed, list(discuss_docs), timeout))
+
+def report(samples, elapsed):
+    """
+    Per scenario: requests, errors, throughput and latency percentiles (ms), plus the
+    server's per-stage Server-Timing percentiles and, for chat_stream, time to first token.
+    """
+    scenarios = {}
+    for s in samples:
+        scenarios.setdefault(s["scenario"], []).append(s)
+    result = {"elapsed_seconds": round(elapsed, 2), "requests": len(samples), "scenarios": {}}
+    ok_total = 0
+    for name, items in sorted(scenarios.items()):
+        ok = [s for s in items if s["ok"]]
+        ok_total += len(ok)
+        stages = {}
+        for s in ok:
+            for stage, ms in s["stages"].items():
+                stages.setdefault(stage, []).append(ms)
+        entry = {
+            "requests": len(items),
+            "errors": len(items) - len(ok),
+            "throughput_per_second": round(len(ok) / elapsed, 2) if elapsed else None,
+            "latency_ms": summarize([s["seconds"] * 1000 for s in ok], digits=1),
+            "stages_ms": {stage: summarize(values, digits=1) for stage, values in sorted(stages.items())},
+        }
+        first_tokens = [s["first_token_seconds"] * 1000 for s in ok if s.get("first_token_seconds") is not None]
+        if first_tokens:
+            entry["first_token_ms"] = summarize(first_tokens, digits=1)
+        statuses = {}
+        for s in items:
+            if not s["ok"]:
+                key = str(s.get("error") or s.get("status") or "error")
+                statuses[key] = statuses.get(key, 0) + 1
+        if statuses:
+            entry["error_kinds"] = statuses
+        result["scenarios"][name] = entry
+    result["throughput_per_second"] = round(ok_total / elapsed, 2) if elapsed else None
+    return result
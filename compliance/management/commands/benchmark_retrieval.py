@@ -0,0 +1,126 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from compliance import retrieval_bench as bench
+
+class Command(BaseCommand):
+    help = ('Benchmarks search_laws retrieval (latency percentiles, QPS, recall@k vs exact search) on a seeded '
+            'synthetic corpus with a local stand-in embedder, for each corpus size and index configuration. '
+            'Run against a scratch database: index builds affect the whole embedding table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000', help='Comma-separated corpus sizes, e.g. 10000,100000,1000000.')
+        parser.add_argument('--index', action='append', dest='indexes',
+                            help="Index configuration (repeatable): none, hnsw[:m=16,ef_construction=64], "
+                                 "ivfflat[:lists=100]. Default: none, hnsw, ivfflat.")
+        parser.add_argument('--ef-search', default='40,100', help='HNSW ef_search values to try per hnsw index.')
+        parser.add_argument('--probes', default='1,10', help='IVFFlat probes values to try per ivfflat index.')
+        parser.add_argument('--modes', default='vector,hybrid', help='search_laws modes to measure (vector, hybrid).')
+        parser.add_argument('--queries', type=int, default=200, help='Queries per measurement.')
+        parser.add_argument('--filter-share', type=float, default=0.2, help='Share of queries with a source filter (discussDoc).')
+        parser.add_argument('--k', type=int, default=5, help='Results per query (chat uses 5).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads for the QPS run.')
+        parser.add_argument('--dimensions', type=int, default=bench.DEFAULT_DIMENSIONS)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None, help='Write the JSON report here (default: stdout).')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic collection afterwards.')
+        parser.add_argument('--force', action='store_true', help='Run even though the real knowledge-base collection has rows.')
+
+    def log(self, message):
+        # Progress goes to stderr so stdout stays valid JSON
+        self.stderr.write(message)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(s) for s in options['sizes'].split(',') if s.strip())
+            configs = [bench.parse_index_config(spec) for spec in (options['indexes'] or ['none', 'hnsw', 'ivfflat'])]
+            ef_values = [int(v) for v in options['ef_search'].split(',') if v.strip()]
+            probe_values = [int(v) for v in options['probes'].split(',') if v.strip()]
+        except ValueError as e:
+            raise CommandError(f"[Error] {e}")
+        modes = [m.strip() for m in options['modes'].split(',') if m.strip()]
+        if not sizes or not modes or options['queries'] < 1:
+            raise CommandError("[Error] Need at least one size, one mode and one query.")
+
+        if connection.vendor != 'postgresql':
+            raise CommandError("[Error] The retrieval benchmark needs PostgreSQL with pgvector (DATABASE_URL).")
+        if bench.real_collection_size() and not options['force']:
+            raise CommandError("[Error] The knowledge-base collection is not empty: point DATABASE_URL at a scratch "
+                               "database (index builds affect the whole table) or pass --force.")
+
+        k = options['k']
+        embedder = bench.HashEmbeddings(dimensions=options['dimensions'], seed=options['seed'])
+        report = {
+            "meta": {
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "git_commit": self.git_commit(),
+                "seed": options['seed'],
+                "dimensions": options['dimensions'],
+                "k": k,
+                "queries": options['queries'],
+                "filter_share": options['filter_share'],
+                "concurrency": options['concurrency'],
+                **bench.server_info(),
+            },
+            "results": [],
+        }
+
+        bench.drop_corpus()
+        try:
+            for size in sizes:
+                # Load without an ANN index (maintaining one during COPY is far slower)
+                bench.apply_index('none', {}, options['dimensions'], log=self.log)
+                load_seconds = bench.load_corpus(embedder, options['seed'], size, log=self.log)
+                if 'hybrid' in modes:
+                    bench.ensure_fts_index(log=self.log)
+                queries = bench.synthetic_queries(options['seed'], size, options['queries'], options['filter_share'])
+                query_vectors = [embedder.embed_query(text) for text, _ in queries]
+                truth = bench.ground_truth(query_vectors, queries, k)
+
+                for method, params in configs:
+                    build_seconds = bench.apply_index(method, params, options['dimensions'], log=self.log)
+                    settings_to_try = (
+                        [{"ef_search": v} for v in ef_values] if method == 'hnsw'
+                        else [{"probes": v} for v in probe_values] if method == 'ivfflat'
+                        else [{}]
+                    )
+                    for knobs in settings_to_try:
+                        for mode in modes:
+                            self.log(f"[Bench] size={size} index={method}{params or ''} {knobs or ''} mode={mode}")
+                            result = bench.measure(query_vectors, queries, truth, k, mode=mode,
+                                                   concurrency=options['concurrency'], **knobs)
+                            report["results"].append({
+                                "size": size,
+                                "index": method,
+                                "index_params": params,
+                                "mode": mode,
+                                "ef_search": knobs.get("ef_search"),
+                                "probes": knobs.get("probes"),
+                                "load_seconds": round(load_seconds, 2),
+                                "build_seconds": round(build_seconds, 2),
+                                **result,
+                            })
+        except Exception as e:
+            raise CommandError(f"[Error] Benchmark failed: {e}")
+        finally:
+            if not options['keep']:
+                bench.drop_corpus()
+
+        report["meta"]["finished_at"] = datetime.now(timezone.utc).isoformat()
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+            self.log(self.style.SUCCESS(f"[Done] {len(report['results'])} measurements written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, timeout=5).stdout.strip() or None
+        except Exception:
+            return None
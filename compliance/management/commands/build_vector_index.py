@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from compliance.vector_index import build_index, build_fts_index, build_metadata_index, INDEX_METHODS
+
+class Command(BaseCommand):
+    help = 'Builds (or rebuilds) an HNSW/IVFFlat ANN index and the full-text index on langchain_pg_embedding for legal_docs_vectors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=INDEX_METHODS, default='hnsw')
+        parser.add_argument('--m', type=int, default=16, help='HNSW: max connections per layer (default 16).')
+        parser.add_argument('--ef-construction', type=int, default=64, help='HNSW: build candidate list size (default 64).')
+        parser.add_argument('--lists', type=int, default=None, help='IVFFlat: number of lists (default rows/1000, min 10).')
+        parser.add_argument('--dimensions', type=int, default=None, help='Vector size if the column is untyped (auto-detected).')
+        parser.add_argument('--rebuild', action='store_true', help='Drop and recreate the index (e.g. after changing parameters).')
+        parser.add_argument('--no-concurrently', action='store_true', help='Build with a table lock instead of CONCURRENTLY (faster, blocks writes).')
+        parser.add_argument('--maintenance-work-mem', default=None, help="e.g. '1GB'; HNSW builds much faster when the graph fits in memory.")
+        parser.add_argument('--skip-fts', action='store_true', help='Do not build the full-text index used by hybrid search.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"[Start] Building {options['method']} index..."))
+        started = time.perf_counter()
+        try:
+            name = build_index(
+                method=options['method'],
+                m=options['m'],
+                ef_construction=options['ef_construction'],
+                lists=options['lists'],
+                dimensions=options['dimensions'],
+                rebuild=options['rebuild'],
+                concurrently=not options['no_concurrently'],
+                maintenance_work_mem=options['maintenance_work_mem'],
+                log=self.stdout.write,
+            )
+            if not options['skip_fts']:
+                build_fts_index(concurrently=not options['no_concurrently'], log=self.stdout.write)
+            build_metadata_index(concurrently=not options['no_concurrently'], log=self.stdout.write)
+        except Exception as e:
+            raise CommandError(f"[Error] Index build failed: {e}")
+        self.stdout.write(self.style.SUCCESS(f"[Done] {name} ready in {time.perf_counter() - started:.1f}s"))
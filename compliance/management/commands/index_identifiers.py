@@ -0,0 +1,57 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from compliance.identifiers import extract_identifiers
+from compliance.ingest_to_db import chunk_metadata
+from compliance.vector_index import EMBEDDING_TABLE, COLLECTION_TABLE, COLLECTION_NAME
+
+class Command(BaseCommand):
+    help = 'Backfills identifier metadata (circular/notification/section numbers) on already-ingested chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(self.style.SUCCESS("[Start] Indexing identifiers for existing chunks..."))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT e.id, e.document, e.cmetadata
+                FROM {EMBEDDING_TABLE} AS e
+                JOIN {COLLECTION_TABLE} AS c ON e.collection_id = c.uuid
+                WHERE c.name = %s
+                """,
+                [COLLECTION_NAME],
+            )
+            rows = cursor.fetchall()
+
+        # Document-level identifiers come from the index CSV; the header fallback may only
+        # read a document's first chunk, which older rows without chunk_index cannot name
+        doc_metadata = {}
+        for chunk_id, document, metadata in rows:
+            metadata = metadata or {}
+            source = metadata.get('source', '')
+            if source not in doc_metadata or metadata.get('chunk_index') == 0:
+                head = document or '' if metadata.get('chunk_index') == 0 else ''
+                doc_metadata[source] = chunk_metadata(source, metadata.get('category'), head)
+
+        updates = []
+        for chunk_id, document, metadata in rows:
+            source = (metadata or {}).get('source', '')
+            patch = dict(doc_metadata[source], identifiers=extract_identifiers(document or ''))
+            updates.append((json.dumps(patch), chunk_id))
+
+        updated = 0
+        for start in range(0, len(updates), batch_size):
+            batch = updates[start:start + batch_size]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(
+                    f"UPDATE {EMBEDDING_TABLE} SET cmetadata = COALESCE(cmetadata, '{{}}'::jsonb) || %s::jsonb WHERE id = %s",
+                    batch,
+                )
+            updated += len(batch)
+            self.stdout.write(f"   ({updated}/{len(updates)} chunks)")
+
+        self.stdout.write(self.style.SUCCESS(f"[Done] Indexed identifiers on {updated} chunks across {len(doc_metadata)} documents."))
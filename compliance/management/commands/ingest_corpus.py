@@ -0,0 +1,102 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from compliance.ingest_to_db import (
+    file_sha256, get_embeddings, is_unchanged, load_chunks, load_knowledge_base_index, replace_document,
+)
+
+CATEGORIES = ("acts", "circulars", "notifications")
+
+class Command(BaseCommand):
+    help = 'Bulk-ingests data/raw_pdfs/{acts,circulars,notifications} into the knowledge base.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', default=os.path.join(settings.BASE_DIR, 'data', 'raw_pdfs'))
+        parser.add_argument('--category', choices=CATEGORIES, action='append',
+                            help='Only ingest these folders (repeatable). Default: all.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Processes used to parse and chunk PDFs.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many files.')
+        parser.add_argument('--force', action='store_true', help='Re-ingest files even if their content hash is unchanged.')
+
+    def collect_files(self, root, categories):
+        """(path, category) for every PDF; category comes from knowledge_base_index.csv when listed."""
+        index = load_knowledge_base_index()
+        files = []
+        for folder in categories:
+            folder_path = os.path.join(root, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for name in sorted(os.listdir(folder_path)):
+                if name.lower().endswith('.pdf'):
+                    category = index.get(name, {}).get('category') or folder
+                    files.append((os.path.join(folder_path, name), category))
+        return files
+
+    def handle(self, *args, **options):
+        files = self.collect_files(options['root'], options['category'] or CATEGORIES)
+        if options['limit']:
+            files = files[:options['limit']]
+        if not files:
+            raise CommandError(f"[Error] No PDFs found under {options['root']}")
+
+        # Unchanged files are skipped before any parsing or embedding
+        hashes = {path: file_sha256(path) for path, _ in files}
+        skipped = 0
+        if not options['force']:
+            pending = [(p, c) for p, c in files if not is_unchanged(os.path.basename(p), hashes[p])]
+            skipped = len(files) - len(pending)
+            files = pending
+        if skipped:
+            self.stdout.write(f"   (Skipping {skipped} unchanged files)")
+        if not files:
+            self.stdout.write(self.style.SUCCESS("[Done] Knowledge base already up to date."))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"[Start] Ingesting {len(files)} PDFs with {options['workers']} parser processes..."
+        ))
+        embeddings = get_embeddings()
+        # Forked workers must not inherit open DB connections
+        connections.close_all()
+
+        started = time.perf_counter()
+        total_pages = total_chunks = failed = 0
+        queued = iter(files)
+        # Parsed chunk lists wait here for embedding: cap them at two per parser process
+        max_in_flight = 2 * options['workers']
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {}
+
+            def submit_more():
+                for path, category in queued:
+                    futures[pool.submit(load_chunks, path, category)] = (path, category)
+                    if len(futures) >= max_in_flight:
+                        return
+
+            submit_more()
+            # Parsing of later files overlaps with embedding/inserting finished ones
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                future = next(iter(done))
+                path, category = futures.pop(future)
+                submit_more()
+                try:
+                    chunks, pages = future.result()
+                    written = replace_document(os.path.basename(path), category, hashes[path], chunks, embeddings=embeddings)
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"[Error] {os.path.basename(path)}: {e}"))
+                    continue
+                total_pages += pages
+                total_chunks += written
+                self.stdout.write(f"   {os.path.basename(path)}: {pages} pages, {written} chunks")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"[Done] {len(files) - failed}/{len(files)} files ({skipped} unchanged skipped), {total_pages} pages, {total_chunks} chunks "
+            f"in {elapsed:.1f}s ({total_pages / elapsed:.1f} pages/s, {total_chunks / elapsed:.1f} chunks/s)"
+        ))
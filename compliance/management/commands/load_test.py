@@ -0,0 +1,107 @@
+import json
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from compliance import load_test
+from compliance.models import GlobalNotification
+
+class Command(BaseCommand):
+    help = ('Replays a chat/dashboard/upload traffic mix against a running server and reports throughput and tail '
+            'latency per scenario and per Server-Timing stage. Start the server (and run_workers) with '
+            'GENAI_BACKEND=fake DOCAI_BACKEND=fake STORAGE_BACKEND=local to avoid Google quota.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run.')
+        parser.add_argument('--think', type=float, default=1.0, help='Mean think time between a user\'s requests (0 = none).')
+        parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which users start.')
+        parser.add_argument('--mix', default=load_test.DEFAULT_MIX,
+                            help=f'Scenario weights, e.g. "{load_test.DEFAULT_MIX}". Scenarios: {", ".join(load_test.SCENARIOS)}.')
+        parser.add_argument('--anonymous', action='store_true', help='Send no credentials (drops history and upload).')
+        parser.add_argument('--upload-timeout', type=float, default=120, help='Seconds to wait for an upload to be processed.')
+        parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--seed-corpus', type=int, default=0,
+                            help='Load this many synthetic chunks into an EMPTY knowledge base first '
+                                 '(embedded like the fake backend, FAKE_EMBED_SEED).')
+        parser.add_argument('--output', default=None, help='Write the JSON report here (default: stdout).')
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def handle(self, *args, **options):
+        try:
+            mix = load_test.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(f"[Error] {e}")
+        if options['users'] < 1 or options['duration'] <= 0:
+            raise CommandError("[Error] Need at least one user and a positive duration.")
+        if options['anonymous']:
+            mix = {name: w for name, w in mix.items() if name not in ('history', 'upload')}
+            if not mix:
+                raise CommandError("[Error] Nothing left to run anonymously: add chat, chat_stream or notifications.")
+
+        if options['seed_corpus']:
+            self.seed_corpus(options['seed_corpus'])
+
+        tokens = [None] * options['users'] if options['anonymous'] else load_test.prepare_users(options['users'])
+        discuss_docs = list(GlobalNotification.objects.order_by('-created_at').values_list('doc_name', flat=True)[:20])
+
+        self.log(self.style.SUCCESS(
+            f"[Start] {options['users']} users for {options['duration']:.0f}s against {options['base_url']} "
+            f"(mix: {', '.join(f'{k}={v:g}' for k, v in mix.items())})"
+        ))
+        samples, elapsed = load_test.run(
+            options['base_url'], tokens, mix,
+            duration=options['duration'],
+            think_seconds=options['think'],
+            ramp_seconds=options['ramp'],
+            upload_timeout=options['upload_timeout'],
+            seed=options['seed'],
+            discuss_docs=discuss_docs,
+            timeout=options['timeout'],
+        )
+        result = load_test.report(samples, elapsed)
+        result["meta"] = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "base_url": options['base_url'],
+            "users": options['users'],
+            "duration": options['duration'],
+            "think_seconds": options['think'],
+            "mix": mix,
+            "seed": options['seed'],
+        }
+
+        for name, entry in result["scenarios"].items():
+            latency = entry["latency_ms"]
+            self.log(f"   {name:<20} {entry['requests']:>6} req  {entry['errors']:>4} err  "
+                     f"{entry['throughput_per_second'] or 0:>7.2f}/s  p50 {latency['p50']} ms  "
+                     f"p95 {latency['p95']} ms  p99 {latency['p99']} ms")
+        self.log(self.style.SUCCESS(f"[Done] {result['throughput_per_second']} successful requests/s overall"))
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def seed_corpus(self, size):
+        from django.db import connection
+        from compliance import fake_backends, retrieval_bench
+        from compliance.vector_index import COLLECTION_NAME
+
+        if connection.vendor != 'postgresql':
+            raise CommandError("[Error] --seed-corpus needs PostgreSQL with pgvector.")
+        if getattr(settings, 'GENAI_BACKEND', 'vertex') != 'fake':
+            self.log(self.style.WARNING("[Warn] GENAI_BACKEND is not 'fake': real query embeddings will not match the synthetic corpus."))
+        have = retrieval_bench.real_collection_size()
+        if have and have < size:
+            raise CommandError(f"[Error] The knowledge base already has {have} chunks; --seed-corpus only fills an empty one.")
+        if have:
+            return
+        embedder = retrieval_bench.HashEmbeddings(seed=fake_backends.EMBED_SEED)
+        seconds = retrieval_bench.load_corpus(embedder, fake_backends.EMBED_SEED, size, log=self.log,
+                                              collection_name=COLLECTION_NAME)
+        self.log(f"[Seed] Loaded {size} synthetic chunks in {seconds:.1f}s")
@@ -0,0 +1,113 @@
+import json
+import subprocess
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from compliance import query_replay
+
+class Command(BaseCommand):
+    help = ('Replays past chat questions (ComplianceQuery, whole conversations) through retrieval, the answer cache '
+            'and prompt building with generation stubbed, and reports per-stage latency percentiles and cache hit '
+            'rates. Use --export to freeze an anonymized sample and --input to replay it against later commits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=200, help='Conversations to sample (0 = all).')
+        parser.add_argument('--days', type=int, default=None, help='Only conversations from the last N days.')
+        parser.add_argument('--max-turns', type=int, default=None, help='Replay at most this many turns per conversation.')
+        parser.add_argument('--seed', type=int, default=42, help='Sampling seed (same seed, same conversations).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Conversations replayed at the same time.')
+        parser.add_argument('--generate-latency', type=float, default=0.0,
+                            help='Seconds each uncached turn holds its thread in place of the Gemini call.')
+        parser.add_argument('--store-answers', action='store_true',
+                            help='Store the recorded answers in the answer cache (as live traffic would). '
+                                 'Writes to the AnswerCacheEntry table.')
+        parser.add_argument('--no-anonymize', action='store_true', help='Keep the text and ids as stored.')
+        parser.add_argument('--export', default=None, help='Write the sampled workload (JSONL) here and exit.')
+        parser.add_argument('--input', default=None, help='Replay a workload file written by --export instead of sampling.')
+        parser.add_argument('--output', default=None, help='Write the JSON report here (default: stdout).')
+
+    def log(self, message):
+        # Progress goes to stderr so stdout stays valid JSON
+        self.stderr.write(message)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("[Error] --concurrency must be at least 1.")
+        if options['input']:
+            try:
+                conversations = query_replay.read_workload(options['input'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"[Error] Cannot read workload {options['input']}: {e}")
+            if options['max_turns']:
+                for conversation in conversations:
+                    conversation['turns'] = conversation['turns'][:options['max_turns']]
+        else:
+            since = datetime.now(timezone.utc) - timedelta(days=options['days']) if options['days'] else None
+            conversations = query_replay.sample_conversations(
+                count=options['conversations'] or None,
+                since=since,
+                seed=options['seed'],
+                max_turns=options['max_turns'],
+                anonymized=not options['no_anonymize'],
+            )
+        turns = sum(len(c['turns']) for c in conversations)
+        if not turns:
+            raise CommandError("[Error] No chat history to replay.")
+
+        if options['export']:
+            query_replay.write_workload(conversations, options['export'])
+            self.log(self.style.SUCCESS(f"[Done] Wrote {len(conversations)} conversations ({turns} turns) to {options['export']}"))
+            return
+
+        if connection.vendor != 'postgresql':
+            self.log(self.style.WARNING("[Warn] Not PostgreSQL: knowledge-base search and the answer cache will not work."))
+        self.log(self.style.SUCCESS(
+            f"[Start] Replaying {len(conversations)} conversations ({turns} turns) with concurrency {options['concurrency']}"
+        ))
+        before = query_replay.cache_stats()
+        samples, elapsed = query_replay.replay(
+            conversations,
+            concurrency=options['concurrency'],
+            store_answers=options['store_answers'],
+            generate_seconds=options['generate_latency'],
+            log=self.log,
+        )
+        result = query_replay.report(samples, elapsed, before, query_replay.cache_stats())
+        result["meta"] = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": self.git_commit(),
+            "source": options['input'] or "ComplianceQuery",
+            "conversations": options['conversations'],
+            "days": options['days'],
+            "max_turns": options['max_turns'],
+            "seed": options['seed'],
+            "concurrency": options['concurrency'],
+            "generate_latency": options['generate_latency'],
+            "store_answers": options['store_answers'],
+            "genai_backend": getattr(settings, 'GENAI_BACKEND', 'vertex'),
+        }
+
+        for stage, summary in result["stages_ms"].items():
+            self.log(f"   {stage:<20} p50 {summary['p50']} ms  p95 {summary['p95']} ms  p99 {summary['p99']} ms")
+        caches = result["caches"]
+        self.log(f"   answer cache hit rate {caches['answer_cache']['hit_rate']}  "
+                 f"embedding cache hit rate {caches['embedding_cache']['hit_rate']}  "
+                 f"single-flight follower rate {caches['single_flight']['follower_rate']}")
+        self.log(self.style.SUCCESS(
+            f"[Done] {result['turns']} turns, {result['errors']} errors, p95 {result['latency_ms']['p95']} ms"
+        ))
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, timeout=5).stdout.strip() or None
+        except Exception:
+            return None
@@ -0,0 +1,53 @@
+import multiprocessing
+import os
+import signal
+import socket
+from django.core.management.base import BaseCommand
+from django.db import connections
+from compliance.jobs import work
+
+def _worker_main(worker_id, stop_event, poll_interval, burst):
+    # Each process opens its own DB connection; the parent's was closed before fork.
+    # The parent owns shutdown: a group-wide SIGINT/SIGTERM must not kill a worker
+    # mid-job (or while it holds stop_event's lock, which would hang the parent).
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(worker_id, stop_event=stop_event, poll_interval=poll_interval, burst=burst)
+
+class Command(BaseCommand):
+    help = 'Runs background job workers (document processing etc.) against the Postgres job queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=int(os.getenv('JOB_WORKERS', '2')),
+                            help='Worker processes to run on this node (default: JOB_WORKERS or 2).')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds between polls when idle.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        hostname = socket.gethostname()
+        count = max(1, options['workers'])
+        self.stdout.write(self.style.SUCCESS(f"[Start] Starting {count} job workers on {hostname}..."))
+
+        # Forked workers must not inherit open DB connections
+        connections.close_all()
+        stop_event = multiprocessing.Event()
+        processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(f"{hostname}:{os.getpid()}:{i}", stop_event, options['poll_interval'], options['burst']),
+                daemon=False,
+            )
+            for i in range(count)
+        ]
+        for p in processes:
+            p.start()
+
+        def shutdown(signum, frame):
+            self.stdout.write("[Stop] Finishing in-flight jobs...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        for p in processes:
+            p.join()
+        self.stdout.write(self.style.SUCCESS("[Done] All job workers stopped."))
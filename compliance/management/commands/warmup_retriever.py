@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+from compliance.retriever import warmup
+
+class Command(BaseCommand):
+    help = 'Builds the retriever embedder and vector store and opens the DB connection ahead of traffic.'
+
+    def handle(self, *args, **options):
+        report = warmup()
+        if not report["ready"]:
+            raise CommandError(f"[Error] Retriever warmup failed: {report['error']}")
+        self.stdout.write(self.style.SUCCESS("[Done] Retriever is warm (embeddings + vector store)."))
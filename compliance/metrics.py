@@ -0,0 +1,307 @@
+"""
+ComplyFlow - Latency Metrics
+
+Per-stage timing for the chat and document pipelines. Code wraps a stage in
+span("name") (a context manager, or a decorator); each sampled span is recorded in a
+process-wide latency histogram and, inside a request, reported back to the client in
+the Server-Timing response header (ServerTimingMiddleware), so a slow answer can be
+pinned on embedding, the pgvector scan, Gemini or the history save from the browser's
+network panel. /metrics serves the histograms and the existing cache/pool counters in
+Prometheus text format.
+
+Sampling is per request (per span outside a request, e.g. the job worker):
+- METRICS_SAMPLE_RATE: fraction of requests timed (default 1.0, 0 = off). An unsampled
+  span is one context variable read.
+- METRICS_TOKEN: if set, /metrics serves "Authorization: Bearer <token>" scrapes.
+- METRICS_ALLOWED_IPS: comma-separated client addresses (REMOTE_ADDR) served without
+  a token. Staff sessions are always served; anyone else gets a 404, so with neither
+  setting /metrics is closed to scrapers.
+
+Metrics are per process: with several gunicorn workers each scrape sees one worker.
+
+Functions:
+- span: Time a stage (context manager / decorator).
+- observe: Record a duration for a stage directly.
+- collect_spans: Capture every span in a block, as for a sampled request (replays).
+- server_timing: Server-Timing header value for the current request's spans.
+- render: All metrics in Prometheus text exposition format.
+- percentile / summarize: Percentiles of raw samples (benchmarks, load tests).
+- parse_server_timing: Stage durations from a Server-Timing header.
+- metrics_view: The /metrics endpoint.
+
+Classes:
+- Histogram: Fixed-bucket latency histogram.
+- ServerTimingMiddleware: Samples requests, times them and adds Server-Timing.
+"""
+
+import bisect
+import hmac
+import contextvars
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+
+SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOWED_IPS = {ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "").split(",") if ip.strip()}
+# Seconds; spans from ~1 ms cache hits up to slow Document AI calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# None: not in a request; False: request not sampled; list: this request's (name, seconds)
+_request_spans = contextvars.ContextVar("complyflow_request_spans", default=None)
+
+class Histogram:
+    """Counts observations into BUCKETS (non-cumulative internally), plus sum and count."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts incl. +Inf, sum, count)."""
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative, running = [], 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+_lock = threading.Lock()
+_stages = {}     # stage -> Histogram
+_requests = {}   # (view, method, status class) -> Histogram
+
+def _histogram(registry, key):
+    histogram = registry.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = registry.setdefault(key, Histogram())
+    return histogram
+
+def _sampled():
+    return SAMPLE_RATE >= 1 or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE)
+
+def observe(name, seconds):
+    """Records a duration measured elsewhere (e.g. time to first token) as stage 'name'."""
+    spans = _request_spans.get()
+    if spans is False:
+        return
+    _histogram(_stages, name).observe(seconds)
+    if spans is not None:
+        spans.append((name, seconds))
+
+@contextmanager
+def span(name):
+    """
+    Times the enclosed block as stage 'name'. Usable as `with span("retrieve"):` or
+    as a decorator. Exceptions propagate; the time spent is still recorded.
+    """
+    spans = _request_spans.get()
+    if spans is False or (spans is None and not _sampled()):
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _histogram(_stages, name).observe(elapsed)
+        if spans is not None:
+            spans.append((name, elapsed))
+
+@contextmanager
+def collect_spans():
+    """
+    Times every span in the enclosed block, as inside a sampled request, and yields the
+    list they are appended to as (name, seconds). For offline replays and benchmarks.
+    """
+    spans = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples (None if empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(samples, digits=3):
+    """p50/p95/p99/mean/max of a list of samples."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(samples, 50), digits),
+        "p95": round(percentile(samples, 95), digits),
+        "p99": round(percentile(samples, 99), digits),
+        "mean": round(sum(samples) / len(samples), digits),
+        "max": round(max(samples), digits),
+    }
+
+def parse_server_timing(value):
+    """{name: milliseconds} from a Server-Timing header value."""
+    timings = {}
+    for entry in (value or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        match = re.search(r"dur=([0-9.]+)", params)
+        if name and match:
+            timings[name] = float(match.group(1))
+    return timings
+
+def server_timing(spans, total=None):
+    """Server-Timing value: one entry per stage (repeated stages summed), then 'total'."""
+    durations, counts = {}, {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+        counts[name] = counts.get(name, 0) + 1
+    entries = []
+    for name, seconds in durations.items():
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if counts[name] > 1:
+            entry += f';desc="x{counts[name]}"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+class ServerTimingMiddleware:
+    """
+    Samples each request (METRICS_SAMPLE_RATE); for a sampled one, records its latency
+    by view and adds a Server-Timing header listing the stages timed while it ran. A
+    streaming response only carries the stages finished before its first byte.
+    Works under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            spans = _request_spans.get()
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, started)
+
+    async def __acall__(self, request):
+        token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            spans = _request_spans.get()
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, started)
+
+    def _start(self):
+        return _request_spans.set([] if _sampled() else False), time.perf_counter()
+
+    def _finish(self, request, response, spans, started):
+        if spans is False:
+            return response
+        total = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        _histogram(_requests, (view, request.method, f"{response.status_code // 100}xx")).observe(total)
+        response["Server-Timing"] = server_timing(spans, total)
+        # Cross-origin pages (the frontend) may only read it with Timing-Allow-Origin
+        allowed_origin = response.get("Access-Control-Allow-Origin")
+        if allowed_origin:
+            response["Timing-Allow-Origin"] = allowed_origin
+        return response
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _render_histogram(lines, metric, help_text, registry, label_names):
+    lines.append(f"# HELP {metric} {help_text}")
+    lines.append(f"# TYPE {metric} histogram")
+    with _lock:
+        items = sorted(registry.items())
+    for key, histogram in items:
+        values = key if isinstance(key, tuple) else (key,)
+        labels = ",".join(f'{n}="{_label(v)}"' for n, v in zip(label_names, values))
+        cumulative, total, count = histogram.snapshot()
+        for bound, c in zip(list(histogram.buckets) + ["+Inf"], cumulative):
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {c}')
+        lines.append(f"{metric}_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{metric}_count{{{labels}}} {count}")
+
+def _stat_sources():
+    from .genai_clients import genai_client_stats
+    from .answer_cache import answer_cache_stats
+    from .single_flight import single_flight_stats
+    from .embedding_cache import embedding_cache_stats
+    from .authentication_backends import auth_cache_stats
+    return (
+        ("genai", genai_client_stats),
+        ("answer_cache", answer_cache_stats),
+        ("single_flight", single_flight_stats),
+        ("embedding_cache", embedding_cache_stats),
+        ("auth_cache", auth_cache_stats),
+    )
+
+def render():
+    """Prometheus text exposition (version 0.0.4) of this process's metrics."""
+    lines = []
+    _render_histogram(lines, "complyflow_stage_duration_seconds",
+                      "Time spent in each pipeline stage.", _stages, ("stage",))
+    _render_histogram(lines, "complyflow_request_duration_seconds",
+                      "Request latency by view, method and status class.", _requests, ("view", "method", "status"))
+    for prefix, stats in _stat_sources():
+        try:
+            data = stats()
+        except Exception as e:
+            print(f"[Metrics] {prefix} stats unavailable: {e}")
+            continue
+        for name, value in sorted(data.items()):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            metric = f"complyflow_{prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+def _metrics_allowed(request):
+    if METRICS_TOKEN and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return True
+    if request.META.get("REMOTE_ADDR") in METRICS_ALLOWED_IPS:
+        return True
+    user = getattr(request, "user", None)
+    return bool(user and user.is_active and user.is_staff)
+
+def metrics_view(request):
+    """Prometheus scrape endpoint (token, allow-listed address or staff session only)."""
+    if not _metrics_allowed(request):
+        if METRICS_TOKEN:
+            return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+        return HttpResponse("Not Found\n", status=404, content_type="text/plain")
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
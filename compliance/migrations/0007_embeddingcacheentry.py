@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:27
+
+import django.utils.timezone
+import pgvector.django.vector
+from pgvector.django import VectorExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0006_globalnotification_action_draft_and_more'),
+    ]
+
+    operations = [
+        VectorExtension(),
+        migrations.CreateModel(
+            name='EmbeddingCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('embedding', pgvector.django.vector.VectorField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'text_hash'), name='unique_embedding_cache_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0007_embeddingcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text="File name stored as chunk metadata 'source'", max_length=255, unique=True)),
+                ('category', models.CharField(max_length=50)),
+                ('content_hash', models.CharField(help_text='sha256 of the file bytes', max_length=64)),
+                ('chunk_count', models.PositiveIntegerField(default=0)),
+                ('source_url', models.CharField(blank=True, max_length=500, null=True)),
+                ('ingested_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
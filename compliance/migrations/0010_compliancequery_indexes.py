@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0009_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compliancequery',
+            index=models.Index(fields=['user', 'conversation_id', 'timestamp'], name='cq_user_conv_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='compliancequery',
+            index=models.Index(fields=['user', '-timestamp'], name='cq_user_ts_idx'),
+        ),
+    ]
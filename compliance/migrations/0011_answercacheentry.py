@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:43
+
+import django.utils.timezone
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0010_compliancequery_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.TextField()),
+                ('embedding', pgvector.django.vector.VectorField()),
+                ('profession', models.CharField(max_length=100)),
+                ('scope', models.CharField(blank=True, default='', help_text='discussDoc the answer was scoped to, if any', max_length=255)),
+                ('context_hash', models.CharField(help_text='sha256 of the retrieved chunk ids, in rank order', max_length=64)),
+                ('chunk_ids', models.JSONField(default=list)),
+                ('sources', models.JSONField(default=list)),
+                ('answer', models.TextField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['context_hash', 'profession', 'scope'], name='answer_cache_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:12
+
+import pgvector.django.vector
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0011_answercacheentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='answercacheentry',
+            name='embedding',
+            field=pgvector.django.vector.VectorField(blank=True, help_text='Question embedding; empty for exact-match (identifier) entries', null=True),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
+from pgvector.django import VectorField
 import uuid
 import os
 
@@ -74,6 +77,11 @@ class ComplianceQuery(models.Model):
     class Meta:
         verbose_name_plural = "Compliance Queries"
         ordering = ['-timestamp']
+        indexes = [
+            # Session listing (history_view) and conversation replay
+            models.Index(fields=['user', 'conversation_id', 'timestamp'], name='cq_user_conv_ts_idx'),
+            models.Index(fields=['user', '-timestamp'], name='cq_user_ts_idx'),
+        ]
     def __str__(self):
         return f"Query by {self.user.username} - {self.timestamp.strftime('%Y-%m-%d')}"
 
@@ -103,4 +111,98 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
-        instance.profile.save()
\ No newline at end of file
+        instance.profile.save()
+
+class Job(models.Model):
+    """
+    Postgres-backed background job (see compliance/jobs.py). Workers claim QUEUED rows
+    with SELECT ... FOR UPDATE SKIP LOCKED, so any number of processes can share the queue.
+    """
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    kind = models.CharField(max_length=100, help_text="Registered handler name, e.g. 'process_tax_document'")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only runnable rows are indexed, so the claim query stays small as history grows
+            models.Index(fields=['run_after'], name='job_queued_run_after_idx', condition=Q(status='QUEUED')),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.kind} ({self.status})"
+
+class EmbeddingCacheEntry(models.Model):
+    """Persistent tier of the embedding cache, keyed by (model, sha256 of the text)."""
+    model = models.CharField(max_length=100)
+    text_hash = models.CharField(max_length=64)
+    embedding = VectorField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'text_hash'], name='unique_embedding_cache_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.model}:{self.text_hash[:12]}"
+
+class IngestedDocument(models.Model):
+    """Registry of knowledge-base files, so unchanged files are skipped on re-ingestion."""
+    source = models.CharField(max_length=255, unique=True, help_text="File name stored as chunk metadata 'source'")
+    category = models.CharField(max_length=50)
+    content_hash = models.CharField(max_length=64, help_text="sha256 of the file bytes")
+    chunk_count = models.PositiveIntegerField(default=0)
+    source_url = models.CharField(max_length=500, null=True, blank=True)
+    ingested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.chunk_count} chunks)"
+
+class AnswerCacheEntry(models.Model):
+    """Semantic answer cache: a generated chat answer, reusable for similar questions over the same context."""
+    question = models.TextField()
+    embedding = VectorField(null=True, blank=True, help_text="Question embedding; empty for exact-match (identifier) entries")
+    profession = models.CharField(max_length=100)
+    scope = models.CharField(max_length=255, blank=True, default='', help_text="discussDoc the answer was scoped to, if any")
+    context_hash = models.CharField(max_length=64, help_text="sha256 of the retrieved chunk ids, in rank order")
+    chunk_ids = models.JSONField(default=list)
+    sources = models.JSONField(default=list)
+    answer = models.TextField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['context_hash', 'profession', 'scope'], name='answer_cache_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.question[:50]} ({self.hit_count} hits)"
+
+class StreamTicket(models.Model):
+    """Short-lived, single-use credential for an EventSource stream, which cannot send an Authorization header."""
+    ticket_hash = models.CharField(max_length=64, unique=True, help_text="sha256 of the ticket handed to the client")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stream_tickets')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Stream ticket for {self.user} (expires {self.expires_at})"
@@ -0,0 +1,254 @@
+"""
+ComplyFlow - Chat History Replay
+
+Replays real questions from ComplianceQuery through the chat pipeline up to the model
+call (retrieval, answer cache, prompt construction) with generation stubbed out, so
+retrieval and caching changes are measured against the production query distribution
+instead of synthetic prompts. `manage.py replay_queries` drives it.
+
+Conversations are sampled whole and replayed turn by turn, each turn with the recorded
+earlier turns as its history, so follow-up query expansion and history-dependent
+cache eligibility behave as they did live. Different conversations run concurrently.
+Nothing is saved to history and no Gemini call is made; the answer cache is only
+read unless asked to store the recorded answers.
+
+A sample can be anonymized (emails, phone numbers, PAN/GSTIN/Aadhaar and long account
+numbers masked; users and conversations replaced by opaque ids) and frozen to a JSONL
+workload file, so the same questions can be replayed against later commits or on
+another database. Free-text names are NOT detected: keep workload files internal.
+
+Functions:
+- anonymize: Mask personal identifiers in a message.
+- sample_conversations: Whole conversations from ComplianceQuery (seeded sample).
+- write_workload / read_workload: Freeze a sample to JSONL and read it back.
+- replay: Run the conversations at a given concurrency; returns per-turn samples.
+- cache_stats / report: Cache counters, latency percentiles per stage and hit rates.
+"""
+
+import hashlib
+import json
+import queue
+import random
+import re
+import threading
+import time
+from .metrics import collect_spans, span, summarize
+
+# Most specific first: a GSTIN contains a PAN, an Aadhaar number looks like a long number
+_PATTERNS = (
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "user@example.com"),
+    (re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b", re.IGNORECASE), "27ABCDE1234F1Z5"),
+    (re.compile(r"\b[A-Z]{5}\d{4}[A-Z]\b", re.IGNORECASE), "ABCDE1234F"),
+    (re.compile(r"\b\d{4}[ -]\d{4}[ -]\d{4}\b"), "XXXX XXXX XXXX"),
+    (re.compile(r"(?:\+91[\s-]?)?\b[6-9]\d{9}\b"), "9XXXXXXXXX"),
+    (re.compile(r"\b\d{9,18}\b"), "XXXXXXXXXX"),
+)
+
+def anonymize(text):
+    """Masks emails, GSTIN, PAN, Aadhaar, phone and account numbers (circular/section numbers are kept)."""
+    for pattern, replacement in _PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def _opaque_id(value):
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:16]
+
+def sample_conversations(count=None, since=None, seed=0, max_turns=None, anonymized=True):
+    """
+    Returns up to 'count' whole conversations (all of them if None), chosen at random
+    with 'seed', started after 'since' if given. Each is {"id", "profession", "turns":
+    [{"query", "response"}, ...]} in the order the messages were sent.
+    """
+    from .models import ComplianceQuery
+
+    rows = ComplianceQuery.objects.all()
+    if since is not None:
+        rows = rows.filter(timestamp__gte=since)
+    keys = sorted(set(rows.values_list("user_id", "conversation_id")), key=lambda k: (k[0], str(k[1])))
+    if count is not None and count < len(keys):
+        keys = random.Random(seed).sample(keys, count)
+
+    by_key = {key: [] for key in keys}
+    conversation_ids = sorted({str(c) for _, c in keys})
+    for start in range(0, len(conversation_ids), 500):
+        batch = (
+            ComplianceQuery.objects
+            .filter(conversation_id__in=conversation_ids[start:start + 500])
+            .order_by("timestamp", "id")
+            .values_list("user_id", "conversation_id", "query", "response", "user__profile__profession")
+        )
+        for user_id, conversation_id, query, response, profession in batch:
+            turns = by_key.get((user_id, conversation_id))
+            if turns is not None:
+                turns.append((query, response, profession))
+
+    conversations = []
+    for (user_id, conversation_id), turns in by_key.items():
+        if max_turns:
+            turns = turns[:max_turns]
+        if not turns:
+            continue
+        clean = anonymize if anonymized else (lambda text: text)
+        conversations.append({
+            "id": _opaque_id(f"{user_id}:{conversation_id}") if anonymized else str(conversation_id),
+            "profession": turns[0][2] or "User",
+            "turns": [{"query": clean(q), "response": clean(r)} for q, r, _ in turns],
+        })
+    return conversations
+
+def write_workload(conversations, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for conversation in conversations:
+            f.write(json.dumps(conversation, ensure_ascii=False) + "\n")
+
+def read_workload(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _replay_turn(conversation, index, store_answers, generate_seconds):
+    """Runs one turn through chat_view's stages (without save_query); returns its sample."""
+    from . import answer_cache
+    from .chat_pipeline import greeting_reply, retrieve, build_prompt
+
+    turns = conversation["turns"]
+    message = turns[index]["query"].strip()
+    history = []
+    for turn in turns[:index]:
+        history.append({"role": "user", "content": turn["query"]})
+        history.append({"role": "assistant", "content": turn["response"]})
+    sample = {"conversation": conversation["id"], "turn": index, "ok": True, "greeting": False,
+              "cacheable": False, "cache_hit": False, "prompt_chars": None, "stages": {}}
+
+    started = time.perf_counter()
+    with collect_spans() as spans:
+        try:
+            if greeting_reply(message, conversation["profession"]):
+                sample["greeting"] = True
+            else:
+                with span("retrieve"):
+                    retrieval = retrieve(message, history)
+                with span("answer_cache"):
+                    key = answer_cache.cache_key(message, history, conversation["profession"], retrieval["search_results"],
+                                                 exact=retrieval["identifier_match"],
+                                                 agent_context=retrieval["agent_context"])
+                    cached = answer_cache.lookup(key)
+                sample["cacheable"] = key is not None
+                sample["cache_hit"] = cached is not None
+                if cached is None:
+                    with span("prompt"):
+                        prompt = build_prompt(message, history, conversation["profession"], retrieval)
+                    sample["prompt_chars"] = len(prompt)
+                    # Generation stubbed: optionally hold the worker as long as the model would
+                    if generate_seconds:
+                        with span("generate"):
+                            time.sleep(generate_seconds)
+                    if store_answers:
+                        answer_cache.store(key, turns[index]["response"])
+        except Exception as e:
+            sample["ok"] = False
+            sample["error"] = f"{type(e).__name__}: {e}"[:200]
+    sample["seconds"] = time.perf_counter() - started
+    for name, seconds in spans:
+        sample["stages"][name] = sample["stages"].get(name, 0.0) + seconds * 1000
+    return sample
+
+def replay(conversations, concurrency=8, store_answers=False, generate_seconds=0.0, log=print):
+    """
+    Replays every conversation (turns in order) from 'concurrency' threads. Returns
+    (samples, elapsed seconds).
+    """
+    from django.db import connections
+
+    pending = queue.Queue()
+    for conversation in conversations:
+        pending.put(conversation)
+    samples, lock = [], threading.Lock()
+    total = sum(len(c["turns"]) for c in conversations)
+
+    def worker():
+        try:
+            while True:
+                try:
+                    conversation = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for index in range(len(conversation["turns"])):
+                    sample = _replay_turn(conversation, index, store_answers, generate_seconds)
+                    with lock:
+                        samples.append(sample)
+                        done = len(samples)
+                    if done % 100 == 0:
+                        log(f"[Replay] {done}/{total} turns")
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+def cache_stats():
+    """Current counters of the caches the chat path goes through (this process)."""
+    from .answer_cache import answer_cache_stats
+    from .embedding_cache import embedding_cache_stats
+    from .single_flight import single_flight_stats
+    return {
+        "answer_cache": answer_cache_stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "single_flight": single_flight_stats(),
+    }
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+def _cache_report(before, after):
+    delta = {
+        name: {k: v - before[name].get(k, 0) for k, v in counters.items()
+               if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        for name, counters in after.items()
+    }
+    answers, embeddings, flights = delta["answer_cache"], delta["embedding_cache"], delta["single_flight"]
+    embedded = embeddings["memory_hits"] + embeddings["db_hits"] + embeddings["misses"]
+    coalesced = flights["leaders"] + flights["followers"]
+    return {
+        "answer_cache": {**answers, "enabled": after["answer_cache"]["enabled"],
+                         "hit_rate": _rate(answers["hits"], answers["hits"] + answers["misses"])},
+        "embedding_cache": {**embeddings, "memory_entries": after["embedding_cache"]["memory_entries"],
+                            "hit_rate": _rate(embeddings["memory_hits"] + embeddings["db_hits"], embedded)},
+        "single_flight": {**flights, "follower_rate": _rate(flights["followers"], coalesced)},
+    }
+
+def report(samples, elapsed, stats_before, stats_after):
+    """
+    Turn latency and per-stage percentiles (ms), prompt sizes, answer-cache eligibility
+    and the cache counters' change over the run with hit rates.
+    """
+    ok = [s for s in samples if s["ok"]]
+    answered = [s for s in ok if not s["greeting"]]
+    stages = {}
+    for s in answered:
+        for stage, ms in s["stages"].items():
+            stages.setdefault(stage, []).append(ms)
+    errors = {}
+    for s in samples:
+        if not s["ok"]:
+            kind = s["error"].split(":", 1)[0]
+            errors[kind] = errors.get(kind, 0) + 1
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "conversations": len({s["conversation"] for s in samples}),
+        "turns": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_kinds": errors,
+        "greetings": sum(1 for s in ok if s["greeting"]),
+        "follow_ups": sum(1 for s in answered if s["turn"] > 0),
+        "throughput_per_second": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize([s["seconds"] * 1000 for s in answered], digits=1),
+        "stages_ms": {stage: summarize(values, digits=1) for stage, values in sorted(stages.items())},
+        "prompt_chars": summarize([s["prompt_chars"] for s in answered if s["prompt_chars"] is not None], digits=0),
+        "answer_cache_eligible_rate": _rate(sum(1 for s in answered if s["cacheable"]), len(answered)),
+        "caches": _cache_report(stats_before, stats_after),
+    }
@@ -0,0 +1,280 @@
+"""
+ComplyFlow - Offline Retrieval Benchmark
+
+Measures search_laws' search path (retriever.search_vector) on a seeded synthetic
+corpus, without Vertex AI: a deterministic local embedder stands in for embedding-001,
+so runs are free, repeatable and comparable over time. For each corpus size and index
+configuration it reports single-client latency percentiles, throughput under
+concurrency and recall@k against exact (sequential scan) search.
+
+The corpus lives in its own collection (BENCH_COLLECTION) of langchain_pg_embedding,
+but building an index rebuilds it for the whole table, so run this against a scratch
+database (`manage.py benchmark_retrieval` refuses when the real collection is not
+empty, unless forced).
+
+Functions:
+- synthetic_chunks: The seeded corpus (same rows for the same seed, any size).
+- synthetic_queries: Seeded queries paraphrasing corpus chunks (some with a source filter).
+- load_corpus: Grow the benchmark collection to a given number of chunks.
+- apply_index: Build (or drop) the ANN index for one configuration.
+- ground_truth: Exact top-k ids per query.
+- measure: Latency, QPS and recall for one configuration and search setting.
+
+Classes:
+- HashEmbeddings: Deterministic feature-hashing embedder (embed_query/embed_documents).
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+import numpy as np
+from django.db import connection
+from .metrics import summarize
+from .vector_index import (
+    EMBEDDING_TABLE, COLLECTION_TABLE, COLLECTION_NAME, INDEX_METHODS,
+    build_index, build_fts_index, ensure_tables, index_name, insert_embeddings, ann_search,
+)
+
+BENCH_COLLECTION = "complyflow_bench_vectors"
+# Same size as Vertex embedding-001
+DEFAULT_DIMENSIONS = 768
+HASH_BUCKETS = 8192
+WORDS_PER_CHUNK = 48
+CHUNKS_PER_SOURCE = 40
+TOPICS = 200
+
+# Domain words mixed into every chunk so FTS/hybrid queries look like real ones
+DOMAIN_WORDS = (
+    "gst itc input tax credit invoice supplier recipient section rule circular notification "
+    "cbic cgst sgst igst rcm reverse charge gstr-3b gstr-1 return filing refund export services "
+    "goods exemption rate schedule assessment penalty interest demand appeal audit registration "
+    "composition turnover place supply valuation blocked credit motor vehicle gift works contract"
+).split()
+CATEGORIES = ("acts", "circulars", "notifications")
+_TOKEN = re.compile(r"[\w\-]+")
+
+class HashEmbeddings:
+    """
+    Stand-in for VertexEmbeddings: each token hashes (sha256, seeded) to a row of a fixed
+    random matrix and a text's vector is the normalized sum of its rows. Texts sharing
+    words are close, like a real embedder, and the output depends only on the seed.
+    """
+
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, seed=0, buckets=HASH_BUCKETS):
+        self.dimensions = dimensions
+        self.seed = seed
+        self.buckets = buckets
+        rng = np.random.default_rng(seed)
+        self.matrix = rng.standard_normal((buckets, dimensions), dtype=np.float32)
+        self._rows = {}
+
+    def row(self, token):
+        row = self._rows.get(token)
+        if row is None:
+            digest = hashlib.sha256(f"{self.seed}:{token}".encode("utf-8")).digest()
+            row = self._rows[token] = int.from_bytes(digest[:8], "big") % self.buckets
+        return row
+
+    def rows(self, text):
+        return [self.row(t) for t in _TOKEN.findall(text.lower())] or [0]
+
+    def vectors(self, row_lists):
+        """Normalized vectors (float32 array) for lists of matrix rows."""
+        out = np.empty((len(row_lists), self.dimensions), dtype=np.float32)
+        for i, rows in enumerate(row_lists):
+            v = self.matrix[rows].sum(axis=0)
+            out[i] = v / (np.linalg.norm(v) or 1.0)
+        return out
+
+    def embed_query(self, text):
+        return self.vectors([self.rows(text)])[0].tolist()
+
+    def embed_documents(self, texts):
+        return self.vectors([self.rows(t) for t in texts]).tolist()
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+def _topic_words(seed, topic):
+    rng = random.Random(f"{seed}:topic:{topic}")
+    return [f"t{topic}w{rng.randrange(400)}" for _ in range(60)]
+
+def synthetic_chunk(seed, i):
+    """(content, metadata) of chunk i: words from its topic, some shared vocabulary, a few domain terms."""
+    rng = random.Random(f"{seed}:chunk:{i}")
+    topic = rng.randrange(TOPICS)
+    topic_words = _topic_words(seed, topic)
+    words = []
+    for _ in range(WORDS_PER_CHUNK):
+        draw = rng.random()
+        if draw < 0.6:
+            words.append(rng.choice(topic_words))
+        elif draw < 0.85:
+            words.append(rng.choice(DOMAIN_WORDS))
+        else:
+            words.append(f"w{rng.randrange(20000)}")
+    source_no = i // CHUNKS_PER_SOURCE
+    metadata = {
+        "source": f"BENCH-{source_no:06d}.pdf",
+        "category": CATEGORIES[source_no % len(CATEGORIES)],
+        "chunk_index": i % CHUNKS_PER_SOURCE,
+    }
+    return " ".join(words), metadata
+
+def synthetic_chunks(seed, start, stop):
+    for i in range(start, stop):
+        yield synthetic_chunk(seed, i)
+
+def synthetic_queries(seed, corpus_size, count, filter_share=0.2):
+    """
+    [(text, filter_metadata)]: each query keeps about a third of a random chunk's words
+    plus a few unrelated ones; filter_share of them carry that chunk's source as filter
+    (the discussDoc path).
+    """
+    rng = random.Random(f"{seed}:queries:{corpus_size}")
+    queries = []
+    for _ in range(count):
+        content, metadata = synthetic_chunk(seed, rng.randrange(corpus_size))
+        words = content.split()
+        picked = rng.sample(words, max(4, len(words) // 3)) + [f"w{rng.randrange(20000)}" for _ in range(3)]
+        rng.shuffle(picked)
+        filter_metadata = {"source": metadata["source"]} if rng.random() < filter_share else None
+        queries.append((" ".join(picked), filter_metadata))
+    return queries
+
+def collection_size(collection_name=BENCH_COLLECTION):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM {EMBEDDING_TABLE} AS e JOIN {COLLECTION_TABLE} AS c "
+            f"ON e.collection_id = c.uuid WHERE c.name = %s",
+            [collection_name],
+        )
+        return cursor.fetchone()[0]
+
+def load_corpus(embedder, seed, size, batch_size=1000, log=print, collection_name=BENCH_COLLECTION):
+    """
+    Grows the benchmark collection to 'size' chunks (existing rows are kept, so sizes
+    can be benchmarked in increasing order). Returns seconds spent loading.
+    collection_name: `manage.py load_test --seed-corpus` fills the real collection instead.
+    """
+    ensure_tables()
+    have = collection_size(collection_name)
+    if have >= size:
+        return 0.0
+    log(f"[Bench] Loading chunks {have}..{size} ({embedder.dimensions}-d)...")
+    started = time.perf_counter()
+
+    def rows():
+        for offset in range(have, size, batch_size):
+            batch = list(synthetic_chunks(seed, offset, min(size, offset + batch_size)))
+            vectors = embedder.vectors([embedder.rows(content) for content, _ in batch])
+            for (content, metadata), vector in zip(batch, vectors.tolist()):
+                yield content, metadata, vector
+
+    insert_embeddings(rows(), collection_name=collection_name, batch_size=batch_size)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {EMBEDDING_TABLE}")
+    return time.perf_counter() - started
+
+def drop_corpus():
+    """Deletes the benchmark collection (rows cascade)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {COLLECTION_TABLE} WHERE name = %s", [BENCH_COLLECTION])
+
+def real_collection_size():
+    ensure_tables()
+    return collection_size(COLLECTION_NAME)
+
+def parse_index_config(spec):
+    """'none', 'hnsw', 'hnsw:m=16,ef_construction=64' or 'ivfflat:lists=100' -> (method, params)."""
+    method, _, options = spec.partition(":")
+    method = method.strip().lower()
+    if method != "none" and method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index '{method}', expected none or one of {INDEX_METHODS}")
+    params = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        params[key.strip()] = int(value)
+    return method, params
+
+def apply_index(method, params, dimensions, log=print):
+    """Builds the configuration's index (dropping the others). Returns build seconds."""
+    started = time.perf_counter()
+    if method == "none":
+        with connection.cursor() as cursor:
+            for other in INDEX_METHODS:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name(other)}")
+    else:
+        build_index(method=method, dimensions=dimensions, rebuild=True, concurrently=False, log=log, **params)
+    return time.perf_counter() - started
+
+def ensure_fts_index(log=print):
+    build_fts_index(concurrently=False, log=log)
+
+def ground_truth(query_vectors, queries, k):
+    """Exact (index-free) top-k ids for each query."""
+    return [
+        [r["id"] for r in ann_search(vector, k=k, filter_metadata=filter_metadata, collection_name=BENCH_COLLECTION, exact=True)]
+        for vector, (_, filter_metadata) in zip(query_vectors, queries)
+    ]
+
+def _run_concurrently(fn, items, concurrency):
+    """Calls fn on every item from 'concurrency' threads; returns wall-clock seconds."""
+    from django.db import connections
+
+    def worker(part):
+        try:
+            for item in part:
+                fn(item)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(items[i::concurrency],)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+def measure(query_vectors, queries, truth, k, mode="vector", ef_search=None, probes=None, concurrency=8, warmup=10):
+    """
+    Runs every query once sequentially (latency, recall@k) and once spread over
+    'concurrency' threads (QPS). Recall is only meaningful for mode="vector"; hybrid
+    results are fused with full-text ranks, so it reports None.
+    """
+    from .retriever import search_vector
+
+    def search(i):
+        return search_vector(query_vectors[i], queries[i][0], k=k, filter_metadata=queries[i][1],
+                             ef_search=ef_search, probes=probes, mode=mode, collection_name=BENCH_COLLECTION)
+
+    for i in range(min(warmup, len(queries))):
+        search(i)
+
+    latencies, hits = [], 0
+    expected = sum(len(t) for t in truth)
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        results = search(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len({r["id"] for r in results} & set(truth[i]))
+
+    wall = _run_concurrently(search, list(range(len(queries))), concurrency)
+    return {
+        "latency_ms": summarize(latencies),
+        "qps": round(len(queries) / wall, 1) if wall else None,
+        "concurrency": concurrency,
+        f"recall_at_{k}": round(hits / expected, 4) if mode == "vector" and expected else None,
+    }
+
+def server_info():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT version(), (SELECT extversion FROM pg_extension WHERE extname = 'vector')")
+        postgres, pgvector = cursor.fetchone()
+    return {"postgres": postgres, "pgvector": pgvector}
@@ -2,51 +2,144 @@
 ComplyFlow - Legal Document Retriever
 
 This module handles semantic search for legal documents using vector embeddings.
-It uses LangChain's PGVector for similarity search with pgvector PostgreSQL extension.
+It queries the langchain_pg_embedding table (written by LangChain's PGVector at ingestion)
+through the shared ANN query in vector_index, so per-query ef_search/probes apply.
+In "hybrid" mode, a full-text ranking is fused with the vector ranking (reciprocal rank
+fusion), which keeps exact identifiers like "Section 17(5)" or "GSTR-3B" in the top k.
+Hybrid mode needs the tsvector column from `manage.py build_vector_index`; without it
+searches fall back to vector only.
+
+The embedder and the DB connection are set up lazily on first use (not at import),
+so importing this module is cheap and a misconfigured environment surfaces as a
+readiness failure instead of an import error. Call warmup() ahead of traffic (the
+gunicorn post_worker_init hook and `manage.py warmup_retriever` both do) to take the
+client construction off the first chat request and check the database is reachable.
+Requests run in other threads (ASGI), each with its own connection, so warmup does
+not pre-open theirs.
 
 Functions:
 - search_laws: Performs semantic search on the legal knowledge base.
+- search_vector: search_laws for an already-embedded query (any collection).
+- warmup: Builds the embedder and checks the DB is reachable.
+- readiness: Reports whether the embedder and vector store are warm.
 
 Note: Requires PostgreSQL with pgvector extension and Vertex AI embeddings.
 """
 
-import os
-from langchain_postgres.vectorstores import PGVector
+import threading
+import time
+from django.db import connection
 from dotenv import load_dotenv
-from .vertex_embeddings import VertexEmbeddings
+from .embedding_cache import get_cached_embeddings
+from .metrics import span
+from .vector_index import ann_search, lexical_search, fts_available, rrf_fuse, COLLECTION_NAME
 
 load_dotenv()
 
 # --- CONFIGURATION ---
-# Use the SAME connection string and model as ingestion
-DB_CONNECTION = os.getenv("DATABASE_URL")
-embeddings = VertexEmbeddings(model="models/embedding-001")
-
-# Connect to the EXISTING table (langchain_pg_embedding)
-vector_store = PGVector(
-    embeddings=embeddings,
-    collection_name="legal_docs_vectors", # This maps to the internal collection ID
-    connection=DB_CONNECTION,
-    use_jsonb=True,
-)
-
-def search_laws(query, k=3, filter_metadata=None):
+# Use the SAME model as ingestion
+EMBEDDING_MODEL = "models/embedding-001"
+SEARCH_MODES = ("vector", "hybrid")
+# Candidates pulled from each ranking before fusion
+HYBRID_CANDIDATES = 20
+
+_lock = threading.Lock()
+_embeddings = None
+_fts_warned = False
+_state = {"embeddings": False, "vector_store": False, "error": None, "warmed_at": None}
+
+def get_embeddings():
+    """Returns the shared (cached) query embedder, building it on first use."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                _embeddings = get_cached_embeddings(model=EMBEDDING_MODEL)
+                _state["embeddings"] = True
+    return _embeddings
+
+def warmup():
+    """
+    Builds the embedder and completes one DB round trip to check the vector store is
+    reachable. The connection is closed again: requests run in other threads and
+    cannot use it. Safe to call repeatedly. Returns the readiness() report; never raises.
+    """
+    started = time.perf_counter()
+    try:
+        get_embeddings()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.close()
+        _state["vector_store"] = True
+        _state["error"] = None
+        _state["warmed_at"] = time.time()
+        print(f"[Retriever] Warm in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        _state["error"] = str(e)
+        print(f"[Retriever] Warmup failed: {e}")
+    return readiness()
+
+def readiness():
+    """Reports whether the embedder and vector store are warm (does not build anything)."""
+    return {
+        "ready": _state["embeddings"] and _state["vector_store"],
+        "embeddings": _state["embeddings"],
+        "vector_store": _state["vector_store"],
+        "error": _state["error"],
+        "warmed_at": _state["warmed_at"],
+    }
+
+def search_laws(query, k=3, filter_metadata=None, ef_search=None, probes=None, mode="vector"):
     """
     Semantic Search: Finds the top 'k' most relevant legal chunks.
     filter_metadata: Dictionary for filtering, e.g. {"source": "doc.pdf"}
+    ef_search / probes: Optional ANN recall/latency knobs (HNSW / IVFFlat index).
+    mode: "vector" (embedding similarity only) or "hybrid" (vector + full-text, RRF-fused).
     """
-    print(f"🔍 Searching for: '{query}' (Filter: {filter_metadata})...")
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+    print(f"🔍 Searching for: '{query}' (Filter: {filter_metadata}, Mode: {mode})...")
     
     # Perform Similarity Search with filtering
-    # Langchain PGVector supports filtering via the 'filter' parameter
-    docs = vector_store.similarity_search(query, k=k, filter=filter_metadata)
-    
+    with span("embed_query"):
+        query_vector = get_embeddings().embed_query(query)
+    results = search_vector(query_vector, query, k, filter_metadata, ef_search, probes, mode)
+    # A successful search proves the store is usable even if warmup() never ran
+    _state["vector_store"] = True
+    return results
+
+def search_vector(query_vector, query, k=3, filter_metadata=None, ef_search=None, probes=None,
+                  mode="vector", collection_name=COLLECTION_NAME):
+    """
+    The search half of search_laws, for a query that is already embedded; also used by
+    `manage.py benchmark_retrieval` against its synthetic collection.
+    """
+    if mode == "hybrid" and not fts_available():
+        global _fts_warned
+        if not _fts_warned:
+            _fts_warned = True
+            print("[Retriever] Full-text column missing (run build_vector_index): hybrid search uses vectors only")
+        mode = "vector"
+    if mode == "hybrid":
+        candidates = max(k, HYBRID_CANDIDATES)
+        with span("vector_search"):
+            vector_docs = ann_search(query_vector, k=candidates, filter_metadata=filter_metadata, ef_search=ef_search,
+                                     probes=probes, collection_name=collection_name)
+        with span("lexical_search"):
+            lexical_docs = lexical_search(query, k=candidates, filter_metadata=filter_metadata, collection_name=collection_name)
+        docs = rrf_fuse([vector_docs, lexical_docs], k=k)
+    else:
+        with span("vector_search"):
+            docs = ann_search(query_vector, k=k, filter_metadata=filter_metadata, ef_search=ef_search, probes=probes,
+                              collection_name=collection_name)
+
     results = []
     for doc in docs:
         results.append({
-            "content": doc.page_content,
-            "source": doc.metadata.get("source", "Unknown"),
-            "category": doc.metadata.get("category", "Unknown")
+            "id": doc["id"],
+            "content": doc["content"],
+            "source": doc["metadata"].get("source", "Unknown"),
+            "category": doc["metadata"].get("category", "Unknown")
         })
         
     return results
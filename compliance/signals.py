@@ -1,14 +1,17 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.conf import settings
-from django.db import connection
-from .models import TaxDocument
+from .models import TaxDocument, GlobalNotification
+from .jobs import enqueue, register
+from .events import publish, DOCUMENT_STATUS_CHANNEL, NOTIFICATIONS_CHANNEL
 from .utils import analyze_document_uri
 import time
 import json
 from google.cloud import storage
-from .vertex_embeddings import VertexEmbeddings
+from .embedding_cache import get_cached_embeddings
 from .agent_logic import audit_invoice_against_rule
+from .vector_index import ann_search
+from .metrics import span
 
 # ==========================================
 # 0. SETUP AI MODEL (CRITICAL STEP)
@@ -22,12 +25,13 @@ def get_embedding_model():
     if _embedding_model is not None:
         return _embedding_model
     project = os.getenv("DOCAI_PROJECT_ID")
-    if not project:
+    # The local stand-in (GENAI_BACKEND=fake) needs no project
+    if not project and getattr(settings, "GENAI_BACKEND", "vertex") != "fake":
         print("[AI] Skipping embedding init: DOCAI_PROJECT_ID not set.")
         return None
     try:
-        _embedding_model = VertexEmbeddings(model="models/embedding-001", project=project, location=os.getenv("VERTEX_LOCATION") or "us-central1")
-        print("[AI] Embedding model initialized (Vertex embedding-001).")
+        _embedding_model = get_cached_embeddings(model="models/embedding-001", project=project, location=os.getenv("VERTEX_LOCATION") or "us-central1")
+        print("[AI] Embedding model initialized (Vertex embedding-001, cached).")
         return _embedding_model
     except Exception as e:
         print(f"[AI] Vertex embeddings init failed: {e}")
@@ -47,27 +51,15 @@ def find_relevant_rule(query_text):
             return None
         query_vector = model.embed_query(query_text)
         
-        # B. Raw SQL Search
-        sql = """
-            SELECT embedding.document, embedding.cmetadata
-            FROM langchain_pg_embedding AS embedding
-            JOIN langchain_pg_collection AS collection 
-              ON embedding.collection_id = collection.uuid
-            WHERE collection.name = 'legal_docs_vectors'
-            ORDER BY embedding.embedding <=> %s::vector
-            LIMIT 2;
-        """
-        
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [query_vector])
-            rows = cursor.fetchall()
+        # B. ANN Search (shared with search_laws)
+        rows = ann_search(query_vector, k=2)
             
         if rows:
             combined_text = ""
             sources = []
             for row in rows:
-                combined_text += f"\n--- Source: {row[1].get('source', 'Unknown')} ---\n{row[0]}\n"
-                sources.append(row[1].get('source', 'Unknown'))
+                combined_text += f"\n--- Source: {row['metadata'].get('source', 'Unknown')} ---\n{row['content']}\n"
+                sources.append(row['metadata'].get('source', 'Unknown'))
             
             return {"text": combined_text, "metadata": {"source": ", ".join(list(set(sources)))}}
         
@@ -80,6 +72,7 @@ def find_relevant_rule(query_text):
 # ==========================================
 # 2. HELPER: Verification Logic
 # ==========================================
+@span("verify_billing")
 def verify_billing_logic(extracted_data):
     # 1. Extract Key Data
     doc_text_preview = extracted_data.get('text', '')[:200].replace('\n', ' ')
@@ -120,7 +113,8 @@ def verify_billing_logic(extracted_data):
     print(f"[Search] Searching Knowledge Base for: '{search_query[:50]}...'")
     
     # 3. SEMANTIC SEARCH
-    rule_match = find_relevant_rule(search_query)
+    with span("rule_search"):
+        rule_match = find_relevant_rule(search_query)
     
     if not rule_match:
         return "Warning: No relevant CBIC rules found in the database."
@@ -134,7 +128,8 @@ def verify_billing_logic(extracted_data):
 
     if is_financial_doc:
         # MODE A: FINANCIAL (Invoice) - USE AI AUDIT
-        is_flagged, reason = audit_invoice_against_rule(extracted_data, found_text)
+        with span("audit"):
+            is_flagged, reason = audit_invoice_against_rule(extracted_data, found_text)
         if is_flagged:
             return f"Compliance Infringement: {reason} (Ref: {source_doc})"
         return None 
@@ -146,46 +141,99 @@ def verify_billing_logic(extracted_data):
 # 3. UTILS: Storage Check
 # ==========================================
 def check_blob_exists(bucket_name, blob_name):
+    if getattr(settings, 'STORAGE_BACKEND', 'gcs') != 'gcs':
+        # Local/in-memory upload storage (load tests): no bucket to ask
+        from django.core.files.storage import default_storage
+        return default_storage.exists(blob_name)
     storage_client = storage.Client(credentials=settings.GS_CREDENTIALS)
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
     return blob.exists()
 
+def publish_document_status(instance):
+    """Pushes a status change to the owner's open /documents/stream/ connections (on commit)."""
+    publish(DOCUMENT_STATUS_CHANNEL, {
+        'id': instance.id,
+        'user_id': instance.user_id,
+        'status': instance.status,
+        'flag_reason': (instance.flag_reason or '')[:4000] or None,
+        'is_processed': instance.is_processed,
+    })
+
 # ==========================================
-# 4. SIGNAL: The Main Trigger
+# 4. JOB: Document Processing (runs in `manage.py run_workers`)
+# ==========================================
+@register('process_tax_document')
+def process_tax_document_job(document_id):
+    instance = TaxDocument.objects.filter(id=document_id).first()
+    if instance is None or not instance.file:
+        print(f"[Skip] Document {document_id} no longer exists")
+        return
+    if instance.is_processed:
+        return
+    try:
+        print(f"[Wait] Waiting for file: {instance.file.name}")
+        file_ready = False
+        for i in range(3):
+            if check_blob_exists(settings.GS_BUCKET_NAME, instance.file.name):
+                file_ready = True
+                break
+            time.sleep(2)
+        
+        if not file_ready:
+            instance.status = 'ERROR'
+            instance.flag_reason = "File upload incomplete"
+            instance.save()
+            publish_document_status(instance)
+            return
+
+        gcs_uri = f"gs://{settings.GS_BUCKET_NAME}/{instance.file.name}"
+        ai_results = analyze_document_uri(gcs_uri)
+        
+        if ai_results:
+            notification = verify_billing_logic(ai_results)
+            instance.status = 'FLAGGED' if notification else 'VALID'
+            instance.flag_reason = notification
+            instance.is_processed = True
+            instance.save(update_fields=['status', 'flag_reason', 'is_processed'])
+            print(f"[Done] Final Status: {instance.status}")
+            
+        else:
+            instance.status = 'ERROR'
+            instance.save()
+        publish_document_status(instance)
+            
+    except Exception as e:
+        print(f"[Error] Document Job Error: {e}")
+        instance.status = 'ERROR'
+        instance.save(update_fields=['status'])
+        publish_document_status(instance)
+        raise # Let the queue retry with backoff
+
+# ==========================================
+# 5. SIGNAL: The Main Trigger
 # ==========================================
 @receiver(post_save, sender=TaxDocument)
 def process_tax_document(sender, instance, created, **kwargs):
+    # Only enqueue: the upload request returns immediately and a worker does the rest
     if created and instance.file:
-        try:
-            print(f"[Wait] Waiting for file: {instance.file.name}")
-            file_ready = False
-            for i in range(3):
-                if check_blob_exists(settings.GS_BUCKET_NAME, instance.file.name):
-                    file_ready = True
-                    break
-                time.sleep(2)
-            
-            if not file_ready:
-                instance.status = 'ERROR'
-                instance.flag_reason = "File upload incomplete"
-                instance.save()
-                return
-
-            gcs_uri = f"gs://{settings.GS_BUCKET_NAME}/{instance.file.name}"
-            ai_results = analyze_document_uri(gcs_uri)
-            
-            if ai_results:
-                notification = verify_billing_logic(ai_results)
-                instance.status = 'FLAGGED' if notification else 'VALID'
-                instance.flag_reason = notification
-                instance.is_processed = True
-                instance.save(update_fields=['status', 'flag_reason', 'is_processed'])
-                print(f"[Done] Final Status: {instance.status}")
-                
-            else:
-                instance.status = 'ERROR'
-                instance.save()
-                
-        except Exception as e:
-            print(f"[Error] Signal Error: {e}")
\ No newline at end of file
+        enqueue('process_tax_document', {'document_id': instance.id})
+        print(f"[Queue] Queued processing for document {instance.id}")
+
+
+def notification_event(notification):
+    """SSE payload for a GlobalNotification (shared by the live push and Last-Event-ID replay)."""
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message[:4000],
+        'doc_name': notification.doc_name,
+        'source_url': notification.source_url,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+@receiver(post_save, sender=GlobalNotification)
+def broadcast_notification(sender, instance, created, **kwargs):
+    # NOTIFY is delivered on commit to every web worker's broadcaster
+    if created:
+        publish(NOTIFICATIONS_CHANNEL, notification_event(instance))
@@ -0,0 +1,178 @@
+"""
+ComplyFlow - Single-Flight Request Coalescing
+
+When a notification goes out, many users click "Discuss" on the same document within
+seconds and each click would run the same filtered search and an identical Gemini
+prompt. Coalescing makes concurrent callers with the same normalized key share ONE
+in-flight call:
+
+- Within a worker process, followers wait for the leader's call and receive its result
+  (or its exception).
+- Across worker processes, a Postgres advisory lock on the key stands in for a shared
+  flight: the leader holds it while computing, and followers wait for it to be released
+  and then read the result from a shared store (the caller's `load`, e.g. the semantic
+  answer cache) instead of recomputing.
+
+The lock is transaction-scoped (pg_try_advisory_xact_lock) and the leader computes
+inside that transaction, so it stays on one server connection even through a
+transaction-mode pooler (Supabase port 6543), and is released by the commit that also
+publishes the leader's result: it can never be left held.
+
+Functions:
+- flight_key: Normalized key from arbitrary parts (case/whitespace-insensitive).
+- coalesce: In-process single flight.
+- acoalesce: In-process single flight for coroutines on one event loop.
+- coalesce_shared: In-process plus cross-worker (advisory lock) single flight.
+- single_flight_stats: Leader/follower counters for this process.
+
+Classes:
+- SingleFlight: Registry of in-flight calls.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from django.db import connection, transaction
+
+# Longest a follower waits on another worker's flight before computing itself
+SHARED_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT", "60"))
+SHARED_POLL_SECONDS = 0.1
+
+_stats_lock = threading.Lock()
+_stats = {"leaders": 0, "followers": 0, "shared_leaders": 0, "shared_followers": 0, "shared_fallbacks": 0}
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def flight_key(*parts):
+    """sha256 of the parts with strings lowercased and whitespace collapsed."""
+    def normalize(value):
+        if isinstance(value, str):
+            return " ".join(value.lower().split())
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        return value
+    return hashlib.sha256(json.dumps(normalize(list(parts)), default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Runs fn once per key at a time; concurrent callers with that key share the outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Returns (result, shared): shared is True for followers, who get a deep copy."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            _count("followers")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        _count("leaders")
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+_flight = SingleFlight()
+
+def coalesce(key, fn):
+    """In-process single flight: returns fn()'s result, shared with concurrent same-key callers."""
+    return _flight.do(key, fn)[0]
+
+# (event loop, key) -> in-flight task; awaiting callers on that loop share it
+_tasks = {}
+
+async def acoalesce(key, make):
+    """
+    coalesce() for async callers: make() builds the coroutine, run once per key at a
+    time on this event loop; concurrent awaiters get a deep copy of its result. A
+    follower that is cancelled does not cancel the shared call.
+    """
+    loop = asyncio.get_running_loop()
+    task = _tasks.get((loop, key))
+    if task is not None:
+        _count("followers")
+        return copy.deepcopy(await asyncio.shield(task))
+    _count("leaders")
+    task = _tasks[(loop, key)] = loop.create_task(make())
+    task.add_done_callback(lambda _: _tasks.pop((loop, key), None))
+    return await asyncio.shield(task)
+
+def _advisory_id(key):
+    # pg advisory locks take a signed bigint
+    return int.from_bytes(bytes.fromhex(key[:16]), "big", signed=True)
+
+def _try_xact_lock(lock_id):
+    """Takes the lock until the current transaction ends; False if another holds it."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [lock_id])
+        return cursor.fetchone()[0]
+
+def _lock_free(lock_id):
+    # Taken and released at once by the short transaction
+    with transaction.atomic():
+        return _try_xact_lock(lock_id)
+
+def _shared(key, fn, load):
+    if connection.vendor != "postgresql":
+        return fn()
+    lock_id = _advisory_id(key)
+    with transaction.atomic():
+        leader = _try_xact_lock(lock_id)
+        if leader:
+            _count("shared_leaders")
+            return fn()
+
+    # Another worker is computing this key: wait for it to finish, then read its result
+    _count("shared_followers")
+    deadline = time.monotonic() + SHARED_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(SHARED_POLL_SECONDS)
+        if _lock_free(lock_id):
+            break
+    result = load()
+    if result is not None:
+        return result
+    _count("shared_fallbacks")
+    return fn()
+
+def coalesce_shared(key, fn, load):
+    """
+    Single flight within this process and across workers. fn must publish its result
+    somewhere load() can read it (load returns None if it cannot); a follower whose
+    load() comes back empty computes fn() itself. The leader's fn runs inside a
+    transaction: its database writes are committed when it returns (rolled back if it
+    raises), and a write that may fail must use its own atomic() block.
+    """
+    return _flight.do(key, lambda: _shared(key, fn, load))[0]
+
+def single_flight_stats():
+    with _stats_lock:
+        return dict(_stats)
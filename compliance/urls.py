@@ -5,8 +5,16 @@ urlpatterns = [
     # Document management endpoint
     path('documents/', views.DocumentListCreateView.as_view(), name='document-list-create'),
     path('documents/<int:pk>/', views.DocumentDetailView.as_view(), name='document-detail'),
+    # Live processing status of the user's documents (SSE)
+    path('documents/stream/', views.document_status_stream, name='document-status-stream'),
+    # Single-use ticket for opening an EventSource stream (?ticket=)
+    path('stream-ticket/', views.stream_ticket_view, name='stream-ticket'),
     # Chat endpoint for compliance queries
     path('chat/', views.chat_view, name='chat'),
+    # Token-streaming chat (SSE)
+    path('chat/stream/', views.chat_stream_view, name='chat-stream'),
+    # Same as chat/, served on the async (ASGI) pipeline
+    path('chat/async/', views.achat_view, name='chat-async'),
     # Query history endpoint: now returns unique sessions
     path('history/', views.history_view, name='history'),
     # Specific conversation messages
@@ -17,4 +25,6 @@ urlpatterns = [
     path('notifications/stream/', views.notifications_stream, name='notifications-stream'),
     # Profile management endpoint
     path('profile/', views.UserProfileView.as_view(), name='profile'),
+    # Readiness probe (retriever warm state)
+    path('health/ready/', views.readiness_view, name='readiness'),
 ]
\ No newline at end of file
@@ -1,5 +1,15 @@
 from google.cloud import documentai
 from django.conf import settings
+from .metrics import span
+
+def get_docai_client():
+    """Document AI client; the local stand-in when settings.DOCAI_BACKEND is 'fake'."""
+    if getattr(settings, 'DOCAI_BACKEND', 'google') == 'fake':
+        from .fake_backends import FakeDocumentProcessorServiceClient
+        return FakeDocumentProcessorServiceClient()
+    return documentai.DocumentProcessorServiceClient(
+        credentials=settings.GS_CREDENTIALS
+    )
 
 def analyze_document_uri(gcs_uri, mime_type='application/pdf'):
     """
@@ -8,9 +18,7 @@ def analyze_document_uri(gcs_uri, mime_type='application/pdf'):
     try:
         # 1. Setup the Client with EXPLICIT Credentials
         # This fixes the "Default Credentials not found" error
-        client = documentai.DocumentProcessorServiceClient(
-            credentials=settings.GS_CREDENTIALS
-        )
+        client = get_docai_client()
 
         # 2. Define the Processor Name
         name = client.processor_path(
@@ -35,7 +43,8 @@ def analyze_document_uri(gcs_uri, mime_type='application/pdf'):
         # 5. Execute
         print(f"[AI] Sending GCS Link to AI: {gcs_uri}...")
         
-        result = client.process_document(request=request)
+        with span("docai_process"):
+            result = client.process_document(request=request)
         document = result.document
         
         # 6. Extract Data
@@ -0,0 +1,426 @@
+"""
+ComplyFlow - Vector Index Management
+
+This module owns the SQL that touches LangChain's langchain_pg_embedding table directly:
+building approximate-nearest-neighbour (ANN) and full-text indexes, and running the
+similarity and lexical queries that search_laws and the upload audit share.
+
+Without an ANN index, `ORDER BY embedding <=> query` is a full sequential scan whose
+cost grows with every circular we ingest. HNSW gives the best recall/latency trade-off;
+IVFFlat builds faster and uses less memory. Both are tuned per query:
+- hnsw.ef_search (HNSW): candidate list size, higher = better recall, slower (default 40).
+- ivfflat.probes (IVFFlat): lists scanned, higher = better recall, slower (default 1).
+
+Exact identifiers ("Circular No. 189/01/2023-GST", "Section 17(5)", "GSTR-3B") rank
+poorly in embedding space, so a stored tsvector column (document_tsv, generated from
+the chunk text) with a GIN index sits next to the vectors and hybrid retrieval fuses
+both rankings with reciprocal rank fusion (RRF).
+
+Functions:
+- build_index: Create (or rebuild) an HNSW/IVFFlat cosine index on the embeddings.
+- build_fts_index: Add the stored tsvector column and its GIN index.
+- fts_available: Whether the tsvector column exists (hybrid search needs it).
+- build_metadata_index: Ensure the jsonb_path_ops GIN index on chunk metadata exists.
+- ann_search: Nearest-neighbour query with optional per-query ef_search/probes (or exact).
+- lexical_search: Full-text query (all terms, else any term) ranked by ts_rank_cd.
+- rrf_fuse: Reciprocal rank fusion of several ranked result lists.
+- ensure_tables: Create the LangChain collection/embedding tables if missing (scratch DBs).
+- get_collection_id: UUID of a LangChain collection, created on first use.
+- insert_embeddings: Bulk insert of (content, metadata, vector) rows, streamed with
+  COPY ... FROM STDIN (text format, vectors as pgvector '[x,y,...]' literals).
+- delete_document_chunks: Remove every chunk of one source document.
+
+Note: Requires the pgvector extension (0.5.0+ for HNSW).
+"""
+
+import io
+import json
+import os
+import time
+import uuid
+from django.db import connection, transaction
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+COLLECTION_NAME = "legal_docs_vectors"
+INDEX_METHODS = ("hnsw", "ivfflat")
+FTS_COLUMN = "document_tsv"
+FTS_INDEX_NAME = f"{EMBEDDING_TABLE}_tsv_idx"
+# Expression index used before the stored column; dropped by build_fts_index
+LEGACY_FTS_INDEX_NAME = f"{EMBEDDING_TABLE}_fts_idx"
+# Same name LangChain's PGVector uses, so an existing index is recognised
+METADATA_INDEX_NAME = "ix_cmetadata_gin"
+# Text search configuration of the generated tsvector column and of the queries
+FTS_CONFIG = "english"
+# Seconds before re-checking for a missing tsvector column
+FTS_CHECK_SECONDS = 60
+# Standard RRF damping constant (Cormack et al.); larger values flatten rank differences
+RRF_K = 60
+
+# Rows per COPY statement when bulk-inserting embeddings (all inside one transaction)
+COPY_BATCH_SIZE = int(os.getenv("VECTOR_COPY_BATCH_SIZE", "1000"))
+
+# Per-query defaults; None leaves the server setting alone
+DEFAULT_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "0")) or None
+DEFAULT_PROBES = int(os.getenv("VECTOR_PROBES", "0")) or None
+
+def index_name(method):
+    return f"{EMBEDDING_TABLE}_{method}_idx"
+
+def column_dimensions(cursor):
+    """Returns the declared vector(N) size of the embedding column, or None if untyped."""
+    cursor.execute(
+        "SELECT atttypmod FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'embedding'",
+        [EMBEDDING_TABLE],
+    )
+    row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+def detect_dimensions(cursor, collection_name=COLLECTION_NAME):
+    """Reads the dimension of a stored vector in the collection (None if it is empty)."""
+    cursor.execute(
+        f"""
+        SELECT vector_dims(e.embedding)
+        FROM {EMBEDDING_TABLE} AS e
+        JOIN {COLLECTION_TABLE} AS c ON e.collection_id = c.uuid
+        WHERE c.name = %s
+        LIMIT 1
+        """,
+        [collection_name],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def build_index(method="hnsw", m=16, ef_construction=64, lists=None, dimensions=None,
+                rebuild=False, concurrently=True, maintenance_work_mem=None, log=print):
+    """
+    Creates a cosine-distance ANN index on langchain_pg_embedding.embedding.
+
+    pgvector can only index a typed column, so an untyped `vector` column is first
+    converted to vector(dimensions) (auto-detected from the collection when not given).
+    Building one method drops the other method's index so the planner has one choice.
+    For IVFFlat, `lists` defaults to rows / 1000 (min 10), per the pgvector guidance.
+    Must run outside a transaction when concurrently=True.
+    """
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index method '{method}', expected one of {INDEX_METHODS}")
+    concurrent_kw = "CONCURRENTLY " if concurrently else ""
+
+    with connection.cursor() as cursor:
+        if maintenance_work_mem:
+            cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", [maintenance_work_mem])
+
+        typed = column_dimensions(cursor)
+        if typed is None:
+            dimensions = dimensions or detect_dimensions(cursor)
+            if not dimensions:
+                raise ValueError("Cannot detect embedding dimensions: the collection is empty. Pass dimensions explicitly.")
+            log(f"[Index] Typing {EMBEDDING_TABLE}.embedding as vector({dimensions})")
+            cursor.execute(f"ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding TYPE vector({int(dimensions)})")
+        elif dimensions and dimensions != typed:
+            raise ValueError(f"Embedding column is vector({typed}), not vector({dimensions})")
+
+        for other in INDEX_METHODS:
+            if other != method:
+                cursor.execute(f"DROP INDEX {concurrent_kw}IF EXISTS {index_name(other)}")
+        if rebuild:
+            log(f"[Index] Dropping {index_name(method)} for rebuild")
+            cursor.execute(f"DROP INDEX {concurrent_kw}IF EXISTS {index_name(method)}")
+
+        if method == "hnsw":
+            options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        else:
+            if not lists:
+                cursor.execute(f"SELECT count(*) FROM {EMBEDDING_TABLE}")
+                lists = max(10, cursor.fetchone()[0] // 1000)
+            options = f"lists = {int(lists)}"
+
+        log(f"[Index] Building {method} index {index_name(method)} WITH ({options})...")
+        cursor.execute(
+            f"CREATE INDEX {concurrent_kw}IF NOT EXISTS {index_name(method)} "
+            f"ON {EMBEDDING_TABLE} USING {method} (embedding vector_cosine_ops) WITH ({options})"
+        )
+        cursor.execute(f"ANALYZE {EMBEDDING_TABLE}")
+    return index_name(method)
+
+def build_fts_index(concurrently=True, log=print):
+    """
+    Adds the stored tsvector column lexical_search ranks against (generated from the
+    chunk text, so inserts need no changes) and its GIN index. Adding the column
+    rewrites the table once, under an exclusive lock.
+    """
+    concurrent_kw = "CONCURRENTLY " if concurrently else ""
+    with connection.cursor() as cursor:
+        if not fts_available(refresh=True):
+            log(f"[Index] Adding generated column {FTS_COLUMN} (rewrites {EMBEDDING_TABLE})...")
+            cursor.execute(
+                f"ALTER TABLE {EMBEDDING_TABLE} ADD COLUMN IF NOT EXISTS {FTS_COLUMN} tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{FTS_CONFIG}', coalesce(document, ''))) STORED"
+            )
+        log(f"[Index] Building full-text index {FTS_INDEX_NAME}...")
+        cursor.execute(
+            f"CREATE INDEX {concurrent_kw}IF NOT EXISTS {FTS_INDEX_NAME} "
+            f"ON {EMBEDDING_TABLE} USING gin ({FTS_COLUMN})"
+        )
+        cursor.execute(f"DROP INDEX {concurrent_kw}IF EXISTS {LEGACY_FTS_INDEX_NAME}")
+    _fts_state["available"] = True
+    return FTS_INDEX_NAME
+
+_fts_state = {"available": False, "checked_at": 0.0}
+
+def fts_available(refresh=False):
+    """
+    Whether langchain_pg_embedding has the tsvector column (build_fts_index). A hit is
+    remembered; a miss is re-checked at most every FTS_CHECK_SECONDS.
+    """
+    if _fts_state["available"]:
+        return True
+    if not refresh and time.monotonic() - _fts_state["checked_at"] < FTS_CHECK_SECONDS:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            [EMBEDDING_TABLE, FTS_COLUMN],
+        )
+        _fts_state["available"] = cursor.fetchone() is not None
+    _fts_state["checked_at"] = time.monotonic()
+    return _fts_state["available"]
+
+def build_metadata_index(concurrently=True, log=print):
+    """
+    Ensures the GIN (jsonb_path_ops) index on cmetadata exists. It serves metadata
+    filters and identifier lookups (cmetadata @> ...). LangChain creates it with new
+    tables; older tables may lack it.
+    """
+    concurrent_kw = "CONCURRENTLY " if concurrently else ""
+    log(f"[Index] Ensuring metadata index {METADATA_INDEX_NAME}...")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX {concurrent_kw}IF NOT EXISTS {METADATA_INDEX_NAME} "
+            f"ON {EMBEDDING_TABLE} USING gin (cmetadata jsonb_path_ops)"
+        )
+    return METADATA_INDEX_NAME
+
+def ann_search(query_vector, k=3, filter_metadata=None, ef_search=None, probes=None,
+               collection_name=COLLECTION_NAME, exact=False):
+    """
+    Nearest-neighbour search over the collection by cosine distance.
+    filter_metadata: Dictionary matched by JSONB containment, e.g. {"source": "doc.pdf"}
+    ef_search / probes: Per-query recall/latency knobs, applied with SET LOCAL so they
+    only affect this query's transaction.
+    exact: Bypass the ANN index (sequential scan); the ground truth for recall checks.
+    Returns dicts with id, content, metadata and distance, nearest first.
+    """
+    ef_search = ef_search or DEFAULT_EF_SEARCH
+    probes = probes or DEFAULT_PROBES
+
+    where = "c.name = %s"
+    params = [collection_name]
+    if filter_metadata:
+        where += " AND e.cmetadata @> %s::jsonb"
+        params.append(json.dumps(filter_metadata))
+
+    sql = f"""
+        SELECT e.id, e.document, e.cmetadata, e.embedding <=> %s::vector AS distance
+        FROM {EMBEDDING_TABLE} AS e
+        JOIN {COLLECTION_TABLE} AS c ON e.collection_id = c.uuid
+        WHERE {where}
+        ORDER BY distance
+        LIMIT %s;
+    """
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if exact:
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        if ef_search:
+            cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(int(ef_search))])
+        if probes:
+            cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", [str(int(probes))])
+        cursor.execute(sql, [query_vector, *params, k])
+        rows = cursor.fetchall()
+
+    return [
+        {"id": row[0], "content": row[1], "metadata": row[2] or {}, "distance": row[3]}
+        for row in rows
+    ]
+
+def lexical_search(query_text, k=3, filter_metadata=None, collection_name=COLLECTION_NAME):
+    """
+    Full-text search over the stored tsvector column, ranked by ts_rank_cd. Chunks
+    containing every query term (websearch_to_tsquery: AND, "quoted phrases") are
+    returned; only if there are none are the terms OR-ed, since a chat question rarely
+    has every word in one chunk. AND keeps common terms (gst, itc, tax) from matching
+    most of the corpus. Requires build_fts_index.
+    Returns dicts with id, content, metadata and rank, best first.
+    """
+    where = "c.name = %s"
+    params = [collection_name]
+    if filter_metadata:
+        where += " AND e.cmetadata @> %s::jsonb"
+        params.append(json.dumps(filter_metadata))
+
+    queries = (
+        f"websearch_to_tsquery('{FTS_CONFIG}', %s)",
+        f"NULLIF(replace(plainto_tsquery('{FTS_CONFIG}', %s)::text, '&', '|'), '')::tsquery",
+    )
+    rows = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            cursor.execute(
+                f"""
+                WITH q AS (SELECT {query} AS query)
+                SELECT e.id, e.document, e.cmetadata, ts_rank_cd(e.{FTS_COLUMN}, q.query) AS rank
+                FROM {EMBEDDING_TABLE} AS e
+                JOIN {COLLECTION_TABLE} AS c ON e.collection_id = c.uuid
+                CROSS JOIN q
+                WHERE {where} AND e.{FTS_COLUMN} @@ q.query
+                ORDER BY rank DESC
+                LIMIT %s;
+                """,
+                [query_text, *params, k],
+            )
+            rows = cursor.fetchall()
+            if rows:
+                break
+
+    return [
+        {"id": row[0], "content": row[1], "metadata": row[2] or {}, "rank": row[3]}
+        for row in rows
+    ]
+
+def rrf_fuse(rankings, k, rrf_k=RRF_K):
+    """
+    Reciprocal rank fusion: score(d) = sum over lists of 1 / (rrf_k + rank of d).
+    rankings: lists of result dicts (each with an 'id'), best first.
+    Returns the top 'k' unique results with an added 'rrf_score'.
+    """
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc["id"], doc)
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [dict(docs[doc_id], rrf_score=scores[doc_id]) for doc_id in fused]
+
+def ensure_tables():
+    """
+    Creates the pgvector extension and LangChain's collection/embedding tables (same
+    layout PGVector creates) when they do not exist yet, e.g. on a scratch database.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {COLLECTION_TABLE} (
+                uuid uuid PRIMARY KEY,
+                name varchar NOT NULL UNIQUE,
+                cmetadata json
+            )
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {EMBEDDING_TABLE} (
+                id varchar PRIMARY KEY,
+                collection_id uuid REFERENCES {COLLECTION_TABLE} (uuid) ON DELETE CASCADE,
+                embedding vector,
+                document varchar,
+                cmetadata jsonb
+            )
+            """
+        )
+
+def get_collection_id(collection_name=COLLECTION_NAME, create=True):
+    """Returns the langchain_pg_collection uuid for 'collection_name' (creating the row if asked)."""
+    with connection.cursor() as cursor:
+        if create:
+            cursor.execute(
+                f"INSERT INTO {COLLECTION_TABLE} (uuid, name, cmetadata) VALUES (%s, %s, NULL) "
+                f"ON CONFLICT (name) DO NOTHING",
+                [str(uuid.uuid4()), collection_name],
+            )
+        cursor.execute(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = %s", [collection_name])
+        row = cursor.fetchone()
+    return str(row[0]) if row else None
+
+def _copy_text(value):
+    """Escapes a value for COPY text format (Postgres text cannot hold NUL, so it is dropped)."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\x00", "")
+    )
+
+def _vector_literal(vector):
+    return "[" + ",".join(repr(float(x)) for x in vector) + "]"
+
+def _copy_rows(cursor, sql, buffer):
+    """Runs COPY FROM STDIN on the raw DB-API cursor (psycopg2 or psycopg 3)."""
+    raw = cursor.cursor
+    if hasattr(raw, "copy_expert"):
+        buffer.seek(0)
+        raw.copy_expert(sql, buffer)
+    else:
+        with raw.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+def insert_embeddings(rows, collection_name=COLLECTION_NAME, batch_size=None, use_copy=True):
+    """
+    Bulk-inserts chunks into langchain_pg_embedding, in the same row format PGVector writes.
+    rows: iterable of (content, metadata_dict, vector); consumed lazily, batch by batch.
+    batch_size: rows per COPY (or executemany) statement; all batches share one transaction.
+    use_copy: False falls back to parameterized INSERTs.
+    Returns the number of rows written.
+    """
+    batch_size = batch_size or COPY_BATCH_SIZE
+    collection_id = get_collection_id(collection_name)
+    columns = "(id, collection_id, embedding, document, cmetadata)"
+    copy_sql = f"COPY {EMBEDDING_TABLE} {columns} FROM STDIN"
+    insert_sql = f"INSERT INTO {EMBEDDING_TABLE} {columns} VALUES (%s, %s, %s::vector, %s, %s::jsonb)"
+
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        def flush(batch):
+            if use_copy:
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write("\t".join(row) + "\n")
+                _copy_rows(cursor, copy_sql, buffer)
+            else:
+                cursor.executemany(insert_sql, batch)
+            return len(batch)
+
+        batch = []
+        for content, metadata, vector in rows:
+            if use_copy:
+                batch.append((
+                    str(uuid.uuid4()),
+                    collection_id,
+                    _vector_literal(vector),
+                    _copy_text(content),
+                    _copy_text(json.dumps(metadata)),
+                ))
+            else:
+                batch.append((str(uuid.uuid4()), collection_id, list(vector), content, json.dumps(metadata)))
+            if len(batch) >= batch_size:
+                written += flush(batch)
+                batch = []
+        if batch:
+            written += flush(batch)
+    return written
+
+def delete_document_chunks(source, collection_name=COLLECTION_NAME):
+    """Deletes all chunks whose metadata 'source' is 'source'. Returns rows deleted."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {EMBEDDING_TABLE} AS e
+            USING {COLLECTION_TABLE} AS c
+            WHERE e.collection_id = c.uuid AND c.name = %s AND e.cmetadata @> %s::jsonb
+            """,
+            [collection_name, json.dumps({"source": source})],
+        )
+        return cursor.rowcount
@@ -3,6 +3,18 @@ ComplyFlow - Vertex AI Embeddings Wrapper
 
 This module provides a LangChain-compatible wrapper for Google Vertex AI embeddings.
 It allows semantic search and RAG (Retrieval-Augmented Generation) using text embeddings.
+embed_documents() packs many texts into each Vertex request and runs a bounded number
+of batch requests at once, so bulk ingestion does not pay one round trip per chunk.
+
+Batching is tuned with environment variables (or constructor arguments):
+- VERTEX_EMBED_BATCH_SIZE: max texts per request (default 100, Vertex allows up to 250).
+- VERTEX_EMBED_BATCH_TOKENS: approx. max tokens per request (default 15000, Vertex allows 20000).
+- VERTEX_EMBED_CONCURRENCY: max batch requests in flight (default 4, 1 = sequential).
+
+aembed_query() / aembed_documents() are asyncio coroutines for ASGI views (the async
+chat embeds its search query with them, chat_pipeline.asearch). They share the same concurrency cap (an asyncio semaphore per event loop),
+retry quota/unavailable errors with jittered exponential backoff, and give up after
+VERTEX_EMBED_DEADLINE seconds (default 30) per call.
 
 Classes:
 - VertexEmbeddings: Minimal wrapper for Vertex AI embedding models.
@@ -10,20 +22,50 @@ Classes:
 Note: Requires Google Cloud credentials with Vertex AI API access.
 """
 
+import asyncio
 import os
-from typing import List
+import random
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
 
 try:
     from google import genai
 except Exception:
     genai = None
+from .genai_clients import get_genai_client
+from .metrics import span
+
+# Vertex counts roughly 4 characters per token for English/legal text.
+CHARS_PER_TOKEN = 4
+
+# HTTP status codes / API statuses worth retrying: quota exhaustion and transient overload.
+RETRYABLE_CODES = {429, 503}
+RETRYABLE_STATUSES = ("RESOURCE_EXHAUSTED", "UNAVAILABLE")
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    code = getattr(exc, "code", None)
+    if code in RETRYABLE_CODES:
+        return True
+    status = str(getattr(exc, "status", "") or exc)
+    return any(s in status for s in RETRYABLE_STATUSES)
 
 class VertexEmbeddings:
     """
     Minimal embeddings wrapper that uses Vertex AI via google-genai.
     Provides embed_query() and embed_documents() compatible with LangChain's interface.
     """
-    def __init__(self, model: str = "models/embedding-001", project: str | None = None, location: str | None = None):
+    def __init__(
+        self,
+        model: str = "models/embedding-001",
+        project: str | None = None,
+        location: str | None = None,
+        batch_size: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_concurrency: int | None = None,
+        deadline: float | None = None,
+    ):
         if genai is None:
             raise RuntimeError("google-genai library not available")
         self.model = model
@@ -36,7 +78,16 @@ class VertexEmbeddings:
         self.location = location or os.getenv("VERTEX_LOCATION") or "us-central1"
         if not self.project:
             raise RuntimeError("Set DOCAI_PROJECT_ID/GOOGLE_CLOUD_PROJECT for Vertex embeddings")
-        self.client = genai.Client(vertexai=True, project=self.project, location=self.location)
+        # Process-wide client: shares its keep-alive pool with chat and the agent
+        self.client = get_genai_client(self.project, self.location)
+        self.batch_size = max(1, batch_size or int(os.getenv("VERTEX_EMBED_BATCH_SIZE", "100")))
+        self.max_batch_tokens = max(1, max_batch_tokens or int(os.getenv("VERTEX_EMBED_BATCH_TOKENS", "15000")))
+        self.max_concurrency = max(1, max_concurrency or int(os.getenv("VERTEX_EMBED_CONCURRENCY", "4")))
+        self.deadline = deadline or float(os.getenv("VERTEX_EMBED_DEADLINE", "30"))
+        self.backoff_base = 0.5
+        self.backoff_cap = 8.0
+        # asyncio primitives belong to one event loop, so keep one semaphore per loop
+        self._semaphores = weakref.WeakKeyDictionary()
 
     def _extract_vector(self, resp) -> List[float]:
         # google-genai embed_content responses typically contain an object with 'embedding.values'
@@ -62,13 +113,129 @@ class VertexEmbeddings:
         except Exception as e:
             raise RuntimeError(f"Failed to parse Vertex embedding response: {e}")
 
+    def _extract_vectors(self, resp, expected: int) -> List[List[float]]:
+        # Batched responses carry one entry per input under 'embeddings', in request order
+        items = getattr(resp, "embeddings", None)
+        if items is None and isinstance(resp, dict):
+            items = resp.get("embeddings")
+        if items is None:
+            if expected == 1:
+                return [self._extract_vector(resp)]
+            raise RuntimeError("Failed to parse Vertex embedding response: no 'embeddings' in batch response")
+        vectors = []
+        for item in items:
+            values = getattr(item, "values", None)
+            if values is None and isinstance(item, dict):
+                values = item.get("values")
+            if values is None:
+                raise RuntimeError("Failed to parse Vertex embedding response: No values found in embedding")
+            vectors.append(list(values))
+        if len(vectors) != expected:
+            raise RuntimeError(f"Vertex returned {len(vectors)} embeddings for a batch of {expected} texts")
+        return vectors
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def _iter_batches(self, texts: List[str]) -> Iterator[List[str]]:
+        """Groups texts (in order) under both the per-request text cap and token cap."""
+        batch: List[str] = []
+        batch_tokens = 0
+        for t in texts:
+            tokens = self._estimate_tokens(t)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch, batch_tokens = [], 0
+            # An oversized single text still goes out alone; Vertex truncates it server-side
+            batch.append(t)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        with span("vertex_embed_batch"):
+            resp = self.client.models.embed_content(model=self.model, contents=batch)
+        return self._extract_vectors(resp, expected=len(batch))
+
     def embed_query(self, text: str) -> List[float]:
-        resp = self.client.models.embed_content(model=self.model, content=text)
+        with span("vertex_embed"):
+            resp = self.client.models.embed_content(model=self.model, content=text)
         return self._extract_vector(resp)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds texts in batched requests, returning vectors in the same order as texts.
+        Up to max_concurrency batches are in flight at once.
+        """
+        if not texts:
+            return []
+        batches = list(self._iter_batches(list(texts)))
+        if self.max_concurrency == 1 or len(batches) == 1:
+            results = [self._embed_batch(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(self._embed_batch, batches))
+
         vectors: List[List[float]] = []
-        for t in texts:
-            resp = self.client.models.embed_content(model=self.model, content=t)
-            vectors.append(self._extract_vector(resp))
+        for batch_vectors in results:
+            vectors.extend(batch_vectors)
+        return vectors
+
+    # --- Async API ---
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _aembed_batch(self, batch: List[str], deadline: float) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            if deadline - loop.time() <= 0:
+                raise TimeoutError(f"Vertex embedding deadline of {self.deadline}s exceeded")
+            try:
+                async with self._get_semaphore():
+                    # Time spent queued for a slot counts against the deadline
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    with span("vertex_embed_batch"):
+                        resp = await asyncio.wait_for(
+                            self.client.aio.models.embed_content(model=self.model, contents=batch),
+                            timeout=remaining,
+                        )
+                return self._extract_vectors(resp, expected=len(batch))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Vertex embedding deadline of {self.deadline}s exceeded")
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                # Full jitter: sleep anywhere in [0, min(cap, base * 2^attempt)]
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+                if loop.time() + delay >= deadline:
+                    raise TimeoutError(f"Vertex embedding deadline of {self.deadline}s exceeded after {attempt + 1} attempts: {e}")
+                print(f"[AI] Vertex embedding throttled ({e}); retry {attempt + 1} in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        return (await self._aembed_batch([text], deadline))[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async embed_documents(): batches run concurrently up to max_concurrency in flight."""
+        if not texts:
+            return []
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        results = await asyncio.gather(
+            *(self._aembed_batch(b, deadline) for b in self._iter_batches(list(texts)))
+        )
+        vectors: List[List[float]] = []
+        for batch_vectors in results:
+            vectors.extend(batch_vectors)
         return vectors
@@ -15,24 +15,39 @@ Note: All endpoints require authentication via Google OAuth or JWT tokens.
 
 import os
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
+from django.utils import timezone as django_timezone
 from rest_framework import generics, permissions, parsers, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
 from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+import asyncio
+import base64
+import hashlib
 import json
-import time
+import queue
+import secrets
+import uuid
 
-from .models import TaxDocument, UserProfile, ComplianceQuery, GlobalNotification
+from .models import TaxDocument, UserProfile, ComplianceQuery, GlobalNotification, StreamTicket
 from .serializers import TaxDocumentSerializer, UserProfileSerializer, ComplianceQuerySerializer, GlobalNotificationSerializer
+from .events import subscribe, asubscribe, DOCUMENT_STATUS_CHANNEL, NOTIFICATIONS_CHANNEL
+from .signals import notification_event
+from .genai_clients import get_genai_client
+from . import answer_cache
+from .metrics import span
+from .chat_pipeline import (
+    user_context, greeting_reply, is_greeting, retrieve, aprepare, build_prompt, generate_answer,
+    fallback_report, save_query,
+    AnswerStream, IRRELEVANT_REPLY, in_thread,
+)
 
-# New Google GenAI SDK
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv
 
 # Initialize logging
@@ -99,36 +114,78 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         profile, created = UserProfile.objects.get_or_create(user=self.request.user)
         return profile
 
+HISTORY_PAGE_SIZE = 10
+HISTORY_MAX_PAGE_SIZE = 50
+
+def _encode_history_cursor(timestamp, pk):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{pk}".encode()).decode()
+
+def _decode_history_cursor(cursor):
+    try:
+        raw_ts, raw_pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(raw_ts), int(raw_pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def history_view(request):
-    """Retrieve unique chat sessions for the authenticated user."""
-    # Group by conversation_id and get the latest query for each session
-    from django.db.models import Max
-    
-    # Get distinct conversation IDs and their latest timestamp
-    sessions = ComplianceQuery.objects.filter(user=request.user) \
-        .values('conversation_id') \
-        .annotate(latest_timestamp=Max('timestamp')) \
-        .order_by('-latest_timestamp')[:10] # Return last 10 sessions
-        
+    """
+    Retrieve unique chat sessions for the authenticated user, newest first.
+
+    A session is represented by its latest message: a row with no newer row in the same
+    conversation (anti-join on the (user, conversation_id, timestamp) index). Rows are
+    walked newest first on the (user, -timestamp) index with the keyset cursor applied
+    to them directly, so a page reads only the messages in its own time window, never
+    the whole history. The title (first message) is fetched per listed session. Pass
+    the X-Next-Cursor response header back as ?cursor= to page further; ?limit= sets
+    the page size.
+    """
+    from django.db.models import Exists, OuterRef, Q, Subquery
+
+    try:
+        limit = min(max(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    same_conversation = ComplianceQuery.objects.filter(user=request.user, conversation_id=OuterRef('conversation_id'))
+    newer = same_conversation.filter(
+        Q(timestamp__gt=OuterRef('timestamp')) | Q(timestamp=OuterRef('timestamp'), id__gt=OuterRef('id'))
+    )
+    sessions = ComplianceQuery.objects.filter(user=request.user).filter(~Exists(newer))
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        position = _decode_history_cursor(cursor)
+        if position is None:
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        cursor_ts, cursor_id = position
+        sessions = sessions.filter(Q(timestamp__lt=cursor_ts) | Q(timestamp=cursor_ts, id__lt=cursor_id))
+
+    sessions = sessions.annotate(
+        first_query=Subquery(same_conversation.order_by('timestamp', 'id').values('query')[:1])
+    )
+
+    page = list(
+        sessions.order_by('-timestamp', '-id')
+        .values('id', 'conversation_id', 'timestamp', 'query', 'first_query')[:limit + 1]
+    )
+
     history_data = []
-    for session in sessions:
-        # Get the first query of this session to use as a title
-        first_query = ComplianceQuery.objects.filter(
-            user=request.user, 
-            conversation_id=session['conversation_id']
-        ).first()
-        
-        if first_query:
-            history_data.append({
-                "conversation_id": session['conversation_id'],
-                "title": first_query.query[:50] + ("..." if len(first_query.query) > 50 else ""),
-                "timestamp": session['latest_timestamp'],
-                "last_query": first_query.query
-            })
-            
-    return Response(history_data, status=status.HTTP_200_OK)
+    for session in page[:limit]:
+        title = session['first_query']
+        history_data.append({
+            "conversation_id": session['conversation_id'],
+            "title": title[:50] + ("..." if len(title) > 50 else ""),
+            "timestamp": session['timestamp'],
+            "last_query": session['query']
+        })
+
+    response = Response(history_data, status=status.HTTP_200_OK)
+    if len(page) > limit:
+        last = page[limit - 1]
+        response['X-Next-Cursor'] = _encode_history_cursor(last['timestamp'], last['id'])
+    return response
 
 @api_view(['GET', 'DELETE'])
 @permission_classes([permissions.IsAuthenticated])
@@ -182,45 +239,205 @@ def notifications_view(request, pk=None):
     serializer = GlobalNotificationSerializer(notifications, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
-# Standard Django view for SSE (to avoid 406 Not Acceptable from DRF renderer negotiation)
-def notifications_stream(request):
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def readiness_view(request):
     """
-    SSE stream to push new notifications to the client in real-time.
+    Readiness probe: 200 once the retriever's embedder and vector store are warm, else 503.
+    Reports state only; warming happens in the gunicorn hook or `manage.py warmup_retriever`.
+    Public, so it carries no internal counters: those are on the access-gated /metrics.
     """
-    from django.http import StreamingHttpResponse
-    
-    print("[SSE] Client requested notification stream connection")
-    
-    def event_stream():
-        # Get start point
-        latest = GlobalNotification.objects.first()
-        last_id = 0
-        if latest:
-            last_id = latest.id
-            
-        while True:
-            # Check for new notifications
-            new_notifications = GlobalNotification.objects.filter(id__gt=last_id).order_by('id')
-            
-            for n in new_notifications:
-                data = {
-                    'id': n.id,
-                    'title': n.title,
-                    'message': n.message,
-                    'doc_name': n.doc_name,
-                    'source_url': n.source_url,
-                    'created_at': n.created_at.isoformat()
-                }
-                print(f"[SSE] New notification detected: {n.title} ({n.doc_name})")
-                yield f"data: {json.dumps(data)}\n\n"
-                last_id = n.id
-            
-            time.sleep(10)
-            
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    from .retriever import readiness
+
+    report = readiness()
+    code = status.HTTP_200_OK if report["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response(report, status=code)
+
+# Standard Django views for SSE (to avoid 406 Not Acceptable from DRF renderer negotiation).
+# They are async: under ASGI an open stream is an idle coroutine waiting on the process-wide
+# broadcaster (compliance/events.py), not a worker thread polling the DB. Under WSGI
+# (runserver) async generators cannot stream, so a blocking generator is used instead.
+
+SSE_HEARTBEAT_SECONDS = 15
+# Lifetime of a stream ticket: long enough to open the EventSource, no longer
+STREAM_TICKET_SECONDS = int(os.getenv('STREAM_TICKET_SECONDS', '60'))
+# Notifications replayed to a reconnecting client (Last-Event-ID)
+SSE_RESUME_LIMIT = 50
+
+def _sse(data, event=None, event_id=None):
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+def _sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
     response['Cache-Control'] = 'no-cache'
     response['X-Accel-Buffering'] = 'no' # For Nginx/Proxy stability
     return response
+
+def _is_asgi(request):
+    return 'wsgi.input' not in request.META
+
+def _last_event_id(request):
+    """Id of the last notification the client saw (EventSource sends it on reconnect)."""
+    try:
+        return int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        return None
+
+async def _anotification_events(last_id):
+    async with asubscribe(NOTIFICATIONS_CHANNEL) as events:
+        if last_id is not None:
+            # Subscribed first, so nothing published during the replay is lost
+            missed = GlobalNotification.objects.filter(id__gt=last_id).order_by('id')[:SSE_RESUME_LIMIT]
+            async for n in missed:
+                yield _sse(notification_event(n), event_id=n.id)
+                last_id = n.id
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if last_id is not None and event['id'] <= last_id:
+                continue
+            last_id = event['id']
+            print(f"[SSE] New notification: {event['title']} ({event['doc_name']})")
+            yield _sse(event, event_id=event['id'])
+
+def _notification_events(last_id):
+    with subscribe(NOTIFICATIONS_CHANNEL) as events:
+        if last_id is not None:
+            for n in GlobalNotification.objects.filter(id__gt=last_id).order_by('id')[:SSE_RESUME_LIMIT]:
+                yield _sse(notification_event(n), event_id=n.id)
+                last_id = n.id
+        while True:
+            try:
+                event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if last_id is not None and event['id'] <= last_id:
+                continue
+            last_id = event['id']
+            yield _sse(event, event_id=event['id'])
+
+async def notifications_stream(request):
+    """
+    SSE stream to push new notifications to the client in real-time.
+    Sends a heartbeat comment every 15s and replays missed notifications on Last-Event-ID.
+    """
+    print("[SSE] Client requested notification stream connection")
+    last_id = _last_event_id(request)
+    if _is_asgi(request):
+        return _sse_response(_anotification_events(last_id))
+    return _sse_response(_notification_events(last_id))
+
+def _authenticate_stream(request):
+    """
+    Runs the DRF authenticators (Authorization header) for a plain (non-DRF) streaming
+    view. Tokens are never read from the query string, where they would end up in
+    access logs and browser history: EventSource clients use a stream ticket instead.
+    """
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+    from rest_framework.exceptions import AuthenticationFailed
+
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+def _ticket_hash(ticket):
+    return hashlib.sha256(ticket.encode('utf-8')).hexdigest()
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def stream_ticket_view(request):
+    """
+    Issues a single-use ticket, valid for STREAM_TICKET_SECONDS, that opens one
+    EventSource stream as ?ticket=. Only its hash is stored.
+    """
+    now = django_timezone.now()
+    StreamTicket.objects.filter(expires_at__lte=now).delete()
+    ticket = secrets.token_urlsafe(32)
+    StreamTicket.objects.create(
+        ticket_hash=_ticket_hash(ticket), user=request.user,
+        expires_at=now + timedelta(seconds=STREAM_TICKET_SECONDS),
+    )
+    return Response({"ticket": ticket, "expires_in": STREAM_TICKET_SECONDS}, status=status.HTTP_201_CREATED)
+
+def _redeem_stream_ticket(ticket):
+    """The ticket's user if it is valid, else None. A ticket is consumed by its first use."""
+    entry = StreamTicket.objects.select_related('user').filter(
+        ticket_hash=_ticket_hash(ticket), expires_at__gt=django_timezone.now()
+    ).first()
+    if entry is None:
+        return None
+    # Only the request whose delete removes the row may use it
+    deleted, _ = StreamTicket.objects.filter(pk=entry.pk).delete()
+    if not deleted or not entry.user.is_active:
+        return None
+    return entry.user
+
+def _stream_user(request):
+    ticket = request.GET.get('ticket')
+    if ticket:
+        return _redeem_stream_ticket(ticket)
+    return _authenticate_stream(request)
+
+def _pending_documents(user_id):
+    return TaxDocument.objects.filter(user_id=user_id, is_processed=False) \
+        .values('id', 'status', 'flag_reason', 'is_processed')
+
+def _status_event(event):
+    # The broadcaster hands the same payload to every subscriber: copy, never mutate
+    return _sse({k: v for k, v in event.items() if k != 'user_id'}, event='status')
+
+async def _adocument_events(user_id):
+    async with asubscribe(DOCUMENT_STATUS_CHANNEL, match=lambda event: event.get('user_id') == user_id) as events:
+        # Snapshot after subscribing, so a change landing in between is not lost
+        pending = [doc async for doc in _pending_documents(user_id)]
+        yield _sse(pending, event='snapshot')
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield _status_event(event)
+
+def _document_events(user_id):
+    with subscribe(DOCUMENT_STATUS_CHANNEL, match=lambda event: event.get('user_id') == user_id) as events:
+        yield _sse(list(_pending_documents(user_id)), event='snapshot')
+        while True:
+            try:
+                event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield _status_event(event)
+
+async def document_status_stream(request):
+    """
+    SSE stream of the user's TaxDocument status changes (PENDING -> VALID/FLAGGED/ERROR).
+    Events are pushed by the processing job through the broadcaster; the stream itself
+    only reads the DB once, for an initial snapshot of still-pending documents.
+    """
+    from django.http import JsonResponse
+
+    user = await sync_to_async(_stream_user)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication failed'}, status=401)
+    if _is_asgi(request):
+        return _sse_response(_adocument_events(user.id))
+    return _sse_response(_document_events(user.id))
     
 # chat_view logic
 
@@ -234,39 +451,17 @@ def chat_view(request):
     if not message:
         return Response({"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST)
     
-    # 1. User Context Retrieval
-    user_profession = "User"
-    if request.user.is_authenticated:
-        try:
-            profile = request.user.profile
-            if profile.profession:
-                user_profession = profile.profession
-        except UserProfile.DoesNotExist:
-            pass
-    
+    user = request.user if request.user.is_authenticated else None
+    discuss_doc_name = request.query_params.get('discussDoc')
     doc_id = request.query_params.get('docId')
-    doc_context = ""
-    if doc_id and request.user.is_authenticated:
-        try:
-            doc = TaxDocument.objects.get(id=doc_id, user=request.user)
-            doc_context = (
-                f"\n\nDOCUMENT CONTEXT:\nFilename: {doc.original_filename}\n"
-                f"AI Verdict: {doc.get_status_display()}\nIssues: {doc.flag_reason or 'None'}\n"
-                f"Data: {doc.extracted_data or 'Not available'}"
-            )
-        except TaxDocument.DoesNotExist:
-            pass
+
+    # 1. User Context Retrieval
+    with span("context"):
+        user_profession, doc_context = user_context(user, doc_id)
     
     # 2. Greeting Detection
-    message_lower = message.lower().strip()
-    greet_keywords = {"hi", "hello", "hey", "yo", "namaste", "greetings"}
-    words = set(message_lower.split())
-    
-    if words.intersection(greet_keywords) and len(words) <= 3:
-        intro = (
-            f"Hi! 👋 I'm ComplyFlow, your GST and Indian tax compliance assistant. I see you're working as a {user_profession}.\n\n"
-            "Ask me tax questions and I'll answer strictly from legal documents with citations."
-        )
+    intro = greeting_reply(message, user_profession)
+    if intro:
         return Response({
             "response": intro, 
             "citations": [], 
@@ -275,201 +470,280 @@ def chat_view(request):
 
     # 3. Retrieval Phase with Metadata Filtering
     try:
-        from .retriever import search_laws
-        
-        # Check if we are discussing a specific document from notifications
-        discuss_doc_name = request.query_params.get('discussDoc')
-        doc_id = request.query_params.get('docId')
-        
-        filter_metadata = None
-        agent_context = ""
-        
-        # --- AGENTIC HANDOVER: Check for previous analysis ---
-        if discuss_doc_name:
-            # Case A: Discussing a new discovery from notifications
-            filter_metadata = {"source": discuss_doc_name}
-            print(f"[Chat] Targeted search for document: {discuss_doc_name}")
-            
-            # Check if we have an autonomous draft for this
-            notif = GlobalNotification.objects.filter(doc_name=discuss_doc_name).first()
-            if notif and notif.action_draft:
-                agent_context += f"\nPREVIOUS AGENT ANALYSIS: This document was marked as {notif.impact_level} impact. The agent already drafted this action: {notif.action_draft}\n"
-        
-        elif doc_id:
-            # Case B: Discussing a business document from dashboard
-            try:
-                tax_doc = TaxDocument.objects.get(id=doc_id)
-                if tax_doc.status == 'FLAGGED':
-                    agent_context += f"\nPREVIOUS AUDIT RESULT: This document is currently FLAGGED. Reason: {tax_doc.flag_reason}\n"
-            except TaxDocument.DoesNotExist:
-                pass
-
-        # Expand query if it seems to be a follow-up
-        search_query = message
-        reference_pronouns = {"this", "that", "it", "them", "those", "they"}
-        is_follow_up = len(message.split()) < 8 or any(p in message_lower for p in reference_pronouns)
-        
-        if is_follow_up and history and not discuss_doc_name:
-            last_user_msg = next((m['content'] for m in reversed(history) if m['role'] == 'user'), "")
-            if last_user_msg:
-                search_query = f"{last_user_msg} {message}"
-        
-        search_results = search_laws(search_query, k=5, filter_metadata=filter_metadata)
-        print(f"[Chat] Found {len(search_results)} relevant chunks in knowledge base")
-
-        # If we targeted a doc but found nothing, fallback to general search to be helpful
-        if discuss_doc_name and not search_results:
-            print(f"[Chat] ⚠️ No results for {discuss_doc_name} specifically, falling back to general search")
-            search_results = search_laws(search_query, k=5)
-            print(f"[Chat] General fallback found {len(search_results)} chunks")
-        
-        context = "\n\n".join([
-            f"Source: {r['source']}\nCategory: {r['category']}\nContent: {r['content']}"
-            for r in search_results
-        ])
-        
-        citations = [
-            {
-                "id": str(i+1),
-                "section": r.get('category', 'General'),
-                "title": r.get('source', 'Tax Authority'),
-                "content": r.get('content', '')[:300] + "...",
-                "source": r.get('source', 'N/A')
-            }
-            for i, r in enumerate(search_results)
-        ]
-        
+        with span("retrieve"):
+            retrieval = retrieve(message, history, discuss_doc_name, doc_id)
     except Exception as e:
         logger.error(f"RAG Retrieval Error: {str(e)}")
         return Response({"error": "Knowledge base unreachable"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    search_results = retrieval["search_results"]
+    citations = retrieval["citations"]
+
+    # 4. Semantic answer cache (same question over the same retrieved chunks)
+    with span("answer_cache"):
+        cache_key = answer_cache.cache_key(message, history, user_profession, search_results, discuss_doc_name, doc_id,
+                                           exact=retrieval["identifier_match"],
+                                           agent_context=retrieval["agent_context"])
+        response_text = answer_cache.lookup(cache_key)
+    if response_text == IRRELEVANT_REPLY:
+        citations = []
+
+    # 5. Generation Phase (Vertex AI)
+    if response_text is None:
+        try:
+            prompt = build_prompt(message, history, user_profession, retrieval, doc_context, discuss_doc_name)
+            with span("generate"):
+                response_text = generate_answer(prompt, cache_key)
+            if response_text == IRRELEVANT_REPLY:
+                citations = []
+
+        except Exception as gemini_error:
+            logger.error(f"Vertex AI Error: {str(gemini_error)}")
+            response_text = fallback_report(search_results)
+
+    # 6. Save Query to History if authenticated
+    with span("save"):
+        saved_conversation_id = save_query(user, message, response_text, conversation_id)
+
+    return Response({
+        "response": response_text,
+        "citations": citations,
+        "suggestions": build_suggestions(message, search_results),
+        "conversation_id": saved_conversation_id,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }, status=status.HTTP_200_OK)
+
+# Token-streaming chat (SSE over POST, read with fetch()). Same pipeline as chat_view:
+#   event: citations  -> citations, suggestions, conversation_id (as soon as retrieval is done)
+#   event: token      -> {"text": ...} answer text as the model produces it
+#   event: replace    -> {"text": ...} discard streamed text (off-topic answer / LLM failure)
+#   event: done       -> final response, conversation_id, timestamp (after saving history)
+
+def _chat_stream_setup(user, payload, discuss_doc_name, doc_id, prepared=None):
+    """
+    Runs everything before generation. Returns (events, prompt, state); prompt is None
+    when no LLM call is needed (greeting, cached answer) and state['response'] holds the text.
+    prepared: aprepare()'s result when context and retrieval were already loaded async.
+    """
+    message = payload['message']
+    history = payload['history']
+    if prepared is None:
+        user_profession, doc_context = user_context(user, doc_id)
+    else:
+        user_profession, doc_context, retrieval = prepared
+    conversation_id = payload['conversation_id'] or (str(uuid.uuid4()) if user else None)
+    state = {'message': message, 'conversation_id': conversation_id, 'search_results': [], 'save': True}
+
+    intro = greeting_reply(message, user_profession)
+    if intro:
+        return [
+            _sse({"citations": [], "suggestions": ["How to claim ITC?", "What is RCM?"], "conversation_id": None}, event='citations'),
+            _sse({"text": intro}, event='token'),
+        ], None, dict(state, response=intro, conversation_id=None, save=False)
+
+    if prepared is None:
+        retrieval = retrieve(message, history, discuss_doc_name, doc_id)
+    search_results = retrieval['search_results']
+    state['search_results'] = search_results
+    state['cache_key'] = answer_cache.cache_key(message, history, user_profession, search_results, discuss_doc_name, doc_id,
+                                                exact=retrieval["identifier_match"],
+                                                agent_context=retrieval["agent_context"])
+    cached = answer_cache.lookup(state['cache_key'])
+
+    first = _sse({
+        "citations": [] if cached == IRRELEVANT_REPLY else retrieval["citations"],
+        "suggestions": build_suggestions(message, search_results),
+        "conversation_id": conversation_id,
+    }, event='citations')
+    if cached is not None:
+        return [first, _sse({"text": cached}, event='token')], None, dict(state, response=cached)
+    prompt = build_prompt(message, history, user_profession, retrieval, doc_context, discuss_doc_name)
+    return [first], prompt, state
+
+def _chat_stream_finish(user, answer, state, failed=False):
+    """Resolves the final text, caches and saves it, and returns the closing events."""
+    events = []
+    if answer is None:
+        response_text = state['response']
+    elif failed:
+        response_text = fallback_report(state['search_results'])
+        events.append(_sse({"text": response_text}, event='replace'))
+    else:
+        tail = answer.flush()
+        if tail:
+            events.append(_sse({"text": tail}, event='token'))
+        response_text, replaced = answer.finish()
+        if replaced:
+            events.append(_sse({"text": response_text}, event='replace'))
+        answer_cache.store(state.get('cache_key'), response_text)
+    conversation_id = None
+    if state['save']:
+        conversation_id = save_query(user, state['message'], response_text, state['conversation_id'])
+    events.append(_sse({
+        "response": response_text,
+        "conversation_id": conversation_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }, event='done'))
+    return events
+
+def _gemini_model():
+    return os.getenv('GEMINI_MODEL') or 'gemini-2.0-flash'
 
-    # 4. Generation Phase (Vertex AI)
+async def _achat_events(user, payload, discuss_doc_name, doc_id):
     try:
-        gemini_model = os.getenv('GEMINI_MODEL') or 'gemini-2.0-flash'
-        
-        # Initializing Client with Vertex AI as requested
-        client = genai.Client(
-            vertexai=True, 
-            project=settings.DOCAI_PROJECT_ID, 
-            location=os.getenv('VERTEX_LOCATION') or 'us-central1'
-        )
-        
-        # Format conversation history for the prompt
-        history_text = ""
-        for h in history[-6:]: # Include last 3 turns
-            role = "User" if h['role'] == 'user' else "Assistant"
-            history_text += f"{role}: {h['content']}\n"
-            
-        prompt = f"""You are an expert tax and Indian laws assistant for ComplyFlow.
-        The user identifies as: {user_profession}.
-        
-        CONVERSATION HISTORY:
-        {history_text}
-        
-        STEP 1: RELEVANCE CHECK
-        Is the CURRENT User Question below related to Indian Tax, GST, Legal Compliance, or Business Regulations?
-        - Use the CONVERSATION HISTORY to resolve any pronouns or context.
-        - If NO (and it is NOT a greeting or thank you), output EXACTLY: "FALLBACK_IRRELEVANT"
-        - If YES (or if it is a simple greeting/gratitude), proceed to STEP 2.
-        
-        STEP 2: GENERATE RESPONSE
-        Answer the CURRENT user's question or acknowledge their message in a professional, human-readable, and actionable manner.
-        - CRITICAL: If "CONTEXT FROM LEGAL DOCUMENTS" is provided below, you MUST use it to answer the question. Do NOT say you don't have the full text if the context contains legal provisions.
-        - {f"NOTE: The user is specifically asking about the document '{discuss_doc_name}'. Focus your summary and analysis on this document." if discuss_doc_name else ""}
-        
-        FORMATTING INSTRUCTIONS:
-        1. Use Markdown headers (`###`) for main sections. ALWAYS put a DOUBLE NEWLINE after the header.
-        2. Use **bolding** for key terms, dates, and section names.
-        3. Use bullet points (`-`) for lists. ALWAYS put a DOUBLE NEWLINE between each bullet point block and the surrounding text.
-        4. STRUCTURE: 
-           ### Summary
-           (3-4 sentences summarizing the situation)
-           
-           ### Compliance Review
-           - Point 1
-           - Point 2
-           
-           ### Conclusion
-           (Direct, actionable advice)
-        5. Use [1], [2] for citations pointing to the sources below.
-        6. CRITICAL: Use DOUBLE NEWLINES (`\n\n`) between EVERY section. 
-        7. NO HTML TAGS: Do NOT use `<br>`, `<b>`, or any other HTML. Strictly use Markdown.
-        
-        PROMPT:
-        {agent_context}
-
-        LEGAL DOCUMENT CONTEXT:
-        {context}
-        {doc_context}
-        
-        CURRENT USER QUESTION: {message}
-        
-        INSTRUCTIONS:
-        1. If it's a question or a request to discuss a document, provide the structured report described above.
-        2. If it's a thank you/greeting, respond politely as a helpful assistant.
-        """
-        
-        response = client.models.generate_content(
-            model=gemini_model,
-            contents=prompt
-        )
-        response_text = response.text.strip()
-        
-        if "FALLBACK_IRRELEVANT" in response_text:
-            response_text = "I am a compliance assistant dedicated to Indian Tax and Law. I'm afraid I can't help with that specific query."
-            citations = []
+        prepared = None
+        if not is_greeting(payload['message']):
+            prepared = await aprepare(user, payload['message'], payload['history'], discuss_doc_name, doc_id)
+        events, prompt, state = await sync_to_async(_chat_stream_setup)(user, payload, discuss_doc_name, doc_id, prepared)
+    except Exception as e:
+        logger.error(f"RAG Retrieval Error: {str(e)}")
+        yield _sse({"error": "Knowledge base unreachable"}, event='error')
+        return
+    for event in events:
+        yield event
+    if prompt is None:
+        for event in await sync_to_async(_chat_stream_finish)(user, None, state):
+            yield event
+        return
+
+    answer = AnswerStream()
+    failed = False
+    try:
+        client = get_genai_client(settings.DOCAI_PROJECT_ID, os.getenv('VERTEX_LOCATION') or 'us-central1')
+        async for chunk in await client.aio.models.generate_content_stream(model=_gemini_model(), contents=prompt):
+            text = answer.feed(chunk.text or "")
+            if text:
+                yield _sse({"text": text}, event='token')
+            if answer.irrelevant:
+                break
+    except Exception as gemini_error:
+        logger.error(f"Vertex AI Error: {str(gemini_error)}")
+        failed = True
+    for event in await sync_to_async(_chat_stream_finish)(user, answer, state, failed):
+        yield event
 
+def _chat_events(user, payload, discuss_doc_name, doc_id):
+    try:
+        events, prompt, state = _chat_stream_setup(user, payload, discuss_doc_name, doc_id)
+    except Exception as e:
+        logger.error(f"RAG Retrieval Error: {str(e)}")
+        yield _sse({"error": "Knowledge base unreachable"}, event='error')
+        return
+    yield from events
+    if prompt is None:
+        yield from _chat_stream_finish(user, None, state)
+        return
+
+    answer = AnswerStream()
+    failed = False
+    try:
+        client = get_genai_client(settings.DOCAI_PROJECT_ID, os.getenv('VERTEX_LOCATION') or 'us-central1')
+        for chunk in client.models.generate_content_stream(model=_gemini_model(), contents=prompt):
+            text = answer.feed(chunk.text or "")
+            if text:
+                yield _sse({"text": text}, event='token')
+            if answer.irrelevant:
+                break
     except Exception as gemini_error:
         logger.error(f"Vertex AI Error: {str(gemini_error)}")
-        # 3. FINAL FALLBACK: Structured Human-Readable Report
-        if search_results:
-            response_text = "### 🔍 Partial Document Review\n"
-            response_text += "I'm currently having trouble reaching my advanced analysis engine (Vertex AI), but I have retrieved these relevant provisions from your documents:\n\n"
-            
-            # Group by source for readability
-            sources = {}
-            for snippet in search_results:
-                src = snippet.get('metadata', {}).get('source', 'General Provision')
-                if src not in sources:
-                    sources[src] = []
-                sources[src].append(snippet.get('content', ''))
-            
-            for src, contents in sources.items():
-                response_text += f"**From {src}:**\n"
-                for content in contents:
-                    # Clean up and limit content for readability
-                    clean_content = content.strip().replace('\n', ' ')
-                    if len(clean_content) > 300:
-                        clean_content = clean_content[:300] + "..."
-                    response_text += f"• {clean_content}\n"
-                response_text += "\n"
-            
-            response_text += "---\n*Note: To restore full intelligent summaries, please check API permissions.*"
-        else:
-            response_text = "I'm sorry, I'm currently unable to process your request. Please ensure you are logged in and the connection is stable."
+        failed = True
+    yield from _chat_stream_finish(user, answer, state, failed)
 
-    # 5. Save Query to History if authenticated
-    if request.user.is_authenticated:
-        try:
-            # If conversation_id wasn't provided, and we're saving, we should have one or it will use the model default (uuid.uuid4)
-            data_to_save = {
-                "user": request.user,
-                "query": message,
-                "response": response_text
-            }
-            if conversation_id:
-                data_to_save["conversation_id"] = conversation_id
-                
-            new_query = ComplianceQuery.objects.create(**data_to_save)
-            saved_conversation_id = new_query.conversation_id
-        except Exception as save_err:
-            logger.error(f"Failed to save query history: {str(save_err)}")
-            saved_conversation_id = conversation_id
+def _chat_payload(request):
+    """Parses a plain-Django chat POST. Returns (payload, None) or (None, error response)."""
+    from django.http import JsonResponse
 
-    return Response({
+    if request.method != 'POST':
+        return None, JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return None, JsonResponse({"error": "Invalid JSON"}, status=400)
+    payload = {
+        'message': str(body.get('message', '')).strip(),
+        'history': body.get('history', []) or [],
+        'conversation_id': body.get('conversation_id'),
+    }
+    if not payload['message']:
+        return None, JsonResponse({"error": "Message is required"}, status=400)
+    return payload, None
+
+@csrf_exempt
+async def chat_stream_view(request):
+    """
+    POST /api/chat/stream/: chat_view's answer as Server-Sent Events. Citations arrive
+    as soon as retrieval finishes and answer tokens as Gemini produces them, so time to
+    first byte is the retrieval latency rather than the full generation time.
+    """
+    payload, error = _chat_payload(request)
+    if error is not None:
+        return error
+
+    # Anonymous chat is allowed, as in chat_view
+    user = await sync_to_async(_authenticate_stream)(request)
+    discuss_doc_name = request.GET.get('discussDoc')
+    doc_id = request.GET.get('docId')
+    if _is_asgi(request):
+        return _sse_response(_achat_events(user, payload, discuss_doc_name, doc_id))
+    return _sse_response(_chat_events(user, payload, discuss_doc_name, doc_id))
+
+@csrf_exempt
+async def achat_view(request):
+    """
+    POST /api/chat/async/: chat_view on the async pipeline (ASGI). Profile, document,
+    notification and knowledge-base lookups run concurrently (chat_pipeline.aprepare)
+    and the worker's event loop is free while Gemini generates, so one worker serves
+    many chats at once. Same request and response as /api/chat/.
+    """
+    from django.http import JsonResponse
+
+    payload, error = _chat_payload(request)
+    if error is not None:
+        return error
+    message = payload['message']
+    history = payload['history']
+    user = await sync_to_async(_authenticate_stream)(request)
+    discuss_doc_name = request.GET.get('discussDoc')
+    doc_id = request.GET.get('docId')
+
+    if is_greeting(message):
+        user_profession, _ = await sync_to_async(user_context)(user)
+        return JsonResponse({
+            "response": greeting_reply(message, user_profession),
+            "citations": [],
+            "suggestions": ["How to claim ITC?", "What is RCM?"]
+        })
+
+    try:
+        with span("prepare"):
+            user_profession, doc_context, retrieval = await aprepare(user, message, history, discuss_doc_name, doc_id)
+    except Exception as e:
+        logger.error(f"RAG Retrieval Error: {str(e)}")
+        return JsonResponse({"error": "Knowledge base unreachable"}, status=500)
+    search_results = retrieval["search_results"]
+    citations = retrieval["citations"]
+
+    with span("answer_cache"):
+        cache_key = answer_cache.cache_key(message, history, user_profession, search_results, discuss_doc_name, doc_id,
+                                           exact=retrieval["identifier_match"],
+                                           agent_context=retrieval["agent_context"])
+        response_text = await in_thread(answer_cache.lookup)(cache_key)
+    if response_text is None:
+        try:
+            prompt = build_prompt(message, history, user_profession, retrieval, doc_context, discuss_doc_name)
+            with span("generate"):
+                response_text = await in_thread(generate_answer)(prompt, cache_key)
+        except Exception as gemini_error:
+            logger.error(f"Vertex AI Error: {str(gemini_error)}")
+            response_text = fallback_report(search_results)
+    if response_text == IRRELEVANT_REPLY:
+        citations = []
+
+    with span("save"):
+        saved_conversation_id = await sync_to_async(save_query)(user, message, response_text, payload['conversation_id'])
+    return JsonResponse({
         "response": response_text,
         "citations": citations,
         "suggestions": build_suggestions(message, search_results),
-        "conversation_id": saved_conversation_id if request.user.is_authenticated else None,
+        "conversation_id": saved_conversation_id,
         "timestamp": datetime.now(timezone.utc).isoformat()
-    }, status=status.HTTP_200_OK)
\ No newline at end of file
+    })
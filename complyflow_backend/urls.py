@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
+from compliance.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     # This connects your new API endpoints:
     path('api/', include('compliance.urls')), 
+    # Prometheus scrape endpoint (latency histograms, cache/pool counters)
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""
+Gunicorn configuration for ComplyFlow.
+
+Gunicorn loads ./gunicorn.conf.py automatically, so the Dockerfile CMD picks this up.
+"""
+
+import os
+
+def post_worker_init(worker):
+    # Runs once per worker after the Django app is loaded: warm the retriever so the
+    # first chat request does not pay for client construction (and a broken database
+    # shows up in readiness before traffic arrives).
+    if os.getenv("RETRIEVER_WARMUP", "true").lower() == "false":
+        return
+    from compliance.retriever import warmup
+    report = warmup()
+    worker.log.info("Retriever warmup: ready=%s error=%s", report["ready"], report["error"])